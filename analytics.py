@@ -0,0 +1,114 @@
+import weakref
+
+import numpy as np
+
+
+def estimated_1rm(weights: np.ndarray, reps: np.ndarray) -> np.ndarray:
+    # Epley; a single is its own 1RM and a zero-rep set estimates nothing.
+    e1rm = weights * (1.0 + reps / 30.0)
+    e1rm = np.where(reps == 1, weights, e1rm)
+    return np.where(reps > 0, e1rm, 0.0)
+
+
+WEEK = 7 * 24 * 60 * 60
+# The epoch fell on a Thursday; weeks start on Monday (UTC).
+WEEK_OFFSET = 4 * 24 * 60 * 60
+
+
+def weekly_volume(timestamps: np.ndarray, volume: np.ndarray) -> list:
+    # Sets without a timestamp (NaN) cannot be placed in a week and are skipped.
+    timed = ~np.isnan(timestamps)
+    if not timed.any():
+        return []
+    weeks = np.floor((timestamps[timed] - WEEK_OFFSET) / WEEK).astype(np.int64)
+    starts, index = np.unique(weeks, return_inverse=True)
+    totals = np.bincount(index, weights=volume[timed])
+    return [{'week_start': float(w * WEEK + WEEK_OFFSET), 'volume': float(v)} for w, v in zip(starts, totals)]
+
+
+def downsample_max(values: np.ndarray, points: int) -> list:
+    if len(values) <= points:
+        return values.tolist()
+    edges = np.linspace(0, len(values), points, endpoint=False).astype(np.int64)
+    return np.maximum.reduceat(values, edges).tolist()
+
+
+class ExerciseSeries:
+    # Columnar copy of one Exercise's set history. Appends are folded in
+    # incrementally; edits and removals (tracked by Exercise.rewrites) rebuild.
+    def __init__(self):
+        self.size = 0
+        self.weights = np.empty(0, dtype=np.float64)
+        self.reps = np.empty(0, dtype=np.int32)
+        self.e1rm = np.empty(0, dtype=np.float64)
+        self.best_e1rm = np.empty(0, dtype=np.float64)
+        self.volume = np.empty(0, dtype=np.float64)
+        self.is_pr = np.empty(0, dtype=bool)
+        self.timestamps = np.empty(0, dtype=np.float64)
+        self._source = None
+        self._rewrites = -1
+
+    def sync(self, exercise) -> None:
+        count = exercise.count_sets()
+        source = self._source() if self._source is not None else None
+        if source is not exercise or exercise.rewrites != self._rewrites or count < self.size:
+            self._source = weakref.ref(exercise)
+            self._rewrites = exercise.rewrites
+            self.size = 0
+            self._append(exercise.sets_view())
+        elif count > self.size:
+            self._append(exercise.recent_sets(count - self.size))
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self.weights)
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity, 64)
+        for name in ('weights', 'reps', 'e1rm', 'best_e1rm', 'volume', 'is_pr', 'timestamps'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _append(self, sets) -> None:
+        n = len(sets)
+        if not n:
+            return
+        start, end = self.size, self.size + n
+        self._grow(end)
+        weights = np.fromiter((s.weight for s in sets), dtype=np.float64, count=n)
+        reps = np.fromiter((s.reps for s in sets), dtype=np.int32, count=n)
+        timestamps = np.fromiter((np.nan if s.timestamp is None else s.timestamp for s in sets),
+                                 dtype=np.float64, count=n)
+        e1rm = estimated_1rm(weights, reps)
+        prev_best = self.best_e1rm[start - 1] if start else 0.0
+        best = np.maximum.accumulate(np.concatenate(([prev_best], e1rm)))
+        self.weights[start:end] = weights
+        self.reps[start:end] = reps
+        self.e1rm[start:end] = e1rm
+        self.best_e1rm[start:end] = best[1:]
+        self.volume[start:end] = weights * reps
+        self.is_pr[start:end] = e1rm > best[:-1]
+        self.timestamps[start:end] = timestamps
+        self.size = end
+
+    def summary(self, rep_min: int, rep_max: int, points: int = 100) -> dict:
+        n = self.size
+        reps = self.reps[:n]
+        volume = self.volume[:n]
+        pr_index = np.flatnonzero(self.is_pr[:n])
+        in_range = np.count_nonzero((reps >= rep_min) & (reps <= rep_max))
+        return {
+            'set_count': n,
+            'total_volume': float(volume.sum()),
+            'best_e1rm': float(self.best_e1rm[n - 1]) if n else 0.0,
+            'rep_range_adherence': float(in_range) / n if n else 0.0,
+            'personal_records': [
+                {'index': int(i), 'weight': float(self.weights[i]), 'reps': int(self.reps[i]),
+                 'e1rm': float(self.e1rm[i])}
+                for i in pr_index
+            ],
+            'e1rm_curve': downsample_max(self.e1rm[:n], points),
+            'best_e1rm_curve': downsample_max(self.best_e1rm[:n], points),
+            'weekly_volume': weekly_volume(self.timestamps[:n], volume),
+        }
@@ -1,89 +1,196 @@
+import time
+# Startup phases in seconds, reported once the server is up.
+STARTUP_TIMINGS = {}
+_startup_clock = time.perf_counter()
+
 import gradio as gr
-from training import Training
+from training import TrainingPool
+from collections import OrderedDict
+import atexit
+import inspect
+import instrumentation
 import os
+import signal
+import threading
+
+# Rendered views keyed by what they show, stamped with Training.version() of
+# the data they were built from. Unchanged views are served from here.
+# Handlers run on worker threads; _render_cache_lock guards every access, and
+# views are built outside it.
+RENDER_CACHE_SIZE = 256
+_render_cache = OrderedDict()
+_render_cache_lock = threading.Lock()
+
+# Views show a bounded window of the newest sets so payloads stay the same
+# size however long the history grows; older pages are fetched on demand.
+HISTORY_PAGE_SIZE = 20
+OVERVIEW_SETS_PER_EXERCISE = 5
+SEARCH_RESULTS = 20
+# Undo steps kept per open store (0 turns the history buttons off).
+UNDO_STEPS = int(os.environ.get('WORKOUT_UNDO_STEPS', 200))
+
+def cached_render(key, version, build):
+    with _render_cache_lock:
+        hit = _render_cache.get(key)
+        if hit is not None and hit[0] == version:
+            _render_cache.move_to_end(key)
+            return hit[1]
+    value = build()
+    with _render_cache_lock:
+        # A build that raced with a newer one does not replace its result.
+        current = _render_cache.get(key)
+        if current is None or current[0] <= version:
+            _render_cache[key] = (version, value)
+        _render_cache.move_to_end(key)
+        while len(_render_cache) > RENDER_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+    return value
 
 def get_program_choices(training):
-    programs = training.list_programs()
+    programs = cached_render(('programs', id(training)), training.version(),
+                             lambda: [(p['name'], p['id']) for p in training.list_programs()])
     if not programs:
         return [], None
-    return [(p['name'], p['id']) for p in programs], programs[0]['id']
+    return programs, programs[0][1]
 
 def get_exercise_choices(training, program_id):
     if not program_id:
         return [], None
     try:
-        exercises = training.list_exercises(program_id)
+        exercises = cached_render(('exercises', program_id), training.version(program_id),
+                                  lambda: [(e['name'], e['id']) for e in training.list_exercise_summaries(program_id)])
     except KeyError:
         return [], None
         
     if not exercises:
         return [], None
-    return [(e['name'], e['id']) for e in exercises], exercises[0]['id']
+    return exercises, exercises[0][1]
+
+def history_window(training, program_id, exercise_id, page, total):
+    last_page = max(0, (total - 1) // HISTORY_PAGE_SIZE)
+    page = min(max(0, int(page or 0)), last_page)
+    sets = training.get_last_sets(program_id, exercise_id, HISTORY_PAGE_SIZE, skip=page * HISTORY_PAGE_SIZE)
+    first = total - page * HISTORY_PAGE_SIZE - len(sets)
+    return sets, first, page
+
+@instrumentation.timed
+def render_program(training, program_id):
+    p = training.get_program_summary(program_id)
+    exercises = training.list_exercise_summaries(program_id)
+    lines = [f"Program: {p['name']}"]
+    if not exercises:
+        lines.append("  (No exercises.)")
+        return "\n".join(lines), []
+
+    for e in exercises:
+        lines.append(f"\n  Exercise: {e['name']} (Reps: {e['rep_min']}-{e['rep_max']})")
+        if not e['set_count']:
+            lines.append("    (No sets recorded)")
+        sets = training.get_last_sets(program_id, e['id'], OVERVIEW_SETS_PER_EXERCISE)
+        first = e['set_count'] - len(sets)
+        if first:
+            lines.append(f"    ({first} earlier sets)")
+        for i, s in enumerate(sets, start=first):
+            lines.append(f"    Set {i+1}: {s['weight']} lbs x {s['reps']} reps")
+    return "\n".join(lines), [(e['name'], e['id']) for e in exercises]
 
 def display_program(training, program_id):
     if not program_id:
         return "No program selected.", gr.update(choices=[], value=None)
     try:
-        p = training.get_program(program_id)
+        out, exercises = cached_render(('program', program_id), training.version(program_id),
+                                       lambda: render_program(training, program_id))
     except Exception:
         return "No program selected.", gr.update(choices=[], value=None)
-    
-    out = f"Program: {p['name']}\n"
-    if not p['exercises']:
-        out += "  (No exercises.)"
-        return out, gr.update(choices=[], value=None)
-    
-    for e in p['exercises']:
-        out += f"\n  Exercise: {e['name']} (Reps: {e['rep_min']}-{e['rep_max']})"
-        if not e['sets']:
-            out += "\n    (No sets recorded)"
-        for i, s in enumerate(e['sets']):
-            out += f"\n    Set {i+1}: {s['weight']} lbs x {s['reps']} reps"
-            
-    exercises = [(e['name'], e['id']) for e in p['exercises']]
+
     ex_id = exercises[0][1] if exercises else None
     return out, gr.update(choices=exercises, value=ex_id)
 
-def display_exercise(training, program_id, exercise_id):
+@instrumentation.timed
+def render_exercise(training, program_id, exercise_id, page):
+    try:
+        e = training.get_exercise(program_id, exercise_id)
+    except KeyError:
+        if program_id not in training.programs:
+            raise
+        return None
+    sets, first, page = history_window(training, program_id, exercise_id, page, e['set_count'])
+
+    lines = [f"{e['name']} (Reps: {e['rep_min']}-{e['rep_max']})"]
+    if not sets:
+        lines.append("  No sets recorded yet.")
+    elif len(sets) < e['set_count']:
+        lines.append(f"  Sets {first+1}-{first+len(sets)} of {e['set_count']} (page {page+1})")
+    for i, s in enumerate(sets, start=first):
+        line = f"  Set {i+1}: {s['weight']} lbs x {s['reps']} reps"
+        if s.get('timestamp') is not None:
+            line += f" ({time.strftime('%Y-%m-%d %H:%M', time.localtime(s['timestamp']))})"
+        lines.append(line)
+    return "\n".join(lines), training.get_suggested_weight(program_id, exercise_id)
+
+def display_exercise(training, program_id, exercise_id, page=0):
     if not (program_id and exercise_id):
         return "No exercise selected.", 0.0
     try:
-        exs = training.list_exercises(program_id)
-        matches = [e for e in exs if e['id']==exercise_id]
-        if not matches:
-             return "Exercise not found.", 0.0
-        e = matches[0]
+        rendered = cached_render(('exercise', program_id, exercise_id, page), training.version(program_id, exercise_id),
+                                 lambda: render_exercise(training, program_id, exercise_id, page))
     except Exception:
         return "No exercise selected.", 0.0
-        
-    out = f"{e['name']} (Reps: {e['rep_min']}-{e['rep_max']})"
-    sets = e['sets']
-    if not sets:
-        out += "\n  No sets recorded yet."
-    else:
-        for i, s in enumerate(sets):
-            out += f"\n  Set {i+1}: {s['weight']} lbs x {s['reps']} reps"
-            
-    suggested = training.get_suggested_weight(program_id, exercise_id)
-    return out, suggested
+    if rendered is None:
+        return "Exercise not found.", 0.0
+    return rendered
+
+def set_dropdown_update(training, prog_id, ex_id, page=0, selected=None):
+    set_choices, set_id = set_options(training, prog_id, ex_id, page)
+    if selected is not None and any(value == selected for _, value in set_choices):
+        set_id = selected
+    return gr.update(choices=set_choices, value=set_id)
+
+# Each user action is a single handler returning every output it affects, in
+# the orders below. Dropdowns listen to .input (user selections only), so the
+# updates a handler returns never trigger further handlers.
+def exercise_outputs(training, prog_id, ex_id):
+    # ex_disp, suggested weight, weight_in, reps_in, set_dropdown, history_page
+    if not ex_id:
+        return "", 0.0, gr.update(value=0.0), gr.update(value=0), gr.update(choices=[], value=None), 0
+    ex_disp, sugg = display_exercise(training, prog_id, ex_id)
+    return ex_disp, sugg, gr.update(value=sugg), gr.update(value=0), set_dropdown_update(training, prog_id, ex_id), 0
+
+def program_outputs(training, prog_id, ex_id=None):
+    # prog_disp, ex_dropdown, then exercise_outputs for ex_id (default: its
+    # first exercise)
+    if not prog_id:
+        return ("", gr.update(choices=[], value=None)) + exercise_outputs(training, prog_id, None)
+    display, exercise_dropdown = display_program(training, prog_id)
+    if ex_id is not None:
+        exercise_dropdown['value'] = ex_id
+    return (display, exercise_dropdown) + exercise_outputs(training, prog_id, exercise_dropdown['value'])
 
 def create_program_fn(training, prog_name):
     if not prog_name.strip():
-        return gr.update(choices=[], value=None), "Enter a name.", "", gr.update(choices=[], value=None), "", 0.0
+        return (gr.update(), "Enter a name.") + (gr.update(),) * 8
     pid = training.create_program(prog_name)
-    programs, select_id = get_program_choices(training)
-    display, exercises = display_program(training, pid)
-    return gr.update(choices=programs, value=pid), "", display, gr.update(choices=[], value=None), "", 0.0
+    programs, _ = get_program_choices(training)
+    return (gr.update(choices=programs, value=pid), "") + program_outputs(training, pid)
+
+def clone_program_fn(training, prog_id, prog_name):
+    # Same exercises, no sets; named from the new-program box if filled in.
+    if not prog_id:
+        return (gr.update(), "Select a program to clone.") + (gr.update(),) * 8
+    pid = training.clone_program(prog_id, prog_name.strip() or None)
+    programs, _ = get_program_choices(training)
+    return (gr.update(choices=programs, value=pid), "") + program_outputs(training, pid)
 
 def rename_program_fn(training, prog_id, new_name):
     if not new_name.strip():
-        return "", gr.update()
+        return gr.update(), "", gr.update()
     try:
         training.rename_program(prog_id, new_name)
+        programs, _ = get_program_choices(training)
         display, _ = display_program(training, prog_id)
-        return display, gr.update(value="")
+        return gr.update(choices=programs, value=prog_id), display, gr.update(value="")
     except Exception as e:
-        return f"Error: {str(e)}", gr.update()
+        return gr.update(), f"Error: {str(e)}", gr.update()
 
 def delete_program_fn(training, prog_id):
     try:
@@ -91,121 +198,251 @@ def delete_program_fn(training, prog_id):
     except Exception:
         pass
     programs, select_id = get_program_choices(training)
-    if select_id:
-        display, exercises = display_program(training, select_id)
-        ex_disp = "" # Clear exercise display
-        return gr.update(choices=programs, value=select_id), "", display, exercises, ex_disp, 0.0
-    else:
-        return gr.update(choices=[], value=None), "", "", gr.update(choices=[], value=None), "", 0.0
+    return (gr.update(choices=programs, value=select_id), "") + program_outputs(training, select_id)
 
 def select_program_fn(training, prog_id):
-    display, exercise_dropdown = display_program(training, prog_id)
-    if exercise_dropdown['choices']:
-        ex_id = exercise_dropdown['value']
-        ex_disp, sugg = display_exercise(training, prog_id, ex_id)
-    else:
-        ex_id = None
-        ex_disp = ""
-        sugg = 0.0
-    exercises, _ = get_exercise_choices(training, prog_id)
-    return display, gr.update(choices=exercises, value=ex_id), ex_disp, sugg
+    return program_outputs(training, prog_id)
 
 def add_exercise_fn(training, prog_id, ex_name, rep_min, rep_max):
     if not (prog_id and ex_name.strip()):
-        return "", "", gr.update(), 0.0
+        return (gr.update(),) * 8
     if rep_min > rep_max:
         rep_min, rep_max = rep_max, rep_min
     eid = training.add_exercise(prog_id, ex_name, rep_min, rep_max)
-    display, exercise_dropdown = display_program(training, prog_id)
-    exercises, exid = get_exercise_choices(training, prog_id)
-    ex_disp, sugg = display_exercise(training, prog_id, eid)
-    return display, ex_disp, gr.update(choices=exercises, value=eid), sugg
+    display, _ = display_program(training, prog_id)
+    exercises, _ = get_exercise_choices(training, prog_id)
+    return (display, gr.update(choices=exercises, value=eid)) + exercise_outputs(training, prog_id, eid)
 
 def rename_exercise_fn(training, prog_id, ex_id, new_ex_name):
     if not (prog_id and ex_id and new_ex_name.strip()):
-        return "", gr.update(value="")
+        return gr.update(), gr.update(), gr.update(), gr.update(value="")
     try:
         training.rename_exercise(prog_id, ex_id, new_ex_name)
-        ex_disp, sugg = display_exercise(training, prog_id, ex_id)
-        display, _ = display_program(training, prog_id) 
-        return display, ex_disp, gr.update(value="")
+        ex_disp, _ = display_exercise(training, prog_id, ex_id)
+        display, _ = display_program(training, prog_id)
+        exercises, _ = get_exercise_choices(training, prog_id)
+        return display, gr.update(choices=exercises, value=ex_id), ex_disp, gr.update(value="")
     except Exception as e:
-        return "", f"Error: {str(e)}", gr.update()
+        return gr.update(), gr.update(), f"Error: {str(e)}", gr.update()
 
 def delete_exercise_fn(training, prog_id, ex_id):
     try:
         training.remove_exercise(prog_id, ex_id)
     except Exception:
         pass
-    display, exercise_dropdown = display_program(training, prog_id)
-    exercises, exid = get_exercise_choices(training, prog_id)
-    if exercises:
-        ex_id_new = exercises[0][1]
-        ex_disp, sugg = display_exercise(training, prog_id, ex_id_new)
-    else:
-        ex_disp, sugg = "", 0.0
-        exid = None
-    return display, ex_disp, gr.update(choices=exercises, value=exid), sugg
+    return program_outputs(training, prog_id)
 
 def select_exercise_fn(training, prog_id, ex_id):
-    ex_disp, sugg = display_exercise(training, prog_id, ex_id)
-    return ex_disp, sugg, gr.update(value=sugg), gr.update(value=0)
+    return exercise_outputs(training, prog_id, ex_id)
+
+def search_fn(training, query):
+    # Matches are keyed "program_id" or "program_id/exercise_id".
+    if not query.strip():
+        return gr.update(choices=[], value=None)
+    choices = []
+    for r in training.search(query, SEARCH_RESULTS):
+        if r['type'] == 'program':
+            choices.append((f"Program: {r['name']}", r['id']))
+        else:
+            choices.append((f"{r['name']} ({r['program_name']})", f"{r['program_id']}/{r['id']}"))
+    return gr.update(choices=choices, value=None)
+
+def open_search_result_fn(training, result):
+    # prog_dropdown, then program_outputs with the match selected
+    prog_id, _, ex_id = (result or "").partition('/')
+    if prog_id not in training.programs:
+        return (gr.update(),) * 9
+    programs, _ = get_program_choices(training)
+    return (gr.update(choices=programs, value=prog_id),) + program_outputs(training, prog_id, ex_id or None)
+
+def history_outputs(training, prog_id):
+    # prog_dropdown, program_outputs, snapshot_dropdown after the store moved
+    # through its history; stays on prog_id if it still exists.
+    programs, first_id = get_program_choices(training)
+    if prog_id not in training.programs:
+        prog_id = first_id
+    return ((gr.update(choices=programs, value=prog_id),) + program_outputs(training, prog_id) +
+            (gr.update(choices=training.history()['snapshots'], value=None),))
+
+def undo_fn(training, prog_id):
+    training.undo()
+    return history_outputs(training, prog_id)
+
+def redo_fn(training, prog_id):
+    training.redo()
+    return history_outputs(training, prog_id)
+
+def save_snapshot_fn(training, name):
+    # snapshot_dropdown, snapshot_name_in
+    if not (training.undo_limit and name.strip()):
+        return gr.update(), gr.update()
+    training.snapshot(name.strip())
+    return gr.update(choices=training.history()['snapshots'], value=name.strip()), ""
+
+def restore_snapshot_fn(training, prog_id, name):
+    if name:
+        try:
+            training.restore_snapshot(name)
+        except KeyError:
+            pass
+    return history_outputs(training, prog_id)
+
+def history_controls_fn(training):
+    # history_row, snapshot_dropdown
+    if not training.undo_limit:
+        return gr.update(visible=False), gr.update()
+    return gr.update(visible=True), gr.update(choices=training.history()['snapshots'], value=None)
+
+def startup_payload(training):
+    # prog_dropdown, program_outputs for the first program, cleared inputs
+    programs, prog_id = get_program_choices(training)
+    return (gr.update(choices=programs, value=prog_id),) + program_outputs(training, prog_id) + ("", "", "", "")
+
+def startup_populate(training):
+    # Every page load shows the same view until the store changes, so the
+    # payload is cached on the store-wide version (copied: Gradio may alter
+    # the update dicts it is given).
+    payload = cached_render(('startup', training.data_file), training.data_version(),
+                            lambda: startup_payload(training))
+    return tuple(dict(u) if isinstance(u, dict) else u for u in payload)
+
+def startup_phase(name, start):
+    STARTUP_TIMINGS[name] = time.perf_counter() - start
+    return time.perf_counter()
+
+def warm_start():
+    # Opens the shared store and renders its first page, so the first
+    # visitor after a restart finds both ready.
+    start = time.perf_counter()
+    with pool.session(None) as training:
+        start = startup_phase('store', start)
+        startup_populate(training)
+        startup_phase('first_page', start)
+
+def report_startup():
+    for name, seconds in STARTUP_TIMINGS.items():
+        instrumentation.observe('startup.' + name, seconds)
+    print("Startup: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in STARTUP_TIMINGS.items()))
 
 def rep_options():
     return list(range(1, 26))
 
-def set_options(training, prog_id, ex_id):
+@instrumentation.timed
+def render_set_choices(training, prog_id, ex_id, page):
+    total = training.get_exercise(prog_id, ex_id)['set_count']
+    sets, first, _ = history_window(training, prog_id, ex_id, page, total)
+    return [(f"Set {i+1}: {s['weight']}x{s['reps']}", s['id']) for i, s in enumerate(sets, start=first)]
+
+def set_options(training, prog_id, ex_id, page=0):
     if not (prog_id and ex_id):
         return [], None
     try:
-        exs = training.list_exercises(prog_id)
-        matches = [e for e in exs if e['id']==ex_id]
-        if not matches:
-            return [], None
-        e = matches[0]
-        set_choices = [ (f"Set {i+1}: {s['weight']}x{s['reps']}", s['id']) for i, s in enumerate(e['sets'])]
+        set_choices = cached_render(('sets', prog_id, ex_id, page), training.version(prog_id, ex_id),
+                                    lambda: render_set_choices(training, prog_id, ex_id, page))
         return set_choices, set_choices[-1][1] if set_choices else None
     except Exception:
         return [], None
 
+def page_history_fn(training, prog_id, ex_id, page, delta):
+    if not (prog_id and ex_id):
+        return "No exercise selected.", gr.update(choices=[], value=None), 0
+    try:
+        total = training.get_exercise(prog_id, ex_id)['set_count']
+    except KeyError:
+        return "Exercise not found.", gr.update(choices=[], value=None), 0
+    last_page = max(0, (total - 1) // HISTORY_PAGE_SIZE)
+    page = min(max(0, int(page or 0) + delta), last_page)
+    ex_disp, _ = display_exercise(training, prog_id, ex_id, page)
+    set_choices, set_id = set_options(training, prog_id, ex_id, page)
+    return ex_disp, gr.update(choices=set_choices, value=set_id), page
+
+def older_sets_fn(training, prog_id, ex_id, page):
+    return page_history_fn(training, prog_id, ex_id, page, 1)
+
+def newer_sets_fn(training, prog_id, ex_id, page):
+    return page_history_fn(training, prog_id, ex_id, page, -1)
+
 def add_set_fn(training, prog_id, ex_id, weight, reps):
+    # prog_disp, ex_disp, suggested weight, set_dropdown, history_page
     if not (prog_id and ex_id):
-        return "", "", 0.0
+        return "", "", 0.0, gr.update(), 0
     try:
-        set_id = training.add_set(prog_id, ex_id, float(weight), int(reps))
+        training.add_set(prog_id, ex_id, float(weight), int(reps))
         ex_disp, sugg = display_exercise(training, prog_id, ex_id)
         prog_disp, _ = display_program(training, prog_id)
-        return prog_disp, ex_disp, sugg
+        return prog_disp, ex_disp, sugg, set_dropdown_update(training, prog_id, ex_id), 0
     except Exception as e:
-        return f"Error: {str(e)}", "", 0.0
+        return f"Error: {str(e)}", "", 0.0, gr.update(), 0
 
-def edit_set_fn(training, prog_id, ex_id, set_id, weight, reps):
+def edit_set_fn(training, prog_id, ex_id, set_id, weight, reps, page=0):
+    # prog_disp, ex_disp, suggested weight, set_dropdown
     if not (prog_id and ex_id and set_id):
-        return "", "", 0.0
+        return "", "", 0.0, gr.update()
     try:
         training.edit_set(prog_id, ex_id, set_id, float(weight), int(reps))
-        ex_disp, sugg = display_exercise(training, prog_id, ex_id)
+        ex_disp, sugg = display_exercise(training, prog_id, ex_id, page)
         prog_disp, _ = display_program(training, prog_id)
-        return prog_disp, ex_disp, sugg
+        return prog_disp, ex_disp, sugg, set_dropdown_update(training, prog_id, ex_id, page, selected=set_id)
     except Exception as e:
-        return f"Error: {str(e)}", "", 0.0
+        return f"Error: {str(e)}", "", 0.0, gr.update()
 
-def remove_set_fn(training, prog_id, ex_id, set_id):
+def remove_set_fn(training, prog_id, ex_id, set_id, page=0):
     if not (prog_id and ex_id and set_id):
-        return "", "", 0.0
+        return "", "", 0.0, gr.update()
     try:
         training.remove_set(prog_id, ex_id, set_id)
-        ex_disp, sugg = display_exercise(training, prog_id, ex_id)
+        ex_disp, sugg = display_exercise(training, prog_id, ex_id, page)
         prog_disp, _ = display_program(training, prog_id)
-        return prog_disp, ex_disp, sugg
+        return prog_disp, ex_disp, sugg, set_dropdown_update(training, prog_id, ex_id, page)
     except Exception as e:
-        return f"Error: {str(e)}", "", 0.0
+        return f"Error: {str(e)}", "", 0.0, gr.update()
 
 ### App Initialization
-training = Training(data_file='workout_data.json')
+# Signed-in users each get their own store; anonymous visitors share the
+# original single-user workout_data.json. Undo history belongs to a store, so
+# the shared one keeps none: one visitor's undo would revert another's work.
+pool = TrainingPool(data_dir='user_data', max_open=int(os.environ.get('WORKOUT_MAX_OPEN_USERS', 32)),
+                    idle_timeout=600, default_file='workout_data.json', lazy=True, background=True,
+                    undo_limit=UNDO_STEPS, shared_kwargs={'undo_limit': 0})
+# Handlers return before their writes reach disk; make them durable on exit.
+atexit.register(pool.close)
+# Off unless WORKOUT_INSTRUMENT names a sink: memory, log[:min_ms] or
+# prometheus[:port] (metrics at http://127.0.0.1:port/).
+instrumentation.configure(os.environ.get('WORKOUT_INSTRUMENT'))
+
+def tenant(fn):
+    # Wraps fn(training, *inputs) as a Gradio handler that runs against the
+    # requesting user's store. Gradio injects the request by annotation. Each
+    # run is a handler.<name> span and can be the one profile_next() captures.
+    params = [p.replace(default=inspect.Parameter.empty)
+              for p in list(inspect.signature(fn).parameters.values())[1:]]
+    params.append(inspect.Parameter('request', inspect.Parameter.POSITIONAL_OR_KEYWORD))
+
+    def handler(*args):
+        *inputs, request = args
+        with pool.session(getattr(request, 'username', None) or None) as training:
+            return fn(training, *inputs)
+    handler = instrumentation.timed(handler, 'handler.' + fn.__name__, profile=True)
+    handler.__signature__ = inspect.Signature(params)
+    handler.__annotations__ = {'request': gr.Request}
+    return handler
+
+_startup_clock = startup_phase('imports', _startup_clock)
 
 with gr.Blocks(title="Workout Program Manager") as demo:
     gr.Markdown("## Workout Program Manager\nCreate programs, add exercises, and track your sets. Data is saved automatically.")
+
+    with gr.Row():
+        search_in = gr.Textbox(label="Search", placeholder="Find a program or exercise...")
+        search_results = gr.Dropdown(label="Matches", choices=[], interactive=True)
+    # Shown on load for stores that keep undo history.
+    with gr.Row(visible=False) as history_row:
+        undo_btn = gr.Button("Undo")
+        redo_btn = gr.Button("Redo")
+        snapshot_name_in = gr.Textbox(show_label=False, placeholder="Snapshot name...", container=False)
+        save_snapshot_btn = gr.Button("Save Snapshot")
+        snapshot_dropdown = gr.Dropdown(show_label=False, choices=[], interactive=True, container=False)
+        restore_snapshot_btn = gr.Button("Restore")
     
     with gr.Row():
         # Program mgmt
@@ -215,6 +452,7 @@ with gr.Blocks(title="Workout Program Manager") as demo:
             prog_name_in = gr.Textbox(label="New Program Name", placeholder="e.g. Strength A")
             with gr.Row():
                 create_prog_btn = gr.Button("Create", variant="primary")
+                clone_prog_btn = gr.Button("Clone")
                 delete_prog_btn = gr.Button("Delete")
             with gr.Row():
                 rename_prog_in = gr.Textbox(show_label=False, placeholder="Rename current program...", container=False)
@@ -236,6 +474,10 @@ with gr.Blocks(title="Workout Program Manager") as demo:
                  rename_ex_in = gr.Textbox(show_label=False, placeholder="Rename current exercise...", container=False)
                  rename_ex_btn = gr.Button("Rename")
             ex_disp = gr.Textbox(label="Exercise History", lines=10, interactive=False)
+            with gr.Row():
+                older_btn = gr.Button("< Older sets")
+                newer_btn = gr.Button("Newer sets >")
+            history_page = gr.State(0)
             
         # Set mgmt
         with gr.Column(scale=1):
@@ -250,92 +492,108 @@ with gr.Blocks(title="Workout Program Manager") as demo:
                 edit_set_btn = gr.Button("Update Set")
                 remove_set_btn = gr.Button("Delete Set")
 
-    # Initial Population
-    def startup_populate():
-        programs, prog_id = get_program_choices(training)
-        exercises, ex_id = get_exercise_choices(training, prog_id)
-        
-        prog_disp_str = ""
-        ex_disp_str = ""
-        sugg = 0.0
-        
-        if prog_id:
-            prog_disp_str, _ = display_program(training, prog_id)
-            if ex_id:
-                ex_disp_str, sugg = display_exercise(training, prog_id, ex_id)
-        
-        set_choices, set_id = set_options(training, prog_id, ex_id)
-        
-        return (gr.update(choices=programs, value=prog_id),           
-                gr.update(choices=exercises, value=ex_id),            
-                prog_disp_str,                                        
-                ex_disp_str,                                          
-                gr.update(choices=set_choices, value=set_id),         
-                sugg,                                                 
-                sugg, # pre-fill weight with suggestion
-                0,                                                    
-                "", "", "", "")
-
-    demo.load(startup_populate, outputs=[prog_dropdown, ex_dropdown, prog_disp, ex_disp, set_dropdown, suggested_weight_box, weight_in, reps_in, prog_name_in, rename_prog_in, ex_name_in, rename_ex_in])
-
-    # Event Handlers
-    create_prog_btn.click(fn=lambda prog_name: create_program_fn(training, prog_name),
-                         inputs=[prog_name_in],
-                         outputs=[prog_dropdown, prog_name_in, prog_disp, ex_dropdown, ex_disp, suggested_weight_box])
-    
-    rename_prog_btn.click(lambda pid, newname: rename_program_fn(training, pid, newname),
-                         inputs=[prog_dropdown, rename_prog_in],
-                         outputs=[prog_disp, rename_prog_in])
-    
-    delete_prog_btn.click(lambda pid: delete_program_fn(training, pid),
-                         inputs=[prog_dropdown],
-                         outputs=[prog_dropdown, prog_name_in, prog_disp, ex_dropdown, ex_disp, suggested_weight_box])
-    
-    prog_dropdown.change(lambda pid: select_program_fn(training, pid),
-                         inputs=[prog_dropdown],
-                         outputs=[prog_disp, ex_dropdown, ex_disp, suggested_weight_box])
+    # Event graph: one handler per user action (see `python benchmark.py ui`).
+    program_view = [prog_disp, ex_dropdown, ex_disp, suggested_weight_box, weight_in, reps_in, set_dropdown, history_page]
+    exercise_view = [ex_disp, suggested_weight_box, weight_in, reps_in, set_dropdown, history_page]
 
-    add_ex_btn.click(lambda prog_id, ex_name, rmin, rmax: add_exercise_fn(training, prog_id, ex_name, rmin, rmax),
-                    inputs=[prog_dropdown, ex_name_in, rep_min_dropdown, rep_max_dropdown],
-                    outputs=[prog_disp, ex_disp, ex_dropdown, suggested_weight_box])
-    
-    rename_ex_btn.click(lambda pid, exid, newexname: rename_exercise_fn(training, pid, exid, newexname),
-                      inputs=[prog_dropdown, ex_dropdown, rename_ex_in],
-                      outputs=[prog_disp, ex_disp, rename_ex_in])
-    
-    delete_ex_btn.click(lambda pid, exid: delete_exercise_fn(training, pid, exid),
+    demo.load(tenant(startup_populate),
+              outputs=[prog_dropdown] + program_view + [prog_name_in, rename_prog_in, ex_name_in, rename_ex_in])
+    demo.load(tenant(history_controls_fn), outputs=[history_row, snapshot_dropdown])
+
+    create_prog_btn.click(tenant(create_program_fn),
+                          inputs=[prog_name_in],
+                          outputs=[prog_dropdown, prog_name_in] + program_view)
+
+    rename_prog_btn.click(tenant(rename_program_fn),
+                          inputs=[prog_dropdown, rename_prog_in],
+                          outputs=[prog_dropdown, prog_disp, rename_prog_in])
+
+    delete_prog_btn.click(tenant(delete_program_fn),
+                          inputs=[prog_dropdown],
+                          outputs=[prog_dropdown, prog_name_in] + program_view)
+
+    prog_dropdown.input(tenant(select_program_fn),
+                        inputs=[prog_dropdown],
+                        outputs=program_view)
+
+    add_ex_btn.click(tenant(add_exercise_fn),
+                     inputs=[prog_dropdown, ex_name_in, rep_min_dropdown, rep_max_dropdown],
+                     outputs=[prog_disp, ex_dropdown] + exercise_view)
+
+    rename_ex_btn.click(tenant(rename_exercise_fn),
+                        inputs=[prog_dropdown, ex_dropdown, rename_ex_in],
+                        outputs=[prog_disp, ex_dropdown, ex_disp, rename_ex_in])
+
+    delete_ex_btn.click(tenant(delete_exercise_fn),
+                        inputs=[prog_dropdown, ex_dropdown],
+                        outputs=program_view)
+
+    ex_dropdown.input(tenant(select_exercise_fn),
                       inputs=[prog_dropdown, ex_dropdown],
-                      outputs=[prog_disp, ex_disp, ex_dropdown, suggested_weight_box])
-    
-    ex_dropdown.change(lambda pid, exid: select_exercise_fn(training, pid, exid),
-                     inputs=[prog_dropdown, ex_dropdown],
-                     outputs=[ex_disp, suggested_weight_box, weight_in, reps_in])
+                      outputs=exercise_view)
 
-    def update_set_dropdown(prog_id, ex_id):
-        set_choices, set_id = set_options(training, prog_id, ex_id)
-        return gr.update(choices=set_choices, value=set_id)
+    older_btn.click(tenant(older_sets_fn),
+                    inputs=[prog_dropdown, ex_dropdown, history_page],
+                    outputs=[ex_disp, set_dropdown, history_page])
+    newer_btn.click(tenant(newer_sets_fn),
+                    inputs=[prog_dropdown, ex_dropdown, history_page],
+                    outputs=[ex_disp, set_dropdown, history_page])
 
-    ex_dropdown.change(update_set_dropdown, inputs=[prog_dropdown, ex_dropdown], outputs=[set_dropdown])
+    add_set_btn.click(tenant(add_set_fn),
+                      inputs=[prog_dropdown, ex_dropdown, weight_in, reps_in],
+                      outputs=[prog_disp, ex_disp, suggested_weight_box, set_dropdown, history_page])
 
-    add_set_btn.click(lambda prog_id, ex_id, wt, r: add_set_fn(training, prog_id, ex_id, wt, r),
-                   inputs=[prog_dropdown, ex_dropdown, weight_in, reps_in],
-                   outputs=[prog_disp, ex_disp, suggested_weight_box])
-    
-    # Reload set dropdown after adding/editing sets
-    add_set_btn.click(update_set_dropdown, inputs=[prog_dropdown, ex_dropdown], outputs=[set_dropdown])
-    
-    set_dropdown.change(lambda pid, exid: update_set_dropdown(pid, exid), 
-                      inputs=[prog_dropdown, ex_dropdown], outputs=[set_dropdown])
-    
-    edit_set_btn.click(lambda pid, exid, sid, wt, r: edit_set_fn(training, pid, exid, sid, wt, r),
-                    inputs=[prog_dropdown, ex_dropdown, set_dropdown, weight_in, reps_in],
-                    outputs=[prog_disp, ex_disp, suggested_weight_box])
-    edit_set_btn.click(update_set_dropdown, inputs=[prog_dropdown, ex_dropdown], outputs=[set_dropdown])
+    edit_set_btn.click(tenant(edit_set_fn),
+                       inputs=[prog_dropdown, ex_dropdown, set_dropdown, weight_in, reps_in, history_page],
+                       outputs=[prog_disp, ex_disp, suggested_weight_box, set_dropdown])
+
+    remove_set_btn.click(tenant(remove_set_fn),
+                         inputs=[prog_dropdown, ex_dropdown, set_dropdown, history_page],
+                         outputs=[prog_disp, ex_disp, suggested_weight_box, set_dropdown])
+
+    search_in.input(tenant(search_fn),
+                    inputs=[search_in],
+                    outputs=[search_results],
+                    trigger_mode='always_last')
+
+    search_results.input(tenant(open_search_result_fn),
+                         inputs=[search_results],
+                         outputs=[prog_dropdown] + program_view)
+
+    clone_prog_btn.click(tenant(clone_program_fn),
+                         inputs=[prog_dropdown, prog_name_in],
+                         outputs=[prog_dropdown, prog_name_in] + program_view)
+
+    undo_btn.click(tenant(undo_fn),
+                   inputs=[prog_dropdown],
+                   outputs=[prog_dropdown] + program_view + [snapshot_dropdown])
+    redo_btn.click(tenant(redo_fn),
+                   inputs=[prog_dropdown],
+                   outputs=[prog_dropdown] + program_view + [snapshot_dropdown])
+
+    save_snapshot_btn.click(tenant(save_snapshot_fn),
+                            inputs=[snapshot_name_in],
+                            outputs=[snapshot_dropdown, snapshot_name_in])
+    restore_snapshot_btn.click(tenant(restore_snapshot_fn),
+                               inputs=[prog_dropdown, snapshot_dropdown],
+                               outputs=[prog_dropdown] + program_view + [snapshot_dropdown])
 
-    remove_set_btn.click(lambda pid, exid, sid: remove_set_fn(training, pid, exid, sid),
-                       inputs=[prog_dropdown, ex_dropdown, set_dropdown],
-                       outputs=[prog_disp, ex_disp, suggested_weight_box])
-    remove_set_btn.click(update_set_dropdown, inputs=[prog_dropdown, ex_dropdown], outputs=[set_dropdown])
+startup_phase('ui', _startup_clock)
 
 if __name__ == "__main__":
-    demo.launch()
\ No newline at end of file
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 profiles the next request into WORKOUT_PROFILE_DIR;
+        # kill -USR2 switches instrumentation on and off.
+        signal.signal(signal.SIGUSR1,
+                      lambda *_: instrumentation.profile_next(os.environ.get('WORKOUT_PROFILE_DIR', '.')))
+        signal.signal(signal.SIGUSR2,
+                      lambda *_: instrumentation.disable() if instrumentation.current_sink() else instrumentation.enable())
+    # The store loads while the server starts.
+    warming = threading.Thread(target=warm_start, daemon=True)
+    warming.start()
+    start = time.perf_counter()
+    demo.launch(prevent_thread_lock=True)
+    startup_phase('server', start)
+    warming.join()
+    report_startup()
+    demo.block_thread()
\ No newline at end of file
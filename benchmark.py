@@ -0,0 +1,985 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import bulk
+import instrumentation
+
+from training import (BinaryFileBackend, Exercise, JsonFileBackend, Set, SqliteBackend, Training, json_to_binary,
+                      write_json_array)
+
+
+# Rows recorded by the benchmarks for --json; each is one printed table row.
+RESULTS = []
+
+
+def _record(bench: str, **fields) -> None:
+    RESULTS.append(dict(bench=bench, **fields))
+
+
+def _peak_rss_mb() -> float:
+    # Process high-water mark, so it only grows over a run.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentiles(latencies: list) -> dict:
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1e3
+    return {'p50_ms': pick(0.50), 'p99_ms': pick(0.99), 'mean_ms': sum(ordered) / len(ordered) * 1e3}
+
+
+def _per_op_us(fn, ops: int) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) / ops * 1e6
+
+
+def bench_set_index(sizes=(1_000, 10_000, 100_000, 1_000_000), ops: int = 1_000):
+    print(f"{'sets':>10} {'edit_set us/op':>16} {'remove_set us/op':>18}")
+    for n in sizes:
+        ex = Exercise('Bench Press', 8, 12)
+        # Timestamped, so edits and removals also maintain the time index.
+        ids = [ex.add_set(100.0, 8, timestamp=1_700_000_000.0 + 60 * i) for i in range(n)]
+        # Touch sets from the middle of the history, the worst case for a scan.
+        targets = ids[n // 2:n // 2 + ops]
+
+        def edit():
+            for sid in targets:
+                ex.edit_set(sid, 105.0, 10)
+
+        def remove():
+            for sid in targets:
+                ex.remove_set(sid)
+
+        edit_us = _per_op_us(edit, len(targets))
+        remove_us = _per_op_us(remove, len(targets))
+        print(f"{n:>10} {edit_us:>16.3f} {remove_us:>18.3f}")
+        _record('set_index', sets=n, edit_set_us=edit_us, remove_set_us=remove_us)
+
+
+class _DictSet:
+    # The pre-__slots__ layout of training.Set, kept for comparison.
+    def __init__(self, weight: float, reps: int, set_id: str):
+        self.set_id = set_id
+        self.weight = weight
+        self.reps = reps
+
+
+def _allocated_mb(build) -> float:
+    tracemalloc.start()
+    objs = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objs
+    return current / 2**20
+
+
+def bench_set_memory(sizes=(10_000, 100_000, 1_000_000)):
+    print(f"{'sets':>10} {'__dict__ MB':>12} {'__slots__ MB':>13} {'saved':>7}")
+    for n in sizes:
+        # Same ids for both layouts so only the object overhead differs.
+        ids = [Set(0.0, 0).set_id for _ in range(n)]
+        dict_mb = _allocated_mb(lambda: [_DictSet(100.0, 8, sid) for sid in ids])
+        slots_mb = _allocated_mb(lambda: [Set(100.0, 8, sid) for sid in ids])
+        print(f"{n:>10} {dict_mb:>12.1f} {slots_mb:>13.1f} {1 - slots_mb / dict_mb:>7.0%}")
+        _record('set_memory', sets=n, dict_mb=dict_mb, slots_mb=slots_mb)
+
+
+def _stress(make, threads: int, ops: int, readers: int = 4, archived: int = 200):
+    # Writers log, edit and remove sets and churn scratch programs while
+    # readers list programs, page through sets and ask for suggestions.
+    training = make()
+    with training.batch():
+        for i in range(archived):
+            training.create_program(f'Archived {i}')
+    shared = training.create_program('Shared')
+    shared_ex = training.add_exercise(shared, 'Squat', 3, 5)
+    own = []
+    for i in range(threads):
+        pid = training.create_program(f'Lifter {i}')
+        own.append((pid, training.add_exercise(pid, 'Bench Press', 8, 12)))
+    expected = [[] for _ in range(threads)]
+    errors = []
+    done = threading.Event()
+    reads = [0] * readers
+
+    def worker(i: int):
+        pid, eid = own[i]
+        try:
+            for n in range(ops):
+                sid = training.add_set(pid, eid, float(n), 8)
+                expected[i].append(sid)
+                if n % 5 == 4:
+                    training.edit_set(pid, eid, expected[i][0], 1.0, 1)
+                if n % 7 == 6:
+                    training.remove_set(pid, eid, expected[i].pop(1))
+                if n % 3 == 0:
+                    training.add_set(shared, shared_ex, float(i), n)
+                if n % 10 == 9:
+                    training.delete_program(training.create_program(f'Scratch {i}'))
+        except Exception as e:
+            errors.append(e)
+
+    def reader(i: int):
+        try:
+            while not done.wait(0.001):
+                training.list_programs()
+                pid, eid = own[(i + reads[i]) % threads]
+                training.list_sets(pid, eid, limit=20)
+                training.get_suggested_weight(pid, eid)
+                training.get_suggested_weight(shared, shared_ex)
+                reads[i] += 4
+        except Exception as e:
+            errors.append(e)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    watchers = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    # Frequent thread switches surface unlocked reads that would otherwise
+    # rarely interleave with a write.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        start = time.perf_counter()
+        for t in pool + watchers:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for t in watchers:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    training.compact()
+
+    consistent = not errors
+    for i, (pid, eid) in enumerate(own):
+        consistent = consistent and [s['id'] for s in training.list_sets(pid, eid)] == expected[i]
+    shared_count = sum(1 for i in range(threads) for n in range(ops) if n % 3 == 0)
+    consistent = consistent and len(training.list_sets(shared, shared_ex)) == shared_count
+    reloaded = make()
+    consistent = consistent and all(
+        reloaded.get_program(p['id']) == training.get_program(p['id']) for p in training.list_programs())
+    total = sum(len(e) for e in expected) + shared_count
+    for e in errors:
+        print(f"  {type(e).__name__}: {e}")
+    return total / elapsed, sum(reads) / elapsed, consistent
+
+
+def bench_concurrency(threads: int = 16, ops: int = 100):
+    # Fails (raises) if any backend loses a write, a reader or writer errors,
+    # or the reloaded store differs.
+    print(f"{'backend':>14} {'threads':>8} {'ops/s':>10} {'reads/s':>10} {'consistent':>11}")
+    failed = []
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'json': lambda: Training(os.path.join(tmp, 'full.json')),
+            'json-journal': lambda: Training(os.path.join(tmp, 'journal.json'), journal=True, compact_every=500),
+            'sqlite': lambda: Training(backend=SqliteBackend(os.path.join(tmp, 'data.db'))),
+        }
+        for name, make in backends.items():
+            throughput, read_rate, consistent = _stress(make, threads, ops)
+            print(f"{name:>14} {threads:>8} {throughput:>10.0f} {read_rate:>10.0f} {str(consistent):>11}")
+            _record('concurrency', backend=name, threads=threads, ops_per_s=throughput, reads_per_s=read_rate,
+                    consistent=consistent)
+            if not consistent:
+                failed.append(name)
+    if failed:
+        raise RuntimeError(f"Inconsistent concurrent runs: {', '.join(failed)}")
+
+
+def bench_batch(sets: int = 1_000):
+    print(f"{'backend':>14} {'per-call s':>11} {'batched s':>10} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'json': lambda name: Training(os.path.join(tmp, name + '.json')),
+            'json-journal': lambda name: Training(os.path.join(tmp, name + '.journal.json'), journal=True),
+            'sqlite': lambda name: Training(backend=SqliteBackend(os.path.join(tmp, name + '.db'))),
+        }
+        for name, make in backends.items():
+            timings = []
+            for mode in ('per-call', 'batched'):
+                training = make(mode)
+                pid = training.create_program('Block 1')
+                eid = training.add_exercise(pid, 'Deadlift', 3, 5)
+                start = time.perf_counter()
+                if mode == 'batched':
+                    with training.batch():
+                        for n in range(sets):
+                            training.add_set(pid, eid, 100.0 + n, 5)
+                else:
+                    for n in range(sets):
+                        training.add_set(pid, eid, 100.0 + n, 5)
+                timings.append(time.perf_counter() - start)
+            print(f"{name:>14} {timings[0]:>11.3f} {timings[1]:>10.3f} {timings[0] / timings[1]:>7.0f}x")
+            _record('batch', backend=name, per_call_s=timings[0], batched_s=timings[1])
+
+
+def bench_background(history: int = 20_000, ops: int = 200):
+    # add_set latency as a handler sees it, against a history large enough
+    # that each full JSON snapshot costs real I/O.
+    print(f"{'mode':>12} {'p50 ms':>8} {'p99 ms':>8} {'flush s':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('sync', 'background'):
+            path = os.path.join(tmp, mode + '.json')
+            seed = Training(path)
+            pid = seed.create_program('History')
+            eid = seed.add_exercise(pid, 'Squat', 3, 5)
+            with seed.batch():
+                for n in range(history):
+                    seed.add_set(pid, eid, 100.0, 5)
+            training = Training(path, background=mode == 'background')
+            latencies = []
+            for n in range(ops):
+                start = time.perf_counter()
+                training.add_set(pid, eid, 100.0 + n, 5)
+                latencies.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            training.close()
+            flush_s = time.perf_counter() - start
+            latencies.sort()
+            p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+            print(f"{mode:>12} {p50 * 1e3:>8.2f} {p99 * 1e3:>8.2f} {flush_s:>8.2f}")
+            _record('background', mode=mode, p50_ms=p50 * 1e3, p99_ms=p99 * 1e3, flush_s=flush_s)
+            assert len(Training(path).list_sets(pid, eid)) == history + ops
+
+
+def _ui_jobs(demo, triggers):
+    # The handlers one user action runs: those bound to its triggers, plus the
+    # .change handlers their outputs set off (the browser fires .change on
+    # programmatic updates too). A trigger reached again is a loop and is cut.
+    listened = {target for fn in demo.fns.values() for target in fn.targets}
+    jobs, queue, seen, loops = [], list(triggers), set(triggers), 0
+    while queue:
+        target = queue.pop(0)
+        for fn in demo.fns.values():
+            if target not in fn.targets:
+                continue
+            jobs.append(fn)
+            for out in fn.outputs:
+                cascade = (out._id, 'change')
+                if cascade not in listened:
+                    continue
+                if cascade in seen:
+                    loops += 1
+                else:
+                    seen.add(cascade)
+                    queue.append(cascade)
+    return jobs, loops
+
+
+def _ui_run(jobs, state: dict, request=None) -> None:
+    # Calls each handler in-process the way the server would, feeding inputs
+    # from and writing outputs back to the simulated component values.
+    for fn in jobs:
+        args = [state.get(c._id, getattr(c, 'value', None)) for c in fn.inputs]
+        out = fn.fn(*args, request)
+        if len(fn.outputs) == 1:
+            out = (out,)
+        for comp, value in zip(fn.outputs, out):
+            if isinstance(value, dict):
+                if 'value' in value:
+                    state[comp._id] = value['value']
+            else:
+                state[comp._id] = value
+
+
+def bench_ui(sets: int = 50):
+    # Server calls and in-process latency per UI action, against a scratch
+    # signed-in user's store (the anonymous one keeps no undo history).
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            import app
+            ui = app.demo
+            state = {}
+            request = SimpleNamespace(username='bench')
+
+            def action(name, triggers, inputs=None, repeat=1):
+                for comp, value in (inputs or {}).items():
+                    state[comp._id] = value
+                jobs, loops = _ui_jobs(ui, triggers)
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    _ui_run(jobs, state, request)
+                ms = (time.perf_counter() - start) / repeat * 1e3
+                print(f"{name:>16} {len(jobs):>6} {loops:>6} {ms:>9.2f}")
+                _record('ui', action=name, calls=len(jobs), loops=loops, ms=ms)
+
+            def on(comp, event='click'):
+                return (comp._id, event)
+
+            print(f"{'action':>16} {'calls':>6} {'loops':>6} {'ms/action':>9}")
+            action('page load', [next(t for fn in ui.fns.values() for t in fn.targets if t[1] == 'load')])
+            action('create program', [on(app.create_prog_btn)], {app.prog_name_in: 'Block A'})
+            action('add exercise', [on(app.add_ex_btn)], {app.ex_name_in: 'Squat'})
+            action('log set', [on(app.add_set_btn)], {app.weight_in: 100.0, app.reps_in: 5}, sets)
+            action('older sets', [on(app.older_btn)])
+            action('edit set', [on(app.edit_set_btn)], {app.weight_in: 105.0})
+            action('delete set', [on(app.remove_set_btn)])
+            action('undo', [on(app.undo_btn)])
+            action('redo', [on(app.redo_btn)])
+            # A user selection fires both .input and .change on a dropdown.
+            action('select exercise', [on(app.ex_dropdown, 'input'), on(app.ex_dropdown, 'change')])
+            action('select program', [on(app.prog_dropdown, 'input'), on(app.prog_dropdown, 'change')])
+            action('search', [on(app.search_in, 'input'), on(app.search_in, 'change')], {app.search_in: 'squ'})
+            action('open match', [on(app.search_results, 'input'), on(app.search_results, 'change')],
+                   {app.search_results: state[app.prog_dropdown._id]})
+            action('clone program', [on(app.clone_prog_btn)], {app.prog_name_in: ''})
+            action('delete program', [on(app.delete_prog_btn)])
+            action('delete exercise', [on(app.delete_ex_btn)])
+            action('delete program', [on(app.delete_prog_btn)])
+            app.pool.close()
+        finally:
+            os.chdir(cwd)
+
+
+def _synthetic_programs(f, size_mb: int, exercises: int = 10, sets: int = 2_500):
+    # Yields ~4 MB programs of timestamped sets until the file reaches size_mb.
+    # Ids are deterministic but UUID-shaped, as the binary format requires.
+    def uid(kind: int, n: int, i: int = 0) -> str:
+        return f'{n:08x}-{kind:04x}-4000-8000-{i:012x}'
+
+    n = 0
+    while f.tell() < size_mb * 2**20:
+        yield {
+            'id': uid(0, n),
+            'name': f'Block {n}',
+            'exercises': [{
+                'id': uid(1, n, e),
+                'name': f'Exercise {e}',
+                'rep_min': 5,
+                'rep_max': 8,
+                'sets': [{'id': uid(2 + e, n, i), 'weight': 100.0 + i % 50, 'reps': 5 + i % 4,
+                          'timestamp': 1.7e9 + i * 600.0, 'session_id': uid(0xffff, n, i // 20)}
+                         for i in range(sets)],
+            } for e in range(exercises)],
+        }
+        n += 1
+
+
+def _json_phase(mode: str, path: str, queue) -> None:
+    # Runs in a fresh process so ru_maxrss is this phase's peak alone.
+    timings = []
+    start = time.perf_counter()
+    if mode == 'legacy':
+        with open(path) as f:
+            data = json.load(f)
+        timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        with open(path + '.out', 'w') as f:
+            json.dump(data, f, indent=2)
+    else:
+        training = Training(path, lazy=True, indent=2 if mode == 'stream' else None)
+        timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        training.compact()
+    timings.append(time.perf_counter() - start)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((timings, peak_mb, os.path.getsize(path + '.out' if mode == 'legacy' else path) / 2**20))
+
+
+def bench_json_codec(size_mb: int = 500):
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'history.json')
+        with open(source, 'wb') as f:
+            write_json_array(f, _synthetic_programs(f, size_mb))
+        print(f"synthetic history: {os.path.getsize(source) / 2**20:.0f} MB")
+        print(f"{'codec':>14} {'load s':>8} {'save s':>8} {'peak RSS MB':>12} {'file MB':>8}")
+        for mode in ('legacy', 'stream', 'stream-compact'):
+            path = os.path.join(tmp, mode + '.json')
+            shutil.copy(source, path)
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_json_phase, args=(mode, path, queue))
+            proc.start()
+            proc.join()
+            if proc.exitcode != 0:
+                print(f"{mode:>14} {'failed (exit ' + str(proc.exitcode) + ')':>30}")
+                continue
+            (load_s, save_s), peak_mb, file_mb = queue.get()
+            print(f"{mode:>14} {load_s:>8.1f} {save_s:>8.1f} {peak_mb:>12.0f} {file_mb:>8.0f}")
+            _record('json_codec', codec=mode, load_s=load_s, save_s=save_s, peak_rss_mb=peak_mb, file_mb=file_mb)
+            os.remove(path)
+
+
+def bench_snapshot(size_mb: int = 100):
+    # Few ~4 MB programs, then a tenth of the size as many small ones (where
+    # per-element overhead in the streaming parser would show).
+    print(f"{'shape':>6} {'format':>12} {'open lazy s':>12} {'load s':>8} {'save s':>8} {'file MB':>8}")
+    shapes = {
+        'large': (size_mb, {}),
+        'small': (max(size_mb // 10, 1), {'exercises': 1, 'sets': 2}),
+    }
+    for shape, (mb, sizes) in shapes.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'history.json')
+            with open(source, 'wb') as f:
+                write_json_array(f, _synthetic_programs(f, mb, **sizes))
+            json_to_binary(source, os.path.join(tmp, 'history.wtrn'))
+            formats = {
+                'json': lambda lazy: Training(source, lazy=lazy),
+                'json-compact': lambda lazy: Training(source, lazy=lazy, indent=None),
+                'binary': lambda lazy: Training(backend=BinaryFileBackend(os.path.join(tmp, 'history.wtrn')),
+                                                lazy=lazy),
+            }
+            for name, make in formats.items():
+                # A missing index makes the lazy open scan the whole file.
+                if os.path.exists(source + '.idx'):
+                    os.remove(source + '.idx')
+                start = time.perf_counter()
+                make(True).backend.close()
+                open_s = time.perf_counter() - start
+                start = time.perf_counter()
+                training = make(False)
+                load_s = time.perf_counter() - start
+                start = time.perf_counter()
+                training.compact()
+                save_s = time.perf_counter() - start
+                size = os.path.getsize(training.backend.data_file) / 2**20
+                training.backend.close()
+                del training
+                print(f"{shape:>6} {name:>12} {open_s:>12.3f} {load_s:>8.2f} {save_s:>8.2f} {size:>8.0f}")
+                _record('snapshot', shape=shape, format=name, open_lazy_s=open_s, load_s=load_s, save_s=save_s,
+                        file_mb=size)
+
+
+# Synthetic history sizes: programs x exercises per program x sets per exercise.
+SCALES = {
+    'small': (3, 5, 100),
+    'medium': (5, 8, 1_000),
+    'large': (10, 10, 5_000),
+}
+
+
+def _build_history(path: str, programs: int, exercises: int, sets: int) -> None:
+    training = Training(path)
+    start = time.time() - sets * 600.0
+    with training.batch():
+        for p in range(programs):
+            pid = training.create_program(f'Block {p}')
+            for e in range(exercises):
+                eid = training.add_exercise(pid, f'Exercise {e}', 5, 8)
+                for i in range(sets):
+                    training.add_set(pid, eid, 100.0 + i % 50, 5 + i % 4, timestamp=start + i * 600.0)
+    training.close()
+
+
+def _time_calls(op, calls: int, budget_s: float = 2.0) -> list:
+    # Up to `calls` timed calls, stopping early once the budget is spent so
+    # whole-history operations stay affordable at large scales.
+    latencies = []
+    deadline = time.perf_counter() + budget_s
+    for n in range(calls):
+        start = time.perf_counter()
+        op()
+        latencies.append(time.perf_counter() - start)
+        if n >= 4 and start > deadline:
+            break
+    return latencies
+
+
+def bench_api(scales=('small', 'medium'), calls: int = 200):
+    # Per-call latency of the Training API on synthetic histories. Writes go
+    # through the background writer so the figures are the in-memory cost;
+    # load and save are timed separately.
+    print(f"{'scale':>7} {'op':>20} {'calls':>6} {'p50 ms':>9} {'p99 ms':>9} {'ops/s':>10}")
+    rng = random.Random(0)
+    for scale in scales:
+        programs, exercises, sets = SCALES[scale]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'history.json')
+            _build_history(path, programs, exercises, sets)
+            phases = {}
+            start = time.perf_counter()
+            Training(path, lazy=True).close()
+            phases['open_lazy'] = time.perf_counter() - start
+            start = time.perf_counter()
+            training = Training(path)
+            phases['load'] = time.perf_counter() - start
+            start = time.perf_counter()
+            training.compact()
+            phases['save'] = time.perf_counter() - start
+            training.close()
+
+            training = Training(path, background=True)
+            targets = [(p['id'], e['id']) for p in training.list_programs() for e in training.list_exercises(p['id'])]
+            set_ids = {t: [s['id'] for s in training.get_last_sets(*t, 50)] for t in targets}
+            pick = lambda: rng.choice(targets)
+
+            def edit():
+                pid, eid = pick()
+                training.edit_set(pid, eid, rng.choice(set_ids[(pid, eid)]), 105.0, 6)
+
+            ops = {
+                'add_set': lambda: training.add_set(*pick(), 100.0, 5),
+                'edit_set': edit,
+                'list_exercises': lambda: training.list_exercises(pick()[0]),
+                'get_program': lambda: training.get_program(pick()[0]),
+                'get_last_sets': lambda: training.get_last_sets(*pick(), 20),
+                'get_suggested_weight': lambda: training.get_suggested_weight(*pick()),
+                'get_exercise_stats': lambda: training.get_exercise_stats(*pick()),
+            }
+            for name, op in ops.items():
+                latencies = _time_calls(op, calls)
+                stats = _percentiles(latencies)
+                ops_per_s = len(latencies) / sum(latencies)
+                print(f"{scale:>7} {name:>20} {len(latencies):>6} {stats['p50_ms']:>9.3f} {stats['p99_ms']:>9.3f} "
+                      f"{ops_per_s:>10.0f}")
+                _record('api', scale=scale, op=name, calls=len(latencies), ops_per_s=ops_per_s, **stats)
+            training.close()
+            for name, seconds in phases.items():
+                print(f"{scale:>7} {name:>20} {1:>6} {seconds * 1e3:>9.1f} {seconds * 1e3:>9.1f} {1 / seconds:>10.1f}")
+                _record('api', scale=scale, op=name, calls=1, seconds=seconds)
+            print(f"{scale:>7} {'sets':>20} {programs * exercises * sets:>6}   peak RSS {_peak_rss_mb():.0f} MB")
+            _record('api', scale=scale, op='peak_rss', sets=programs * exercises * sets, peak_rss_mb=_peak_rss_mb())
+
+
+def _load_client(app, handlers: dict, user: str, actions: int, seed: int, latencies: dict) -> None:
+    rng = random.Random(seed)
+    request = SimpleNamespace(username=user)
+
+    def call(name, *args):
+        start = time.perf_counter()
+        out = handlers[name](*args, request)
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+        return out
+
+    pid = call('create_program', f'Block {seed}')[0]['value']
+    eid = call('add_exercise', pid, 'Squat', 5, 8)[1]['value']
+    set_id = None
+    for n in range(actions):
+        r = rng.random()
+        if r < 0.6 or set_id is None:
+            set_id = call('add_set', pid, eid, 100.0 + n % 20, 5)[3]['value']
+        elif r < 0.75:
+            call('edit_set', pid, eid, set_id, 105.0, 5, 0)
+        elif r < 0.85:
+            call('select_exercise', pid, eid)
+        elif r < 0.95:
+            call('older_sets', pid, eid, 0)
+        else:
+            call('select_program', pid)
+
+
+def bench_load(clients: int = 8, actions: int = 100):
+    # Drives the app.py handlers from concurrent clients, each as its own
+    # signed-in user or all as one user, through the same tenant() wrapper and
+    # store pool the Gradio server uses.
+    cwd = os.getcwd()
+    print(f"{'users':>9} {'clients':>8} {'calls':>6} {'calls/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            import app
+            handlers = {
+                'create_program': app.tenant(app.create_program_fn),
+                'add_exercise': app.tenant(app.add_exercise_fn),
+                'add_set': app.tenant(app.add_set_fn),
+                'edit_set': app.tenant(app.edit_set_fn),
+                'select_exercise': app.tenant(app.select_exercise_fn),
+                'select_program': app.tenant(app.select_program_fn),
+                'older_sets': app.tenant(app.older_sets_fn),
+            }
+            for users in ('per-user', 'shared'):
+                latencies = [{} for _ in range(clients)]
+                threads = [threading.Thread(target=_load_client, args=(
+                    app, handlers, f'lifter-{i}' if users == 'per-user' else 'shared', actions, i, latencies[i]))
+                    for i in range(clients)]
+                start = time.perf_counter()
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                elapsed = time.perf_counter() - start
+                app.pool.close()
+                merged = [x for per_client in latencies for values in per_client.values() for x in values]
+                stats = _percentiles(merged)
+                throughput = len(merged) / elapsed
+                print(f"{users:>9} {clients:>8} {len(merged):>6} {throughput:>8.0f} {stats['p50_ms']:>8.2f} "
+                      f"{stats['p99_ms']:>8.2f} {_peak_rss_mb():>8.0f}")
+                _record('load', users=users, clients=clients, calls=len(merged), calls_per_s=throughput,
+                        peak_rss_mb=_peak_rss_mb(), **stats)
+                for name in sorted(latencies[0]):
+                    per_action = _percentiles([x for per_client in latencies for x in per_client.get(name, [])])
+                    _record('load', users=users, clients=clients, action=name, **per_action)
+        finally:
+            os.chdir(cwd)
+
+
+def bench_instrumentation(sets: int = 1_000, calls: int = 100_000):
+    # Cost of the span hooks on cheap reads: the undecorated methods, the
+    # hooks switched off, and the hooks feeding an in-memory sink.
+    print(f"{'hooks':>8} {'calls':>8} {'us/call':>9} {'overhead us':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        training = Training(os.path.join(tmp, 'data.json'))
+        pid = training.create_program('Bench')
+        eid = training.add_exercise(pid, 'Squat', 5, 8)
+        with training.batch():
+            for i in range(sets):
+                training.add_set(pid, eid, 100.0 + i % 10, 5)
+        reads = (Training.version, Training.get_suggested_weight, Training.list_programs)
+        raw = [fn.__wrapped__ for fn in reads]
+        baseline = None
+        for label, fns, sink in (('none', raw, None), ('off', reads, None),
+                                 ('memory', reads, instrumentation.MemorySink())):
+            if sink is not None:
+                instrumentation.enable(sink)
+            version, suggested, programs = fns
+            start = time.perf_counter()
+            for _ in range(calls):
+                version(training, pid, eid)
+                suggested(training, pid, eid)
+                programs(training)
+            per_call = (time.perf_counter() - start) / (3 * calls) * 1e6
+            instrumentation.disable()
+            baseline = per_call if baseline is None else baseline
+            print(f"{label:>8} {3 * calls:>8} {per_call:>9.3f} {per_call - baseline:>12.3f}")
+            _record('instrumentation', hooks=label, calls=3 * calls, us_per_call=per_call,
+                    overhead_us=per_call - baseline)
+        training.close()
+
+
+def _bulk_phase(mode: str, path: str, data_file: str, queue) -> None:
+    # Runs in a fresh process so ru_maxrss is this phase's peak alone.
+    start = time.perf_counter()
+    if mode == 'import':
+        # As the import command opens it.
+        training = bulk.open_store(data_file, lazy=True, max_loaded_programs=bulk.IMPORT_LOADED_PROGRAMS)
+        count = bulk.import_rows(training, bulk.read_rows(path))['sets']
+        training.compact()
+        training.close()
+    elif mode == 'export':
+        training = bulk.open_store(data_file, lazy=True, max_loaded_programs=1)
+        count = bulk.write_rows(path, bulk.export_rows(training))
+        training.close()
+    else:
+        # The per-call path the importer replaces: one add_set (and one full
+        # save) per row.
+        training = Training(data_file)
+        count = 0
+        for row in bulk.read_rows(path):
+            program, exercise, rep_min, rep_max, weight, reps, timestamp, _ = bulk.parse_row(row)
+            if not count:
+                pid = training.create_program(program)
+                eid = training.add_exercise(pid, exercise, rep_min, rep_max)
+            training.add_set(pid, eid, weight, reps, timestamp=timestamp)
+            count += 1
+        training.close()
+    queue.put((count, time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def bench_bulk(rows: int = 1_000_000, per_call_rows: int = 2_000):
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{'phase':>10} {'sets':>9} {'seconds':>8} {'sets/s':>9} {'peak RSS MB':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'history.csv')
+        sample = os.path.join(tmp, 'sample.csv')
+        with open(source, 'w', newline='') as f, open(sample, 'w', newline='') as g:
+            writer, sample_writer = csv.writer(f), csv.writer(g)
+            writer.writerow(bulk.COLUMNS)
+            sample_writer.writerow(bulk.COLUMNS)
+            for i in range(rows):
+                # 5 programs x 10 exercises, each exercise a contiguous run of rows.
+                block = i * 50 // rows
+                row = (f'Block {block // 10}', f'Exercise {block % 10}', 5, 8, 100.0 + i % 50, 5 + i % 4,
+                       1.7e9 + i * 60.0, '')
+                writer.writerow(row)
+                if i < per_call_rows:
+                    sample_writer.writerow(row)
+        print(f"synthetic CSV: {rows} rows, {os.path.getsize(source) / 2**20:.0f} MB")
+        for mode, path, data_file in (('add_set', sample, 'per_call.json'), ('import', source, 'bulk.json'),
+                                      ('export', os.path.join(tmp, 'export.csv'), 'bulk.json')):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_bulk_phase, args=(mode, path, os.path.join(tmp, data_file), queue))
+            proc.start()
+            proc.join()
+            if proc.exitcode != 0:
+                print(f"{mode:>10} {'failed (exit ' + str(proc.exitcode) + ')':>30}")
+                continue
+            count, seconds, peak_mb = queue.get()
+            print(f"{mode:>10} {count:>9} {seconds:>8.1f} {count / seconds:>9.0f} {peak_mb:>12.0f}")
+            _record('bulk', phase=mode, sets=count, seconds=seconds, sets_per_s=count / seconds, peak_rss_mb=peak_mb)
+
+
+def _scan_search(training: Training, query: str, limit: int) -> list:
+    # What finding a name cost before the indexes: walk every program and
+    # every exercise.
+    q = query.casefold()
+    results = []
+    for p in training.programs.values():
+        if q in p.name.casefold():
+            results.append(p.program_id)
+        for e in p.exercises.values():
+            if q in e.name.casefold():
+                results.append(e.exercise_id)
+        if len(results) >= limit:
+            break
+    return results[:limit]
+
+
+def bench_search(programs: int = 20_000, exercises: int = 5, calls: int = 200):
+    lifts = ['Bench Press', 'Incline Bench', 'Back Squat', 'Front Squat', 'Deadlift', 'Romanian Deadlift',
+             'Overhead Press', 'Barbell Row', 'Pull Up', 'Dip', 'Lunge', 'Hip Thrust']
+    rng = random.Random(0)
+    print(f"{'query':>24} {'scan ms':>9} {'p50 ms':>8} {'p99 ms':>8} {'hits':>5}")
+    with tempfile.TemporaryDirectory() as tmp:
+        training = Training(os.path.join(tmp, 'data.json'), background=True)
+        with training.batch():
+            for p in range(programs):
+                pid = training.create_program(f'{rng.choice(["Strength", "Hypertrophy", "Peaking"])} Block {p}')
+                for e in rng.sample(lifts, exercises):
+                    training.add_exercise(pid, e, 5, 8)
+        start = time.perf_counter()
+        training.search('warm up')
+        build_s = time.perf_counter() - start
+        print(f"index build for {programs} programs, {programs * exercises} exercises: {build_s * 1e3:.0f} ms")
+        _record('search', op='build', programs=programs, exercises=programs * exercises, seconds=build_s)
+        queries = [('search', 'bench'), ('search', 'block 1999'), ('search', 'squat'), ('search', 'zzq'),
+                   ('search', 'st'),
+                   ('find_programs', training.list_programs()[programs // 2]['name'].upper()),
+                   ('find_exercises', 'dip')]
+        for op, query in queries:
+            fn = getattr(training, op)
+            latencies = _time_calls(lambda: fn(query), calls)
+            stats = _percentiles(latencies)
+            hits = len(fn(query))
+            start = time.perf_counter()
+            _scan_search(training, query, 20 if op == 'search' else programs * exercises)
+            scan_ms = (time.perf_counter() - start) * 1e3
+            label = f'{op}({query!r})'
+            print(f"{label:>24} {scan_ms:>9.2f} {stats['p50_ms']:>8.3f} {stats['p99_ms']:>8.3f} {hits:>5}")
+            _record('search', op=op, query=query, hits=hits, scan_ms=scan_ms, **stats)
+        training.close()
+
+
+def _clone_store(path: str, exercises: int, sets: int):
+    training = Training(path, backend=JsonFileBackend(path, journal=True, compact_every=0, indent=None))
+    with training.batch():
+        pid = training.create_program('Template')
+        for e in range(exercises):
+            eid = training.add_exercise(pid, f'Exercise {e}', 8, 12)
+            for s in range(sets):
+                training.add_set(pid, eid, 100.0 + s, 8, timestamp=1.7e9 + s * 60.0)
+    training.compact()
+    return training, pid
+
+
+def _copy_program(training: Training, pid: str) -> str:
+    # What a copy cost before clone_program: a new program, then every
+    # exercise added one by one.
+    copy = training.create_program('Copy')
+    with training.batch():
+        for e in training.list_exercise_summaries(pid):
+            training.add_exercise(copy, e['name'], e['rep_min'], e['rep_max'])
+    return copy
+
+
+def bench_clone(exercises: int = 200, sets: int = 20, clones=(10, 100, 1_000)):
+    print(f"{'method':>7} {'clones':>7} {'p50 ms':>8} {'p99 ms':>8} {'memory MB':>10} {'journal KB':>11} "
+          f"{'snapshot MB':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for method in ('copy', 'clone'):
+            if method == 'copy':
+                make = _copy_program
+            else:
+                make = lambda training, pid: training.clone_program(pid)
+            for n in clones:
+                path = os.path.join(tmp, f'{method}-{n}.json')
+                training, pid = _clone_store(path, exercises, sets)
+                base_size = os.path.getsize(path)
+                latencies = []
+                for _ in range(n):
+                    start = time.perf_counter()
+                    make(training, pid)
+                    latencies.append(time.perf_counter() - start)
+                journal_kb = os.path.getsize(path + '.log') / 2**10
+                training.compact()
+                snapshot_mb = (os.path.getsize(path) - base_size) / 2**20
+                training.close()
+                # Memory on a fresh store, so tracing does not skew the timings.
+                training, pid = _clone_store(path + '.mem', exercises, sets)
+                memory_mb = _allocated_mb(lambda: [make(training, pid) for _ in range(n)])
+                training.close()
+                stats = _percentiles(latencies)
+                print(f"{method:>7} {n:>7} {stats['p50_ms']:>8.3f} {stats['p99_ms']:>8.3f} {memory_mb:>10.2f} "
+                      f"{journal_kb:>11.1f} {snapshot_mb:>12.2f}")
+                _record('clone', method=method, clones=n, exercises=exercises, memory_mb=memory_mb,
+                        journal_kb=journal_kb, snapshot_mb=snapshot_mb, **stats)
+
+
+def bench_undo(programs: int = 20, exercises: int = 10, sets: int = 1_000, steps=(10, 100, 500)):
+    # Memory an undo history holds and what returning to a snapshot costs,
+    # against reopening a saved copy of the store.
+    print(f"{'steps':>6} {'history KB':>11} {'B/step':>7} {'restore ms':>11} {'reopen ms':>10}")
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data.json')
+        training = Training(path, backend=JsonFileBackend(path, journal=True, compact_every=0, indent=None),
+                            undo_limit=max(steps))
+        with training.batch():
+            for p in range(programs):
+                pid = training.create_program(f'Block {p}')
+                for e in range(exercises):
+                    eid = training.add_exercise(pid, f'Exercise {e}', 5, 8)
+                    for s in range(sets):
+                        training.add_set(pid, eid, 100.0 + s % 50, 5, timestamp=1.7e9 + s * 600.0)
+        training.compact()
+        targets = [(p, e) for p in training.programs for e in training.programs[p].exercises]
+
+        def edits(n):
+            for i in range(n):
+                pid, eid = rng.choice(targets)
+                set_id = training.list_sets(pid, eid, offset=rng.randrange(sets // 2), limit=1)[0]['id']
+                if i % 2:
+                    training.remove_set(pid, eid, set_id)
+                else:
+                    training.edit_set(pid, eid, set_id, 1.0, 1)
+
+        for n in steps:
+            # The same edits with the history off are the baseline.
+            training.undo_limit = 0
+            plain_mb = _allocated_mb(lambda: edits(n))
+            training.undo_limit = max(steps)
+            training.snapshot('before')
+            history_mb = _allocated_mb(lambda: edits(n)) - plain_mb
+            start = time.perf_counter()
+            training.restore_snapshot('before')
+            restore_ms = (time.perf_counter() - start) * 1e3
+            training.flush()
+            start = time.perf_counter()
+            Training(path, backend=JsonFileBackend(path, journal=True, compact_every=0, indent=None)).close()
+            reopen_ms = (time.perf_counter() - start) * 1e3
+            history_kb = max(history_mb, 0.0) * 2**10
+            print(f"{n:>6} {history_kb:>11.1f} {history_kb * 2**10 / n:>7.0f} {restore_ms:>11.2f} {reopen_ms:>10.0f}")
+            _record('undo', steps=n, sets=programs * exercises * sets, history_kb=history_kb, restore_ms=restore_ms,
+                    reopen_ms=reopen_ms)
+        training.close()
+    _undo_latency()
+
+
+def _undo_latency(histories=(200_000, 1_000_000), removals: int = 20):
+    # Removing sets from the middle of one long history and undoing that,
+    # with the history on: both should cost about the same at any length.
+    print(f"{'sets':>9} {'remove ms':>10} {'undo ms':>8}")
+    for n in histories:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.json')
+            training = Training(path, backend=JsonFileBackend(path, journal=True, compact_every=0, indent=None))
+            pid = training.create_program('Block')
+            eid = training.add_exercise(pid, 'Squat', 5, 8)
+            with training.batch():
+                for i in range(n):
+                    training.add_set(pid, eid, 100.0, 5, timestamp=1.7e9 + i * 60.0)
+            training.undo_limit = removals
+            set_ids = [s['id'] for s in training.list_sets(pid, eid, offset=n // 2, limit=removals)]
+            start = time.perf_counter()
+            for set_id in set_ids:
+                training.remove_set(pid, eid, set_id)
+            remove_ms = (time.perf_counter() - start) / removals * 1e3
+            start = time.perf_counter()
+            while training.undo():
+                pass
+            undo_ms = (time.perf_counter() - start) / removals * 1e3
+            print(f"{n:>9} {remove_ms:>10.3f} {undo_ms:>8.3f}")
+            _record('undo_latency', sets=n, remove_ms=remove_ms, undo_ms=undo_ms)
+            training.close()
+
+
+def bench_startup(size_mb: int = 100):
+    # Time to the first page on a large store: the lazy open with and without
+    # the snapshot's index file, then the page-load payload cold and cached.
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            import app
+            path = os.path.join(tmp, 'data.json')
+            with open(path, 'wb') as f:
+                write_json_array(f, _synthetic_programs(f, size_mb), None)
+            print(f"{'open':>6} {'MB':>5} {'open ms':>9} {'first page ms':>14} {'cached ms':>10}")
+            for mode in ('scan', 'index'):
+                if mode == 'scan' and os.path.exists(path + '.idx'):
+                    os.remove(path + '.idx')
+                start = time.perf_counter()
+                training = Training(path, lazy=True)
+                open_ms = (time.perf_counter() - start) * 1e3
+                start = time.perf_counter()
+                app.startup_populate(training)
+                first_ms = (time.perf_counter() - start) * 1e3
+                start = time.perf_counter()
+                app.startup_populate(training)
+                cached_ms = (time.perf_counter() - start) * 1e3
+                training.close()
+                print(f"{mode:>6} {size_mb:>5} {open_ms:>9.1f} {first_ms:>14.2f} {cached_ms:>10.3f}")
+                _record('startup', open=mode, size_mb=size_mb, open_ms=open_ms, first_page_ms=first_ms,
+                        cached_ms=cached_ms)
+            app.pool.close()
+        finally:
+            os.chdir(cwd)
+
+
+BENCHMARKS = {
+    'set_index': bench_set_index,
+    'set_memory': bench_set_memory,
+    'concurrency': bench_concurrency,
+    'batch': bench_batch,
+    'background': bench_background,
+    'ui': bench_ui,
+    'json_codec': bench_json_codec,
+    'snapshot': bench_snapshot,
+    'api': bench_api,
+    'load': bench_load,
+    'instrumentation': bench_instrumentation,
+    'bulk': bench_bulk,
+    'search': bench_search,
+    'clone': bench_clone,
+    'undo': bench_undo,
+    'startup': bench_startup,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Training micro-benchmarks")
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    parser.add_argument('--json-mb', type=int, default=500, help="size of the json_codec synthetic history")
+    parser.add_argument('--snapshot-mb', type=int, default=100, help="size of the snapshot and startup synthetic histories")
+    parser.add_argument('--scales', default='small,medium',
+                        help=f"comma-separated history scales for api: {', '.join(SCALES)}")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent clients for load")
+    parser.add_argument('--json', metavar='PATH', help="also write every result row to PATH as JSON")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    for name in args.names or BENCHMARKS:
+        print(f"== {name}")
+        if name == 'json_codec':
+            bench_json_codec(args.json_mb)
+        elif name == 'snapshot':
+            bench_snapshot(args.snapshot_mb)
+        elif name == 'startup':
+            bench_startup(args.snapshot_mb)
+        elif name == 'api':
+            bench_api(args.scales.split(','))
+        elif name == 'load':
+            bench_load(args.clients)
+        else:
+            BENCHMARKS[name]()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'timestamp': time.time(), 'results': RESULTS}, f, indent=2)
@@ -0,0 +1,281 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from training import BinaryFileBackend, JsonFileBackend, SqliteBackend, Training, TrainingPool
+
+# Streaming import and export of set history as CSV or JSON Lines, one set per
+# row. Rows are read, resolved and written one at a time and committed in
+# batches. The store is opened lazily with programs evicted between batches,
+# so memory is bounded by the largest program rather than the length of the
+# file or the size of the store.
+COLUMNS = ('program', 'exercise', 'rep_min', 'rep_max', 'weight', 'reps', 'timestamp', 'session_id')
+# Rep range given to exercises created by rows that do not carry one (the
+# app's defaults).
+DEFAULT_REP_RANGE = (8, 12)
+# Session labels that are not UUIDs map to uuid5(SESSION_NAMESPACE, label),
+# so rows sharing a label share a session and re-importing the same file gives
+# the same ids. The binary store only holds UUIDs.
+SESSION_NAMESPACE = uuid.UUID('8a3f61d2-5b1e-4c47-9e0a-2f6d4b7c9e13')
+# Programs kept materialized between import batches. Files sorted by program
+# (as export writes them) touch one or two per batch, so one is seldom
+# reloaded; interleaved files reload more.
+IMPORT_LOADED_PROGRAMS = 1
+# Invalid rows reported individually when skipping them; the rest are counted.
+MAX_REPORTED_ERRORS = 100
+
+
+def file_format(path: str, fmt: Optional[str] = None) -> str:
+    if fmt:
+        return fmt
+    return 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'csv'
+
+
+def read_rows(path: str, fmt: Optional[str] = None) -> Iterator[Optional[dict]]:
+    # A JSON Lines row that does not decode comes through as None and is
+    # rejected by parse_row like any other invalid row.
+    if file_format(path, fmt) == 'jsonl':
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield None
+    else:
+        with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+            yield from csv.DictReader(f)
+
+
+def _name(row: dict, key: str) -> str:
+    value = row.get(key)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"missing {key}")
+    return value.strip()
+
+
+def _number(row: dict, key: str, integer: bool = False, required: bool = True):
+    value = row.get(key)
+    if value is None or value == '':
+        if required:
+            raise ValueError(f"missing {key}")
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid {key}: {value!r}") from None
+    if not math.isfinite(number) or (integer and not number.is_integer()):
+        raise ValueError(f"invalid {key}: {value!r}")
+    return int(number) if integer else number
+
+
+def _timestamp(row: dict) -> Optional[float]:
+    # Seconds since the epoch, or ISO 8601 (local time unless it has an offset).
+    value = row.get('timestamp')
+    if isinstance(value, str) and value.strip():
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.fromisoformat(value.strip()).timestamp()
+        except ValueError:
+            raise ValueError(f"invalid timestamp: {value!r}") from None
+    return _number(row, 'timestamp', required=False)
+
+
+def _session_id(row: dict) -> Optional[str]:
+    value = row.get('session_id')
+    label = '' if value is None else str(value).strip()
+    if not label:
+        return None
+    try:
+        return str(uuid.UUID(label))
+    except ValueError:
+        return str(uuid.uuid5(SESSION_NAMESPACE, label))
+
+
+def parse_row(row: Optional[dict]) -> tuple:
+    # (program, exercise, rep_min, rep_max, weight, reps, timestamp, session_id)
+    # with the checks Exercise.add_set makes; raises ValueError otherwise.
+    if not isinstance(row, dict):
+        raise ValueError("not a JSON object")
+    weight = _number(row, 'weight')
+    reps = _number(row, 'reps', integer=True)
+    if weight < 0 or reps < 0:
+        raise ValueError("Weight and reps must be non-negative.")
+    rep_min = _number(row, 'rep_min', integer=True, required=False)
+    rep_max = _number(row, 'rep_max', integer=True, required=False)
+    rep_min = DEFAULT_REP_RANGE[0] if rep_min is None else rep_min
+    rep_max = DEFAULT_REP_RANGE[1] if rep_max is None else rep_max
+    if rep_min > rep_max:
+        rep_min, rep_max = rep_max, rep_min
+    return (_name(row, 'program'), _name(row, 'exercise'), rep_min, rep_max, weight, reps, _timestamp(row),
+            _session_id(row))
+
+
+class Importer:
+    # Resolves program and exercise names to ids through the store's name
+    # index, creating what is missing. Names match ignoring case and repeated
+    # spaces, as search does; where a store already has duplicates the first
+    # one wins. Existing exercises keep their rep range.
+    def __init__(self, training: Training):
+        self.training = training
+        self.programs_created = 0
+        self.exercises_created = 0
+
+    def program_id(self, name: str) -> str:
+        matches = self.training.find_programs(name)
+        if matches:
+            return matches[0]['id']
+        self.programs_created += 1
+        return self.training.create_program(name)
+
+    def exercise_id(self, program_id: str, name: str, rep_min: int, rep_max: int) -> str:
+        matches = self.training.find_exercises(name, program_id)
+        if matches:
+            return matches[0]['id']
+        self.exercises_created += 1
+        return self.training.add_exercise(program_id, name, rep_min, rep_max)
+
+
+def import_rows(training: Training, rows: Iterable[Optional[dict]], batch_size: int = 10_000,
+                skip_invalid: bool = False) -> dict:
+    # Adds one set per row through Training.add_sets. An invalid row raises
+    # ValueError (batches already committed stay) unless skip_invalid is set.
+    importer = Importer(training)
+    result = {'rows': 0, 'sets': 0, 'skipped': 0, 'errors': []}
+
+    def sets():
+        for n, row in enumerate(rows, start=1):
+            result['rows'] = n
+            try:
+                program, exercise, rep_min, rep_max, weight, reps, timestamp, session_id = parse_row(row)
+            except ValueError as e:
+                if not skip_invalid:
+                    raise ValueError(f"Row {n}: {e}") from None
+                result['skipped'] += 1
+                if len(result['errors']) < MAX_REPORTED_ERRORS:
+                    result['errors'].append(f"Row {n}: {e}")
+                continue
+            program_id = importer.program_id(program)
+            yield (program_id, importer.exercise_id(program_id, exercise, rep_min, rep_max), weight, reps,
+                   timestamp, session_id)
+
+    result['sets'] = training.add_sets(sets(), batch_size)
+    result['programs_created'] = importer.programs_created
+    result['exercises_created'] = importer.exercises_created
+    return result
+
+
+def export_rows(training: Training, program_ids: Optional[Iterable[str]] = None) -> Iterator[dict]:
+    # Every set, program by program and oldest first within each exercise.
+    wanted = None if program_ids is None else set(program_ids)
+    for p in training.list_programs():
+        if wanted is not None and p['id'] not in wanted:
+            continue
+        for e in training.list_exercise_summaries(p['id']):
+            for s in training.iter_sets(p['id'], e['id']):
+                yield {'program': p['name'], 'exercise': e['name'], 'rep_min': e['rep_min'],
+                       'rep_max': e['rep_max'], 'weight': s['weight'], 'reps': s['reps'],
+                       'timestamp': s['timestamp'], 'session_id': s['session_id']}
+
+
+def write_rows(path: str, rows: Iterable[dict], fmt: Optional[str] = None) -> int:
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if file_format(path, fmt) == 'jsonl':
+            for row in rows:
+                f.write(json.dumps(row, separators=(',', ':')) + '\n')
+                count += 1
+        else:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            for row in rows:
+                writer.writerow(['' if row[c] is None else row[c] for c in COLUMNS])
+                count += 1
+    return count
+
+
+def open_store(data_file: str, **training_kwargs) -> Training:
+    # Journaled, with compaction left to the caller: each imported batch is
+    # appended to the journal instead of rewriting the whole snapshot. JSON
+    # snapshots are written compact, which encodes several times faster.
+    ext = os.path.splitext(data_file)[1].lower()
+    if ext == '.db':
+        backend = SqliteBackend(data_file)
+    elif ext == '.wtrn':
+        backend = BinaryFileBackend(data_file, journal=True, compact_every=0)
+    else:
+        backend = JsonFileBackend(data_file, journal=True, compact_every=0, indent=None)
+    return Training(data_file, backend=backend, **training_kwargs)
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Import or export workout history as CSV or JSON Lines "
+                                                 f"(columns: {', '.join(COLUMNS)}).")
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_cmd = commands.add_parser('import', help="add every row of FILE to the store")
+    export_cmd = commands.add_parser('export', help="write every set in the store to FILE")
+    for cmd in (import_cmd, export_cmd):
+        cmd.add_argument('file')
+        cmd.add_argument('--format', choices=('csv', 'jsonl'), help="default: from the file extension")
+        cmd.add_argument('--data-file', default='workout_data.json',
+                         help="store to use (.json, .wtrn or .db); default: %(default)s")
+        cmd.add_argument('--user', help="use this signed-in user's store under --data-dir instead")
+        cmd.add_argument('--data-dir', default='user_data', help="per-user stores; default: %(default)s")
+    import_cmd.add_argument('--batch-size', type=int, default=10_000, help="sets per commit")
+    import_cmd.add_argument('--skip-invalid', action='store_true', help="skip invalid rows instead of stopping")
+    export_cmd.add_argument('--program', action='append', help="only the program with this name (repeatable)")
+    args = parser.parse_args(argv)
+
+    data_file = args.data_file
+    if args.user:
+        data_file = TrainingPool(data_dir=args.data_dir).path_for(args.user)
+        os.makedirs(args.data_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    if args.command == 'import':
+        training = open_store(data_file, lazy=True, max_loaded_programs=IMPORT_LOADED_PROGRAMS)
+        try:
+            result = import_rows(training, read_rows(args.file, args.format), args.batch_size, args.skip_invalid)
+        except (OSError, ValueError) as e:
+            print(f"Error importing data: {e}", file=sys.stderr)
+            return 1
+        finally:
+            try:
+                training.compact()
+            finally:
+                training.close()
+        for error in result['errors']:
+            print(error, file=sys.stderr)
+        print(f"Imported {result['sets']} sets from {result['rows']} rows into {data_file} "
+              f"({result['programs_created']} new programs, {result['exercises_created']} new exercises, "
+              f"{result['skipped']} rows skipped) in {time.perf_counter() - start:.1f}s")
+    else:
+        # One program materialized at a time keeps memory flat on large stores.
+        training = open_store(data_file, lazy=True, max_loaded_programs=1)
+        try:
+            program_ids = None
+            if args.program:
+                program_ids = [p['id'] for p in training.list_programs() if p['name'] in args.program]
+            count = write_rows(args.file, export_rows(training, program_ids), args.format)
+        except OSError as e:
+            print(f"Error exporting data: {e}", file=sys.stderr)
+            return 1
+        finally:
+            training.close()
+        print(f"Exported {count} sets from {data_file} to {args.file} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
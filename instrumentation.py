@@ -0,0 +1,222 @@
+import cProfile
+import inspect
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import wraps
+from typing import Callable, Dict, Iterable, Optional
+
+# Timing hooks for Training, its storage backends and the app.py handlers.
+# Spans go to the installed sink; with none installed (the default) each hook
+# costs one global lookup before calling straight through.
+
+
+class Sink(ABC):
+    @abstractmethod
+    def observe(self, name: str, seconds: float, error: bool) -> None:
+        ...
+
+
+class MemorySink(Sink):
+    # Per-span call count, error count, total and worst time.
+    def __init__(self):
+        self._stats: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, error: bool) -> None:
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                stat = self._stats[name] = [0, 0, 0.0, 0.0]
+            stat[0] += 1
+            stat[1] += error
+            stat[2] += seconds
+            if seconds > stat[3]:
+                stat[3] = seconds
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: {'count': c, 'errors': e, 'total_s': t, 'mean_s': t / c, 'max_s': m}
+                    for name, (c, e, t, m) in sorted(self._stats.items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+class PrometheusSink(MemorySink):
+    # MemorySink rendered in the Prometheus text format, optionally served
+    # over HTTP for scraping.
+    def render(self) -> str:
+        lines = ['# TYPE workout_span_seconds summary']
+        stats = self.stats()
+        for name, s in stats.items():
+            lines.append(f'workout_span_seconds_count{{span="{name}"}} {s["count"]}')
+            lines.append(f'workout_span_seconds_sum{{span="{name}"}} {s["total_s"]:.9f}')
+        lines.append('# TYPE workout_span_seconds_max gauge')
+        for name, s in stats.items():
+            lines.append(f'workout_span_seconds_max{{span="{name}"}} {s["max_s"]:.9f}')
+        lines.append('# TYPE workout_span_errors_total counter')
+        for name, s in stats.items():
+            lines.append(f'workout_span_errors_total{{span="{name}"}} {s["errors"]}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> 'ThreadingHTTPServer':
+        # Imported here: http.server is most of this module's import time.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = sink.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class LogSink(Sink):
+    # One log line per span, skipping those faster than min_seconds.
+    def __init__(self, logger: Optional[logging.Logger] = None, min_seconds: float = 0.0, level: int = logging.INFO):
+        self.logger = logger or logging.getLogger('workout.instrumentation')
+        self.min_seconds = min_seconds
+        self.level = level
+
+    def observe(self, name: str, seconds: float, error: bool) -> None:
+        if seconds >= self.min_seconds:
+            self.logger.log(self.level, '%s %.3f ms%s', name, seconds * 1e3, ' (error)' if error else '')
+
+
+_sink: Optional[Sink] = None
+# The sink disable() switched off, brought back by enable() with no argument.
+_parked: Optional[Sink] = None
+# Directory the next profiled call writes its cProfile stats to, if armed.
+_profile_dir: Optional[str] = None
+_profile_lock = threading.Lock()
+
+
+def enable(sink: Optional[Sink] = None) -> Sink:
+    global _sink, _parked
+    if sink is None:
+        sink = _sink or _parked or MemorySink()
+    _sink, _parked = sink, None
+    return sink
+
+
+def disable() -> None:
+    global _sink, _parked
+    if _sink is not None:
+        _sink, _parked = None, _sink
+
+
+def current_sink() -> Optional[Sink]:
+    return _sink
+
+
+def configure(spec: Optional[str]) -> Optional[Sink]:
+    # 'memory', 'log' or 'prometheus[:port]' (as in WORKOUT_INSTRUMENT);
+    # empty leaves instrumentation off.
+    if not spec:
+        return None
+    kind, _, arg = spec.partition(':')
+    if kind == 'memory':
+        return enable(MemorySink())
+    if kind == 'log':
+        logging.basicConfig(level=logging.INFO)
+        return enable(LogSink(min_seconds=float(arg) / 1e3 if arg else 0.0))
+    if kind == 'prometheus':
+        sink = PrometheusSink()
+        sink.serve(int(arg) if arg else 9464)
+        return enable(sink)
+    raise ValueError(f"Unknown instrumentation sink: {spec}")
+
+
+def observe(name: str, seconds: float, error: bool = False) -> None:
+    # Reports a span timed outside timed(), e.g. a startup phase.
+    sink = _sink
+    if sink is not None:
+        sink.observe(name, seconds, error)
+
+
+def profile_next(directory: str = '.') -> None:
+    # The next profiled call (one app handler run) is captured with cProfile
+    # and its stats written to directory.
+    global _profile_dir
+    with _profile_lock:
+        _profile_dir = directory
+
+
+def _claim_profile() -> Optional[str]:
+    global _profile_dir
+    with _profile_lock:
+        directory, _profile_dir = _profile_dir, None
+    return directory
+
+
+def _dump_profile(profiler: cProfile.Profile, name: str, directory: str) -> None:
+    path = os.path.join(directory, f"profile-{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+    try:
+        profiler.dump_stats(path)
+        print(f"Profile of {name} written to {path}")
+    except OSError as e:
+        print(f"Error writing profile: {e}")
+
+
+def timed(fn: Callable, name: Optional[str] = None, profile: bool = False) -> Callable:
+    # Wraps fn in a span. With profile=True the call can also be the one
+    # profile_next() captures.
+    name = name or fn.__qualname__
+
+    def observed(args, kwargs):
+        sink = _sink
+        directory = _claim_profile() if profile else None
+        profiler = cProfile.Profile() if directory is not None else None
+        error = False
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                return profiler.runcall(fn, *args, **kwargs)
+            return fn(*args, **kwargs)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            if sink is not None:
+                sink.observe(name, time.perf_counter() - start, error)
+            if profiler is not None:
+                _dump_profile(profiler, name, directory)
+
+    if profile:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _sink is None and _profile_dir is None:
+                return fn(*args, **kwargs)
+            return observed(args, kwargs)
+    else:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return fn(*args, **kwargs)
+            return observed(args, kwargs)
+    return wrapper
+
+
+def instrument(cls: type, names: Optional[Iterable[str]] = None, exclude: Iterable[str] = ()) -> type:
+    # Replaces the named methods defined on cls (by default every public one)
+    # with timed versions, named Class.method.
+    if names is None:
+        names = [n for n, v in vars(cls).items() if not n.startswith('_') and inspect.isfunction(v)]
+    for n in names:
+        if n not in exclude:
+            setattr(cls, n, timed(vars(cls)[n]))
+    return cls
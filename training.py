@@ -1,24 +1,376 @@
 import uuid
+import codecs
+import hashlib
 import json
+import heapq
+import math
+import mmap
 import os
-from typing import Dict, List, Optional
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from functools import partial
+from itertools import chain, count, islice
+from contextlib import contextmanager
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from instrumentation import instrument
+
+# Sets logged within this many seconds of the program's previous set belong
+# to the same workout session.
+SESSION_GAP = 3 * 60 * 60
+
+class _Block:
+    __slots__ = ('keys', 'values')
+
+    def __init__(self, keys: list, values: list):
+        self.keys = keys
+        self.values = values
+
+class _OrderedView:
+    # Live, re-iterable view of an _OrderedMap's keys, values or items.
+    def __init__(self, mapping: '_OrderedMap', part: Callable[[_Block], Iterable]):
+        self._mapping = mapping
+        self._part = part
+
+    def __len__(self) -> int:
+        return len(self._mapping)
+
+    def __iter__(self) -> Iterator:
+        return chain.from_iterable(self._part(b) for b in self._mapping._blocks)
+
+    def __reversed__(self) -> Iterator:
+        return chain.from_iterable(reversed(self._part(b)) for b in reversed(self._mapping._blocks))
+
+class _OrderedMap:
+    # Insertion-ordered mapping that can also put a key back right after any
+    # other key. Lookups go through a plain dict, which writers update with
+    # single assignments, so lock-free get() and `in` never miss a key that
+    # stays. The order lives in blocks of at most 2 * BLOCK keys: finding a
+    # key's neighbour, inserting or removing it costs one block, not the map.
+    BLOCK = 512
+
+    def __init__(self, items: Iterable[tuple] = ()):
+        self._items: dict = dict(items)
+        self._block_of: dict = {}
+        self._blocks: List[_Block] = []
+        keys, values = list(self._items), list(self._items.values())
+        for i in range(0, len(keys), self.BLOCK):
+            self._add_block(keys[i:i + self.BLOCK], values[i:i + self.BLOCK])
+
+    def _add_block(self, keys: list, values: list) -> None:
+        block = _Block(keys, values)
+        self._blocks.append(block)
+        self._block_of.update(dict.fromkeys(keys, block))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key) -> bool:
+        return key in self._items
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def __iter__(self) -> Iterator:
+        return iter(self.keys())
+
+    def __reversed__(self) -> Iterator:
+        return reversed(self.keys())
+
+    def keys(self) -> _OrderedView:
+        return _OrderedView(self, lambda b: b.keys)
+
+    def values(self) -> _OrderedView:
+        return _OrderedView(self, lambda b: b.values)
+
+    def items(self) -> _OrderedView:
+        return _OrderedView(self, lambda b: list(zip(b.keys, b.values)))
+
+    def __setitem__(self, key, value) -> None:
+        block = self._block_of.get(key)
+        if block is not None:
+            block.values[block.keys.index(key)] = value
+        elif self._blocks and len(self._blocks[-1].keys) < self.BLOCK:
+            block = self._blocks[-1]
+            block.keys.append(key)
+            block.values.append(value)
+            self._block_of[key] = block
+        else:
+            self._add_block([key], [value])
+        self._items[key] = value
+
+    def __delitem__(self, key) -> None:
+        self.pop(key)
+
+    def pop(self, key, *default):
+        block = self._block_of.pop(key, None)
+        if block is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        i = block.keys.index(key)
+        del block.keys[i]
+        del block.values[i]
+        if not block.keys:
+            del self._blocks[self._block_index(block)]
+        return self._items.pop(key)
+
+    def _block_index(self, block: _Block) -> int:
+        return next(i for i, b in enumerate(self._blocks) if b is block)
+
+    def before(self, key):
+        # The key just ahead of key, None for the first one.
+        block = self._block_of[key]
+        i = block.keys.index(key)
+        if i:
+            return block.keys[i - 1]
+        i = self._block_index(block)
+        return self._blocks[i - 1].keys[-1] if i else None
+
+    def insert_after(self, after, key, value) -> None:
+        # Puts key right after the key after (first when None).
+        if key in self._items:
+            raise KeyError(key)
+        if not self._blocks:
+            self._add_block([key], [value])
+            self._items[key] = value
+            return
+        if after is None:
+            block, i = self._blocks[0], 0
+        else:
+            block = self._block_of[after]
+            i = block.keys.index(after) + 1
+        block.keys.insert(i, key)
+        block.values.insert(i, value)
+        self._block_of[key] = block
+        self._items[key] = value
+        if len(block.keys) > 2 * self.BLOCK:
+            half = len(block.keys) // 2
+            moved = _Block(block.keys[half:], block.values[half:])
+            del block.keys[half:], block.values[half:]
+            self._blocks.insert(self._block_index(block) + 1, moved)
+            self._block_of.update(dict.fromkeys(moved.keys, moved))
+
+    def slice(self, start: int, stop: Optional[int] = None) -> list:
+        # Values from position start up to stop, skipping whole blocks.
+        out = []
+        for block in self._blocks:
+            n = len(block.keys)
+            if start >= n:
+                start -= n
+                if stop is not None:
+                    stop -= n
+                continue
+            out.extend(block.values[start:stop])
+            if stop is not None:
+                stop -= n
+                if stop <= 0:
+                    break
+            start = 0
+        return out
+
+def iter_json_array(path: str, chunk_size: int = 1 << 20) -> Iterator[Tuple[object, int, int]]:
+    # Yields (element, start, end) for each element of a top-level JSON array,
+    # with start/end the element's byte offsets in the file. Only one element's
+    # text is held at a time. Each element is buffered up to the previous one's
+    # size before parsing, and reads grow geometrically while it still spans
+    # chunks, so large elements parse in close to linear time. Byte offsets
+    # are counted as the text is consumed: buf[:mark] ends at byte offset
+    # marked, so each character is encoded once.
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    with open(path, 'rb') as f:
+        buf, pos, mark, marked, eof = '', 0, 0, 0, False
+        read_size = expect = chunk_size
+
+        def advance(to: int) -> int:
+            nonlocal mark, marked
+            marked += len(buf[mark:to].encode('utf-8'))
+            mark = to
+            return marked
+
+        def refill() -> None:
+            nonlocal buf, pos, mark, eof
+            advance(pos)
+            buf, pos, mark = buf[pos:], 0, 0
+            data = f.read(read_size)
+            eof = not data
+            buf += utf8.decode(data, final=eof)
+
+        def peek(skip: str) -> str:
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in skip:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos:pos + 1]
+                refill()
+
+        if peek(' \t\r\n') != '[':
+            raise json.JSONDecodeError('Expected a JSON array', buf, pos)
+        pos += 1
+        while True:
+            c = peek(' \t\r\n,')
+            if c == ']':
+                return
+            if not c:
+                raise json.JSONDecodeError('Unterminated array', buf, pos)
+            while len(buf) - pos < expect and not eof:
+                refill()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    refill()
+                    read_size *= 2
+            expect = read_size = max(chunk_size, end - pos)
+            start = advance(pos)
+            yield value, start, advance(end)
+            pos = end
+
+def write_json_array(f, items: Iterable, indent: Optional[int] = 2) -> List[Tuple[int, int]]:
+    # Writes items from an iterable as a JSON array to a binary file, one
+    # element at a time, and returns each element's byte span in the output.
+    # indent=None writes compact JSON.
+    spans = []
+    offset = 0
+    pad = '\n' + ' ' * indent if indent is not None else ''
+    for i, item in enumerate(items):
+        if indent is None:
+            text = json.dumps(item, separators=(',', ':'))
+        else:
+            text = json.dumps(item, indent=indent).replace('\n', pad)
+        head = ('[' if i == 0 else ',') + pad
+        body = text.encode('utf-8')
+        f.write(head.encode('utf-8'))
+        f.write(body)
+        offset += len(head)
+        spans.append((offset, offset + len(body)))
+        offset += len(body)
+    f.write(b'[]' if not spans else ('\n]' if indent is not None else ']').encode('utf-8'))
+    return spans
 
 class Set:
-    def __init__(self, weight: float, reps: int, set_id: str = None):
+    # Heavy users log 100k+ sets; no per-instance __dict__ (see
+    # `python benchmark.py set_memory`).
+    __slots__ = ('set_id', 'weight', 'reps', 'timestamp', 'session_id')
+
+    def __init__(self, weight: float, reps: int, set_id: str = None,
+                 timestamp: Optional[float] = None, session_id: Optional[str] = None):
         self.set_id = set_id if set_id else str(uuid.uuid4())
         self.weight = weight
         self.reps = reps
+        # Seconds since the epoch; None for sets logged before timestamps existed.
+        self.timestamp = timestamp
+        self.session_id = session_id
 
     def to_dict(self):
         return {
             'id': self.set_id,
             'weight': self.weight,
-            'reps': self.reps
+            'reps': self.reps,
+            'timestamp': self.timestamp,
+            'session_id': self.session_id
         }
     
     @classmethod
     def from_dict(cls, data):
-        return cls(weight=data['weight'], reps=data['reps'], set_id=data['id'])
+        return cls(weight=data['weight'], reps=data['reps'], set_id=data['id'],
+                   timestamp=data.get('timestamp'), session_id=data.get('session_id'))
+
+class _TimeIndex:
+    # Timestamped sets sorted by time, ties in insertion order, kept in blocks
+    # of at most 2 * BLOCK with their timestamps alongside for bisect. Adding
+    # or removing a set anywhere costs one block rather than the history.
+    BLOCK = 512
+
+    def __init__(self, sets: Iterable[Set] = ()):
+        ordered = sorted(sets, key=lambda s: s.timestamp)
+        self._sets = [ordered[i:i + self.BLOCK] for i in range(0, len(ordered), self.BLOCK)]
+        self._times = [[s.timestamp for s in block] for block in self._sets]
+        self._firsts = [times[0] for times in self._times]
+        self._len = len(ordered)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, s: Set) -> None:
+        t = s.timestamp
+        if not self._sets:
+            self._sets, self._times, self._firsts = [[s]], [[t]], [t]
+            self._len = 1
+            return
+        j = max(bisect_right(self._firsts, t) - 1, 0)
+        times = self._times[j]
+        i = bisect_right(times, t)
+        times.insert(i, t)
+        self._sets[j].insert(i, s)
+        self._firsts[j] = times[0]
+        self._len += 1
+        if len(times) > 2 * self.BLOCK:
+            half = len(times) // 2
+            self._sets.insert(j + 1, self._sets[j][half:])
+            self._times.insert(j + 1, times[half:])
+            self._firsts.insert(j + 1, times[half])
+            del self._sets[j][half:], times[half:]
+
+    def remove(self, s: Set) -> None:
+        t = s.timestamp
+        j = max(bisect_left(self._firsts, t) - 1, 0)
+        while j < len(self._sets) and self._firsts[j] <= t:
+            times, block = self._times[j], self._sets[j]
+            for i in range(bisect_left(times, t), bisect_right(times, t)):
+                if block[i] is s:
+                    del times[i], block[i]
+                    self._len -= 1
+                    if times:
+                        self._firsts[j] = times[0]
+                    else:
+                        del self._sets[j], self._times[j], self._firsts[j]
+                    return
+            j += 1
+
+    def between(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Set]:
+        # Sets with start <= timestamp < end, oldest first.
+        j = 0 if start is None else max(bisect_left(self._firsts, start) - 1, 0)
+        i = 0 if start is None or j >= len(self._times) else bisect_left(self._times[j], start)
+        while j < len(self._sets):
+            times, block = self._times[j], self._sets[j]
+            stop = len(times) if end is None else bisect_left(times, end, i)
+            yield from block[i:stop]
+            if stop < len(times):
+                return
+            j, i = j + 1, 0
+
+    def last(self) -> Optional[Set]:
+        return self._sets[-1][-1] if self._sets else None
+
+    def around(self, t: float) -> Tuple[Optional[Set], Optional[Set]]:
+        # The latest set at or before t and the earliest one after it.
+        j = bisect_right(self._firsts, t) - 1
+        if j < 0:
+            return None, self._sets[0][0] if self._sets else None
+        block = self._sets[j]
+        i = bisect_right(self._times[j], t)
+        if i < len(block):
+            return block[i - 1], block[i]
+        return block[i - 1], self._sets[j + 1][0] if j + 1 < len(self._sets) else None
+
+    def newest_first(self) -> Iterator[Set]:
+        return chain.from_iterable(reversed(block) for block in reversed(self._sets))
 
 class Exercise:
     def __init__(self, name: str, rep_min: int, rep_max: int, exercise_id: str = None):
@@ -26,42 +378,212 @@ class Exercise:
         self.name = name
         self.rep_min = rep_min
         self.rep_max = rep_max
-        self.sets: List[Set] = []
+        # Insertion-ordered id -> Set store: O(1) lookup, removal and
+        # restoring a removed set in place cost one block.
+        self._sets: _OrderedMap = _OrderedMap()
+        # Bumped by every change other than an append, so derived data built
+        # from the history knows when it can extend instead of rebuilding.
+        self.rewrites = 0
+        # Running aggregates kept in step with every mutation. The best set is
+        # a max-heap on weight x reps with lazy deletion: entries for removed or
+        # edited sets are discarded when they surface.
+        self.total_volume = 0.0
+        self._best: list = []
+        self._order = 0
+        # Timestamped sets sorted by time. Untimed sets only appear in
+        # insertion order.
+        self._timeline = _TimeIndex()
+
+    @property
+    def sets(self) -> Tuple[Set, ...]:
+        # A read-only copy: change the history through add_set, edit_set,
+        # remove_set or by assigning a whole new list here.
+        return tuple(self._sets.values())
+
+    @sets.setter
+    def sets(self, sets: Iterable[Set]) -> None:
+        self._sets = _OrderedMap((s.set_id, s) for s in sets)
+        self.rewrites += 1
+        self._rebuild_aggregates()
+        self._rebuild_time_index()
+
+    def _rebuild_aggregates(self) -> None:
+        self.total_volume = 0.0
+        self._best = []
+        self._order = 0
+        for s in self._sets.values():
+            self.total_volume += s.weight * s.reps
+            self._best.append(self._best_entry(s))
+        heapq.heapify(self._best)
+
+    def _rebuild_time_index(self) -> None:
+        self._timeline = _TimeIndex(s for s in self._sets.values() if s.timestamp is not None)
+
+    def _index_time(self, s: Set) -> None:
+        if s.timestamp is not None:
+            self._timeline.add(s)
+
+    def _unindex_time(self, s: Set) -> None:
+        if s.timestamp is not None:
+            self._timeline.remove(s)
+
+    def _best_entry(self, s: Set) -> tuple:
+        # Ties go to the earliest set, which is the one that set the record.
+        self._order += 1
+        return (-s.weight * s.reps, self._order, s.set_id, s.weight, s.reps)
+
+    def _push_best(self, s: Set) -> None:
+        heapq.heappush(self._best, self._best_entry(s))
+        if len(self._best) > 2 * len(self._sets) + 64:
+            self._rebuild_aggregates()
+
+    def best_set(self) -> Optional[Set]:
+        while self._best:
+            _, _, set_id, weight, reps = self._best[0]
+            s = self._sets.get(set_id)
+            if s is not None and s.weight == weight and s.reps == reps:
+                return s
+            heapq.heappop(self._best)
+        return None
 
     def update_rep_range(self, rep_min: int, rep_max: int):
         self.rep_min = rep_min
         self.rep_max = rep_max
 
-    def add_set(self, weight: float, reps: int) -> str:
+    def add_set(self, weight: float, reps: int, set_id: str = None,
+                timestamp: Optional[float] = None, session_id: Optional[str] = None) -> str:
         if weight < 0 or reps < 0:
             raise ValueError("Weight and reps must be non-negative.")
-        new_set = Set(weight=weight, reps=reps)
-        self.sets.append(new_set)
+        new_set = Set(weight=weight, reps=reps, set_id=set_id, timestamp=timestamp, session_id=session_id)
+        self._sets[new_set.set_id] = new_set
+        self.total_volume += weight * reps
+        self._push_best(new_set)
+        self._index_time(new_set)
         return new_set.set_id
 
+    def has_set(self, set_id: str) -> bool:
+        return set_id in self._sets
+
+    def get_set(self, set_id: str) -> Set:
+        s = self._sets.get(set_id)
+        if s is None:
+            raise KeyError('Set not found')
+        return s
+
+    def set_before(self, set_id: str) -> Optional[str]:
+        # Id of the set logged just before set_id, None for the first.
+        return self._sets.before(set_id)
+
+    def insert_set(self, s: Set, after: Optional[str]) -> None:
+        self._sets.insert_after(after, s.set_id, s)
+        self.rewrites += 1
+        self.total_volume += s.weight * s.reps
+        self._push_best(s)
+        self._index_time(s)
+
     def edit_set(self, set_id: str, weight: float, reps: int) -> None:
         if weight < 0 or reps < 0:
             raise ValueError("Weight and reps must be non-negative.")
-        for s in self.sets:
-            if s.set_id == set_id:
-                s.weight = weight
-                s.reps = reps
-                return
-        raise KeyError('Set not found')
+        s = self._sets.get(set_id)
+        if s is None:
+            raise KeyError('Set not found')
+        self.total_volume += weight * reps - s.weight * s.reps
+        s.weight = weight
+        s.reps = reps
+        self.rewrites += 1
+        self._push_best(s)
 
     def remove_set(self, set_id: str) -> None:
-        for i, s in enumerate(self.sets):
-            if s.set_id == set_id:
-                del self.sets[i]
-                return
-        raise KeyError('Set not found')
+        s = self._sets.pop(set_id, None)
+        if s is None:
+            raise KeyError('Set not found')
+        self.total_volume -= s.weight * s.reps
+        self.rewrites += 1
+        self._unindex_time(s)
+
+    def list_sets(self, offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+        if offset == 0 and limit is None:
+            return [s.to_dict() for s in self._sets.values()]
+        stop = None if limit is None else offset + limit
+        return [s.to_dict() for s in self._sets.slice(offset, stop)]
+
+    def recent_sets(self, limit: int, skip: int = 0) -> List[Set]:
+        # Walks from the newest end, so cost depends on skip + limit only.
+        newest_first = list(islice(reversed(self._sets.values()), skip, skip + limit))
+        newest_first.reverse()
+        return newest_first
+
+    def count_sets(self) -> int:
+        return len(self._sets)
+
+    def sets_view(self) -> Collection[Set]:
+        # The live sets in order, without copying; hold the program lock
+        # while using it.
+        return self._sets.values()
 
-    def list_sets(self) -> List[dict]:
-        return [s.to_dict() for s in self.sets]
+    def sets_between(self, start: float, end: float) -> List[Set]:
+        # Timestamped sets with start <= timestamp < end, oldest first.
+        return list(self._timeline.between(start, end))
+
+    def last_timed_set(self) -> Optional[Set]:
+        return self._timeline.last()
+
+    def timed_around(self, timestamp: float) -> Tuple[Optional[Set], Optional[Set]]:
+        return self._timeline.around(timestamp)
+
+    def last_session(self) -> List[Set]:
+        newest = self._timeline.newest_first()
+        latest = next(newest, None)
+        if latest is None:
+            return []
+        session = [latest]
+        if latest.session_id is not None:
+            for s in newest:
+                if s.session_id != latest.session_id:
+                    break
+                session.append(s)
+        session.reverse()
+        return session
+
+    def last_session_summary(self) -> Optional[dict]:
+        sets = self.last_session()
+        if not sets:
+            return None
+        return {
+            'session_id': sets[0].session_id,
+            'started': sets[0].timestamp,
+            'ended': sets[-1].timestamp,
+            'set_count': len(sets),
+            'volume': sum(s.weight * s.reps for s in sets),
+            'top_weight': max(s.weight for s in sets),
+            'all_hit_rep_max': all(s.reps >= self.rep_max for s in sets)
+        }
+
+    def rollup(self, bucket: float, start: Optional[float] = None, end: Optional[float] = None) -> List[dict]:
+        # One row per bucket of `bucket` seconds that has sets in [start, end).
+        rows: List[dict] = []
+        for s in self._timeline.between(start, end):
+            bucket_start = s.timestamp // bucket * bucket
+            if not rows or rows[-1]['start'] != bucket_start:
+                rows.append({'start': bucket_start, 'set_count': 0, 'volume': 0.0, 'top_weight': 0.0})
+            row = rows[-1]
+            row['set_count'] += 1
+            row['volume'] += s.weight * s.reps
+            row['top_weight'] = max(row['top_weight'], s.weight)
+        return rows
+
+    def summary(self) -> dict:
+        return {
+            'id': self.exercise_id,
+            'name': self.name,
+            'rep_min': self.rep_min,
+            'rep_max': self.rep_max,
+            'set_count': len(self._sets)
+        }
 
     def get_last_set(self):
-        if self.sets:
-            return self.sets[-1]
+        if self._sets:
+            return next(reversed(self._sets.values()))
         return None
 
     def to_dict(self) -> dict:
@@ -80,18 +602,122 @@ class Exercise:
             ex.sets = [Set.from_dict(s) for s in data['sets']]
         return ex
 
+# Operations that change a program's exercise definitions (what clones share).
+DEFINITION_OPS = frozenset(('add_exercise', 'rename_exercise', 'set_exercise_rep_range', 'remove_exercise',
+                            'restore_exercise'))
+
+def clone_exercise_id(program_id: str, source_exercise_id: str) -> str:
+    # Deterministic, so replaying a clone recreates the same ids.
+    return str(uuid.uuid5(uuid.UUID(program_id), source_exercise_id))
+
 class Program:
-    def __init__(self, name: str, program_id: str = None):
+    def __init__(self, name: str, program_id: str = None,
+                 loader: Optional[Callable[[str], Dict[str, 'Exercise']]] = None):
         self.program_id = program_id if program_id else str(uuid.uuid4())
         self.name = name
-        self.exercises: Dict[str, Exercise] = {}
+        # Guards this program's exercises and sets; Training holds it while mutating.
+        self.lock = threading.RLock()
+        # With a loader the exercises are materialized on first access.
+        self._loader = loader
+        self._exercises: Optional[_OrderedMap] = None if loader else _OrderedMap()
+        # Copy-on-write clone: (source program id, the source's definitions)
+        # until the exercises are first used. Definitions are immutable
+        # tuples, so any number of clones share one.
+        self.template: Optional[Tuple[str, tuple]] = None
+        self._definitions: Optional[tuple] = None
+
+    @property
+    def exercises(self) -> _OrderedMap:
+        if self._exercises is None:
+            with self.lock:
+                if self._exercises is None and self.template is not None:
+                    self._exercises = _OrderedMap((ex.exercise_id, ex) for ex in self.template_exercises())
+                    self.template = None
+                elif self._exercises is None:
+                    self._exercises = self._loader(self.program_id)
+        return self._exercises
+
+    @property
+    def loaded(self) -> bool:
+        return self._exercises is not None
+
+    @property
+    def shared(self) -> bool:
+        return self._exercises is None and self.template is not None
+
+    def share(self, source_id: str, definitions: tuple) -> None:
+        # Becomes a clone of definitions, dropping any exercises of its own.
+        with self.lock:
+            self.template = (source_id, definitions)
+            self._exercises = None
+            self._definitions = None
+
+    def insert_exercise(self, exercise: Exercise, after: Optional[str]) -> None:
+        with self.lock:
+            self.exercises.insert_after(after, exercise.exercise_id, exercise)
+
+    def template_exercises(self) -> List[Exercise]:
+        return [Exercise(name, rep_min, rep_max, exercise_id=clone_exercise_id(self.program_id, source_id))
+                for source_id, name, rep_min, rep_max in self.template[1]]
+
+    def definitions(self) -> tuple:
+        # (exercise_id, name, rep_min, rep_max) per exercise, cached until an
+        # exercise is added, renamed, re-ranged or removed (Training resets it).
+        with self.lock:
+            if self._definitions is None:
+                if self.shared:
+                    exercises = self.template_exercises()
+                else:
+                    exercises = self.exercises.values()
+                self._definitions = tuple((ex.exercise_id, ex.name, ex.rep_min, ex.rep_max) for ex in exercises)
+            return self._definitions
+
+    def has_definitions(self, definitions: tuple) -> bool:
+        return self._definitions is definitions
+
+    def cache_definitions(self, definitions: tuple) -> None:
+        # Seeds definitions() from a stored copy, sparing a lazy load.
+        with self.lock:
+            if self._definitions is None:
+                self._definitions = definitions
+
+    def forget_definitions(self) -> None:
+        self._definitions = None
+
+    def exercise_names(self) -> List[Tuple[str, str]]:
+        # (exercise_id, name) per exercise, without materializing a clone.
+        with self.lock:
+            if self.shared:
+                return [(ex_id, name) for ex_id, name, _, _ in self.definitions()]
+            return [(ex.exercise_id, ex.name) for ex in self.exercises.values()]
+
+    def snapshot_exercises(self) -> List[Exercise]:
+        # What to serialize: an unused clone gets throwaway copies rather than
+        # materializing its own.
+        with self.lock:
+            if self.shared:
+                return self.template_exercises()
+            return list(self.exercises.values())
+
+    def unload(self) -> None:
+        if self._loader is not None:
+            self._exercises = None
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                'id': self.program_id,
+                'name': self.name,
+                'exercise_count': len(self.template[1]) if self.shared else len(self.exercises)
+            }
 
     def to_dict(self) -> dict:
-        return {
-            'id': self.program_id,
-            'name': self.name,
-            'exercises': [ex.to_dict() for ex in self.exercises.values()]
-        }
+        with self.lock:
+            return {
+                'id': self.program_id,
+                'name': self.name,
+                'exercises': [ex.to_dict() for ex in self.snapshot_exercises()]
+            }
 
     @classmethod
     def from_dict(cls, data):
@@ -102,124 +728,2043 @@ class Program:
                 prog.exercises[ex.exercise_id] = ex
         return prog
 
+def _stored_definitions(p_data: dict) -> list:
+    # Program.definitions() of a serialized program.
+    return [[ex['id'], ex['name'], ex['rep_min'], ex['rep_max']] for ex in p_data['exercises']]
+
+def _stored_names(p_data: dict) -> list:
+    # Program.exercise_names() of a serialized program.
+    return [[ex['id'], ex['name']] for ex in p_data['exercises']]
+
+def _referenced(definitions: dict, entries: list) -> dict:
+    # Only clone sources need their definitions in the index.
+    sources = {entry[-1] for entry in entries if entry[-1] is not None}
+    return {pid: defs for pid, defs in definitions.items() if pid in sources}
+
+class StorageBackend(ABC):
+    # Incremental backends persist each mutation record through record();
+    # the others get coalesced full snapshots through save().
+    incremental = False
+    # Backends that can read one exercise's sets (read_exercise, read_sets)
+    # without materializing its program.
+    indexed_reads = False
+
+    @abstractmethod
+    def load(self) -> List[Program]:
+        ...
+
+    @abstractmethod
+    def load_index(self) -> List[Tuple[str, str]]:
+        ...
+
+    @abstractmethod
+    def load_program(self, program_id: str) -> Program:
+        ...
+
+    def clone_sources(self) -> Dict[str, str]:
+        # Programs the last load found stored as unchanged clones, by source
+        # id. Training rebuilds them from their sources before replaying.
+        return {}
+
+    def source_definitions(self, program_id: str) -> Optional[tuple]:
+        # A clone source's definitions as of the last load, if known without
+        # loading it.
+        return None
+
+    def exercise_names(self, program_ids: Iterable[str]) -> Dict[str, List[Tuple[str, str]]]:
+        # (exercise_id, name) per exercise of stored programs, for those known
+        # without loading them.
+        return {}
+
+    # Only called when indexed_reads is set.
+    def read_exercise(self, program_id: str, exercise_id: str) -> Tuple[str, int, int]:
+        raise NotImplementedError
+
+    def read_sets(self, exercise_id: str, offset: int = 0, limit: Optional[int] = None,
+                  newest_first: bool = False) -> List[Set]:
+        raise NotImplementedError
+
+    def release(self, program: Program) -> None:
+        pass
+
+    def replay(self) -> Iterator[dict]:
+        return iter(())
+
+    @abstractmethod
+    def save(self, programs: List[Program]) -> None:
+        ...
+
+    @abstractmethod
+    def record(self, record: dict) -> None:
+        ...
+
+    def record_many(self, records: List[dict]) -> None:
+        for record in records:
+            self.record(record)
+
+    def compact_due(self) -> bool:
+        return False
+
+    def compact(self, snapshot: Callable[[], List[Program]]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+class JsonFileBackend(StorageBackend):
+    def __init__(self, data_file: str = 'workout_data.json', journal: bool = False, compact_every: int = 1000,
+                 indent: Optional[int] = 2):
+        self.data_file = data_file
+        self.journal = journal
+        self.compact_every = compact_every
+        # Snapshot formatting; None writes compact JSON.
+        self.indent = indent
+        self.log_file = data_file + '.log'
+        # Program ids, names and spans of the snapshot, so opening it lazily
+        # does not parse the whole file; trusted only while the snapshot's
+        # size and mtime match.
+        self.index_file = data_file + '.idx'
+        self._log_records = 0
+        self._log_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # Programs that are not materialized (lazy mode): a (start, end) byte
+        # span in the snapshot file, or compact JSON text once released.
+        # _span_lock keeps spans and the file they point into in step.
+        self._raw: Dict[str, Union[Tuple[int, int], str]] = {}
+        self._span_lock = threading.Lock()
+        # Unchanged clones are stored as {'id', 'name', 'clone_of'}. The index
+        # also keeps their sources' definitions, for lazy loads.
+        self._clones: Dict[str, str] = {}
+        self._definitions: Dict[str, tuple] = {}
+        # Unmaterialized programs' (exercise_id, name) pairs, from the index
+        # or taken when released.
+        self._exercise_names: Dict[str, List[Tuple[str, str]]] = {}
+
+    def _read(self) -> Iterator[Tuple[dict, int, int]]:
+        # Streams the snapshot program by program.
+        if not os.path.exists(self.data_file):
+            return
+        try:
+            yield from iter_json_array(self.data_file)
+        except (IOError, ValueError) as e:
+            print(f"Error loading data: {e}")
+
+    def load(self) -> List[Program]:
+        programs = []
+        self._clones = {}
+        self._definitions = {}
+        for p_data, _, _ in self._read():
+            if 'clone_of' in p_data:
+                self._clones[p_data['id']] = p_data['clone_of']
+            programs.append(Program.from_dict(p_data))
+        return programs
+
+    def load_index(self) -> List[Tuple[str, str]]:
+        self._raw = {}
+        self._clones = {}
+        stored = self._read_index()
+        if stored is None:
+            entries, definitions, names = [], {}, {}
+            for p_data, start, end in self._read():
+                entries.append((p_data['id'], p_data['name'], start, end, p_data.get('clone_of')))
+                if 'exercises' in p_data:
+                    definitions[p_data['id']] = _stored_definitions(p_data)
+                    names[p_data['id']] = _stored_names(p_data)
+            definitions = _referenced(definitions, entries)
+            if entries:
+                self._write_index(entries, definitions, names)
+        else:
+            entries, definitions, names = stored
+        self._exercise_names = {pid: [tuple(pair) for pair in pairs] for pid, pairs in names.items()}
+        index = []
+        for program_id, name, start, end, clone_of in entries:
+            self._raw[program_id] = (start, end)
+            if clone_of is not None:
+                self._clones[program_id] = clone_of
+            index.append((program_id, name))
+        self._definitions = {pid: tuple(map(tuple, defs)) for pid, defs in definitions.items()}
+        return index
+
+    def _read_index(self) -> Optional[Tuple[list, dict, dict]]:
+        try:
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+            stat = os.stat(self.data_file)
+            if index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+                return index['programs'], index['definitions'], index['exercises']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _write_index(self, entries: list, definitions: dict, names: dict) -> None:
+        tmp = self.index_file + '.tmp'
+        try:
+            stat = os.stat(self.data_file)
+            with open(tmp, 'w') as f:
+                json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'programs': entries,
+                           'definitions': definitions, 'exercises': names}, f, separators=(',', ':'))
+            os.replace(tmp, self.index_file)
+        except OSError as e:
+            print(f"Error saving index: {e}")
+
+    def _raw_data(self, program_id: str) -> dict:
+        with self._span_lock:
+            raw = self._raw[program_id]
+            if isinstance(raw, str):
+                return json.loads(raw)
+            start, end = raw
+            with open(self.data_file, 'rb') as f:
+                f.seek(start)
+                return json.loads(f.read(end - start))
+
+    def load_program(self, program_id: str) -> Program:
+        if program_id not in self._raw:
+            raise KeyError('Program not found')
+        program = Program.from_dict(self._raw_data(program_id))
+        self._raw.pop(program_id, None)
+        return program
+
+    def clone_sources(self) -> Dict[str, str]:
+        return self._clones
+
+    def source_definitions(self, program_id: str) -> Optional[tuple]:
+        return self._definitions.get(program_id)
+
+    def exercise_names(self, program_ids: Iterable[str]) -> Dict[str, List[Tuple[str, str]]]:
+        return {pid: self._exercise_names[pid] for pid in program_ids if pid in self._exercise_names}
+
+    def release(self, program: Program) -> None:
+        self._exercise_names[program.program_id] = program.exercise_names()
+        self._raw[program.program_id] = json.dumps(program.to_dict(), separators=(',', ':'))
+
+    @property
+    def incremental(self) -> bool:
+        return self.journal
+
+    def _program_data(self, program: Program, used: Dict[str, object], by_id: Dict[str, Program]) -> dict:
+        with program.lock:
+            if program.shared:
+                # Written as a reference while the source still has the
+                # definitions it was cloned from.
+                source_id, definitions = program.template
+                source = by_id.get(source_id)
+                if source is not None and source.has_definitions(definitions):
+                    return {'id': program.program_id, 'name': program.name, 'clone_of': source_id}
+                return program.to_dict()
+            if program.loaded:
+                return program.to_dict()
+            used[program.program_id] = self._raw[program.program_id]
+            data = self._raw_data(program.program_id)
+            # Renames do not need the exercises, so the raw copy may be stale.
+            data['name'] = program.name
+            return data
+
+    def _write_snapshot(self, programs: List[Program]) -> None:
+        # Stream to a temp file and rename so readers never see a torn file.
+        # Programs are serialized one at a time, so memory stays bounded by
+        # the largest program rather than the whole history.
+        tmp = self.data_file + '.tmp'
+        with self._write_lock:
+            used: Dict[str, object] = {}
+            by_id = {p.program_id: p for p in programs}
+            ids = [p.program_id for p in programs]
+            entries = []
+            sources = {p.template[0] for p in programs if p.template is not None}
+            definitions, names = {}, {}
+
+            def program_data():
+                for p in programs:
+                    data = self._program_data(p, used, by_id)
+                    entries.append((data['id'], data['name'], data.get('clone_of')))
+                    if 'exercises' in data:
+                        names[data['id']] = _stored_names(data)
+                        if data['id'] in sources:
+                            definitions[data['id']] = _stored_definitions(data)
+                    yield data
+
+            with open(tmp, 'wb') as f:
+                spans = write_json_array(f, program_data(), self.indent)
+            with self._span_lock:
+                os.replace(tmp, self.data_file)
+                # Unmaterialized programs now point into the new file, unless
+                # they were loaded or released while it was being written.
+                for pid, span in zip(ids, spans):
+                    if pid in used and self._raw.get(pid) is used[pid]:
+                        self._raw[pid] = span
+            entries = [(pid, name, start, end, clone_of)
+                       for (pid, name, clone_of), (start, end) in zip(entries, spans)]
+            self._write_index(entries, _referenced(definitions, entries), names)
+
+    def replay(self) -> Iterator[dict]:
+        # A leftover '.compacting' file means a compaction was interrupted; its
+        # records may or may not be in the snapshot, so replay is idempotent.
+        for path in (self.log_file + '.compacting', self.log_file):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            # Torn final line from a crash mid-append.
+                            continue
+                        if isinstance(record, list):
+                            self._log_records += len(record)
+                            yield from record
+                        else:
+                            self._log_records += 1
+                            yield record
+            except IOError as e:
+                print(f"Error loading journal: {e}")
+
+    def save(self, programs: List[Program]) -> None:
+        try:
+            self._write_snapshot(programs)
+        except IOError as e:
+            print(f"Error saving data: {e}")
+
+    def record(self, record: dict) -> None:
+        self.record_many([record])
+
+    def record_many(self, records: List[dict]) -> None:
+        # Several records go on one line as a JSON array: one encoder call per
+        # batch, and a line torn by a crash loses the batch as a whole.
+        line = json.dumps(records[0] if len(records) == 1 else records, separators=(',', ':')) + '\n'
+        with self._log_lock:
+            try:
+                with open(self.log_file, 'a') as f:
+                    f.write(line)
+            except IOError as e:
+                print(f"Error writing journal: {e}")
+                return
+            self._log_records += len(records)
+
+    def compact_due(self) -> bool:
+        if not self.journal:
+            return self._log_records > 0
+        return bool(self.compact_every) and self._log_records >= self.compact_every
+
+    def compact(self, snapshot: Callable[[], List[Program]]) -> None:
+        # Rotate the log first so new records land in a fresh file, then take
+        # the snapshot. Records racing with the snapshot may end up both in it
+        # and in the new log, which replay tolerates.
+        pending = self.log_file + '.compacting'
+        with self._log_lock:
+            if os.path.exists(self.log_file) and not os.path.exists(pending):
+                os.replace(self.log_file, pending)
+            self._log_records = 0
+        try:
+            self._write_snapshot(snapshot())
+            if os.path.exists(pending):
+                os.remove(pending)
+        except BaseException as e:
+            # The old snapshot stands, so put its log back unless new records
+            # have started one; either way replay still finds it.
+            with self._log_lock:
+                if os.path.exists(pending) and not os.path.exists(self.log_file):
+                    os.replace(pending, self.log_file)
+            if not isinstance(e, IOError):
+                raise
+            print(f"Error compacting data: {e}")
+
+def _uuid_bytes(value: Optional[str]) -> bytes:
+    if value is None:
+        return bytes(16)
+    try:
+        raw = bytes.fromhex(value.replace('-', ''))
+    except ValueError:
+        raw = b''
+    if len(raw) != 16:
+        raise ValueError(f"Not a UUID: {value!r}")
+    return raw
+
+def _uuid_strs(block) -> List[Optional[str]]:
+    # One hex() for the whole block is much cheaper than a UUID per id. The
+    # nil UUID stands for "no id" (sets without a session).
+    h = block.hex()
+    nil = '0' * 32
+    return [None if h[i:i + 32] == nil else
+            f'{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-{h[i + 16:i + 20]}-{h[i + 20:i + 32]}'
+            for i in range(0, len(h), 32)]
+
+def _session_strs(block) -> List[Optional[str]]:
+    # Sessions repeat across consecutive sets; decode each distinct id once and
+    # share the string between sets.
+    seen: Dict[bytes, Optional[str]] = {}
+    block = bytes(block)
+    out = []
+    for i in range(0, len(block), 16):
+        raw = block[i:i + 16]
+        value = seen.get(raw)
+        if value is None:
+            value = seen[raw] = _uuid_strs(raw)[0]
+        out.append(value)
+    return out
+
+def _array_bytes(typecode: str, values) -> bytes:
+    arr = array(typecode, values)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr.tobytes()
+
+def _array_from(typecode: str, block) -> array:
+    arr = array(typecode)
+    arr.frombytes(block)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+class BinaryFileBackend(JsonFileBackend):
+    # Versioned binary snapshot, little-endian:
+    #   header   magic 'WTRN', u16 version, u16 flags
+    #   programs one block per program:
+    #              u32 exercise count, then per exercise: 16-byte id, i32 rep_min,
+    #              i32 rep_max, u32 name length, u32 set count, the UTF-8 name,
+    #              then columns: set ids (16 bytes each), weights (f64),
+    #              reps (i32), timestamps (f64, NaN if unset), session ids
+    #              (16 bytes each, zero if unset)
+    #   index    per program: 16-byte id, u64 offset, u64 length,
+    #              u32 name length, UTF-8 name
+    #   footer   u64 index offset, u32 program count, magic 'WTRN'
+    # The file is memory-mapped: opening it reads only the index, and program
+    # blocks are decoded on demand (lazy mode) or copied verbatim into the next
+    # snapshot while unmaterialized. The journal is the JSON backend's.
+    MAGIC = b'WTRN'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHH')
+    FOOTER = struct.Struct('<QI4s')
+    ENTRY = struct.Struct('<16sQQI')
+    EXERCISE = struct.Struct('<16siiII')
+    COUNT = struct.Struct('<I')
+    # Column bytes per set: id, weight, reps, timestamp, session id.
+    SET_SIZE = 16 + 8 + 4 + 8 + 16
+
+    def __init__(self, data_file: str = 'workout_data.wtrn', journal: bool = False, compact_every: int = 1000):
+        super().__init__(data_file, journal=journal, compact_every=compact_every)
+        self._map: Optional[mmap.mmap] = None
+        self._names: Dict[str, str] = {}
+
+    @classmethod
+    def pack_program(cls, program: Program) -> bytes:
+        with program.lock:
+            exercises = program.snapshot_exercises()
+            parts = [cls.COUNT.pack(len(exercises))]
+            for ex in exercises:
+                sets = ex.sets_view()
+                name = ex.name.encode('utf-8')
+                parts.append(cls.EXERCISE.pack(_uuid_bytes(ex.exercise_id), ex.rep_min, ex.rep_max,
+                                               len(name), len(sets)))
+                parts.append(name)
+                parts.append(b''.join(_uuid_bytes(s.set_id) for s in sets))
+                parts.append(_array_bytes('d', (s.weight for s in sets)))
+                parts.append(_array_bytes('i', (s.reps for s in sets)))
+                parts.append(_array_bytes('d', (math.nan if s.timestamp is None else s.timestamp for s in sets)))
+                parts.append(b''.join(_uuid_bytes(s.session_id) for s in sets))
+            return b''.join(parts)
+
+    @classmethod
+    def unpack_program(cls, block, program_id: str, name: str) -> Program:
+        block = memoryview(block)
+        program = Program(name=name, program_id=program_id)
+        (count,), pos = cls.COUNT.unpack_from(block, 0), cls.COUNT.size
+        for _ in range(count):
+            ex_id, rep_min, rep_max, name_len, n = cls.EXERCISE.unpack_from(block, pos)
+            pos += cls.EXERCISE.size
+            ex_name = bytes(block[pos:pos + name_len]).decode('utf-8')
+            pos += name_len
+            columns = []
+            for width, decode in ((16, _uuid_strs), (8, partial(_array_from, 'd')), (4, partial(_array_from, 'i')),
+                                  (8, partial(_array_from, 'd')), (16, _session_strs)):
+                columns.append(decode(block[pos:pos + width * n]))
+                pos += width * n
+            ex = Exercise(name=ex_name, rep_min=rep_min, rep_max=rep_max, exercise_id=_uuid_strs(ex_id)[0])
+            ex.sets = [Set(weight=w, reps=r, set_id=sid, timestamp=None if ts != ts else ts, session_id=session)
+                       for sid, w, r, ts, session in zip(*columns)]
+            program.exercises[ex.exercise_id] = ex
+        return program
+
+    def _open(self) -> List[Tuple[str, str, int, int]]:
+        # Maps the snapshot and returns its index as (id, name, offset, length).
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if not os.path.exists(self.data_file) or os.path.getsize(self.data_file) == 0:
+            return []
+        with open(self.data_file, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        m = self._map
+        magic, version, _ = self.HEADER.unpack_from(m, 0)
+        if magic != self.MAGIC:
+            raise ValueError('Not a binary workout snapshot')
+        if version > self.VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        index_offset, count, magic = self.FOOTER.unpack_from(m, len(m) - self.FOOTER.size)
+        if magic != self.MAGIC:
+            raise ValueError('Truncated binary workout snapshot')
+        index, pos = [], index_offset
+        for _ in range(count):
+            pid, offset, length, name_len = self.ENTRY.unpack_from(m, pos)
+            pos += self.ENTRY.size
+            index.append((_uuid_strs(pid)[0], m[pos:pos + name_len].decode('utf-8'), offset, length))
+            pos += name_len
+        return index
+
+    def _read_binary_index(self) -> List[Tuple[str, str, int, int]]:
+        try:
+            with self._span_lock:
+                return self._open()
+        except (IOError, ValueError, struct.error) as e:
+            print(f"Error loading data: {e}")
+            return []
+
+    def exercise_names(self, program_ids: Iterable[str]) -> Dict[str, List[Tuple[str, str]]]:
+        # Read off the exercise headers in place, skipping the set columns.
+        names = {}
+        with self._span_lock:
+            for pid in program_ids:
+                raw = self._raw.get(pid)
+                if raw is None:
+                    continue
+                block, pos = (raw, 0) if isinstance(raw, bytes) else (self._map, raw[0])
+                (count,), pos = self.COUNT.unpack_from(block, pos), pos + self.COUNT.size
+                pairs = names[pid] = []
+                for _ in range(count):
+                    ex_id, _, _, name_len, n = self.EXERCISE.unpack_from(block, pos)
+                    pos += self.EXERCISE.size
+                    pairs.append((_uuid_strs(ex_id)[0], bytes(block[pos:pos + name_len]).decode('utf-8')))
+                    pos += name_len + self.SET_SIZE * n
+        return names
+
+    def load(self) -> List[Program]:
+        return [self.unpack_program(self._map[offset:offset + length], pid, name)
+                for pid, name, offset, length in self._read_binary_index()]
+
+    def load_index(self) -> List[Tuple[str, str]]:
+        index = self._read_binary_index()
+        self._raw = {pid: (offset, length) for pid, _, offset, length in index}
+        self._names = {pid: name for pid, name, _, _ in index}
+        return [(pid, name) for pid, name, _, _ in index]
+
+    def _raw_block(self, program_id: str) -> bytes:
+        with self._span_lock:
+            raw = self._raw[program_id]
+            if isinstance(raw, bytes):
+                return raw
+            offset, length = raw
+            return self._map[offset:offset + length]
+
+    def load_program(self, program_id: str) -> Program:
+        if program_id not in self._raw:
+            raise KeyError('Program not found')
+        program = self.unpack_program(self._raw_block(program_id), program_id, self._names.get(program_id, ''))
+        self._raw.pop(program_id, None)
+        return program
+
+    def release(self, program: Program) -> None:
+        self._raw[program.program_id] = self.pack_program(program)
+
+    def _write_snapshot(self, programs: Iterable[Program]) -> None:
+        # Programs are packed one at a time; unmaterialized ones are copied
+        # straight from the current map without decoding.
+        tmp = self.data_file + '.tmp'
+        with self._write_lock:
+            used: Dict[str, object] = {}
+            spans, names, entries = {}, {}, []
+            try:
+                with open(tmp, 'wb') as f:
+                    f.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0))
+                    for p in programs:
+                        with p.lock:
+                            if p.loaded or p.shared:
+                                block = self.pack_program(p)
+                            else:
+                                used[p.program_id] = self._raw[p.program_id]
+                                block = self._raw_block(p.program_id)
+                        spans[p.program_id] = (f.tell(), len(block))
+                        names[p.program_id] = p.name
+                        name = p.name.encode('utf-8')
+                        entries.append(self.ENTRY.pack(_uuid_bytes(p.program_id), f.tell(), len(block), len(name))
+                                       + name)
+                        f.write(block)
+                    index_offset = f.tell()
+                    f.write(b''.join(entries))
+                    f.write(self.FOOTER.pack(index_offset, len(entries), self.MAGIC))
+            except BaseException:
+                # A program that does not pack (e.g. an id that is not a UUID)
+                # must not leave a half-written snapshot behind.
+                os.remove(tmp)
+                raise
+            with self._span_lock:
+                # Unmap before replacing so this also works where open files
+                # cannot be replaced, then point unmaterialized programs at the
+                # new file unless they were loaded or released meanwhile.
+                if self._map is not None:
+                    self._map.close()
+                    self._map = None
+                os.replace(tmp, self.data_file)
+                self._open()
+                self._names = names
+                for pid, raw in used.items():
+                    if self._raw.get(pid) is raw:
+                        self._raw[pid] = spans[pid]
+
+    def close(self) -> None:
+        with self._span_lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+def _snapshot_programs(json_file: str) -> Iterator[Program]:
+    # A JSON snapshot's programs one at a time, with unchanged clones sharing
+    # their source's definitions. Sources normally come first; clones of later
+    # ones wait until the end.
+    definitions: Dict[str, tuple] = {}
+    waiting = []
+    for data, _, _ in iter_json_array(json_file):
+        if 'clone_of' not in data:
+            definitions[data['id']] = tuple(map(tuple, _stored_definitions(data)))
+            yield Program.from_dict(data)
+        elif data['clone_of'] in definitions:
+            yield _stored_clone(data, definitions)
+        else:
+            waiting.append(data)
+    for data in waiting:
+        yield _stored_clone(data, definitions)
+
+def _stored_clone(data: dict, definitions: Dict[str, tuple]) -> Program:
+    program = Program(name=data['name'], program_id=data['id'])
+    if data['clone_of'] in definitions:
+        program.share(data['clone_of'], definitions[data['clone_of']])
+    return program
+
+def json_to_binary(json_file: str, binary_file: str) -> None:
+    # Converts a JSON snapshot (the Program.to_dict layout) one program at a time.
+    backend = BinaryFileBackend(binary_file)
+    backend.save(_snapshot_programs(json_file))
+    backend.close()
+
+def json_to_sqlite(json_file: str, db_file: str) -> None:
+    # Converts a JSON snapshot into a new SQLite store, one program at a time.
+    backend = SqliteBackend(db_file)
+    backend.save(_snapshot_programs(json_file))
+    backend.close()
+
+def binary_to_json(binary_file: str, json_file: str, indent: Optional[int] = 2) -> None:
+    backend = BinaryFileBackend(binary_file)
+    index = backend._read_binary_index()
+    with open(json_file, 'wb') as f:
+        write_json_array(f, (backend.unpack_program(backend._map[offset:offset + length], pid, name).to_dict()
+                             for pid, name, offset, length in index), indent)
+    backend.close()
+
+class SqliteBackend(StorageBackend):
+    incremental = True
+    indexed_reads = True
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS programs (
+            seq INTEGER PRIMARY KEY,
+            id TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS exercises (
+            seq INTEGER PRIMARY KEY,
+            id TEXT UNIQUE NOT NULL,
+            program_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            rep_min INTEGER NOT NULL,
+            rep_max INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS exercises_by_program ON exercises (program_id, seq);
+        CREATE TABLE IF NOT EXISTS sets (
+            seq INTEGER PRIMARY KEY,
+            id TEXT UNIQUE NOT NULL,
+            exercise_id TEXT NOT NULL,
+            weight REAL NOT NULL,
+            reps INTEGER NOT NULL,
+            timestamp REAL,
+            session_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS sets_by_exercise ON sets (exercise_id, seq);
+    """
+
+    def __init__(self, db_file: str = 'workout_data.db'):
+        self.db_file = db_file
+        # Gradio serves handlers from a thread pool; one connection, serialized.
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.executescript(self.SCHEMA)
+        # Databases created before sets carried timestamps lack these columns.
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(sets)')}
+        for column, kind in (('timestamp', 'REAL'), ('session_id', 'TEXT')):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE sets ADD COLUMN {column} {kind}')
+        self.conn.commit()
+        self._lock = threading.RLock()
+
+    def load_index(self) -> List[Tuple[str, str]]:
+        with self._lock:
+            return self.conn.execute('SELECT id, name FROM programs ORDER BY seq').fetchall()
+
+    def load_program(self, program_id: str) -> Program:
+        with self._lock:
+            return self._load_program(program_id)
+
+    def _load_program(self, program_id: str) -> Program:
+        row = self.conn.execute('SELECT name FROM programs WHERE id = ?', (program_id,)).fetchone()
+        if row is None:
+            raise KeyError('Program not found')
+        prog = Program(name=row[0], program_id=program_id)
+        rows = self.conn.execute(
+            'SELECT id, name, rep_min, rep_max FROM exercises WHERE program_id = ? ORDER BY seq', (program_id,))
+        for ex_id, name, rep_min, rep_max in rows.fetchall():
+            ex = Exercise(name=name, rep_min=rep_min, rep_max=rep_max, exercise_id=ex_id)
+            ex.sets = [Set(weight=w, reps=r, set_id=sid, timestamp=ts, session_id=session)
+                       for sid, w, r, ts, session in self.conn.execute(
+                           'SELECT id, weight, reps, timestamp, session_id FROM sets WHERE exercise_id = ? ORDER BY seq',
+                           (ex_id,))]
+            prog.exercises[ex_id] = ex
+        return prog
+
+    def load(self) -> List[Program]:
+        return [self.load_program(pid) for pid, _ in self.load_index()]
+
+    def exercise_names(self, program_ids: Iterable[str]) -> Dict[str, List[Tuple[str, str]]]:
+        wanted = set(program_ids)
+        names: Dict[str, List[Tuple[str, str]]] = {pid: [] for pid in wanted}
+        with self._lock:
+            rows = self.conn.execute('SELECT id, program_id, name FROM exercises ORDER BY seq').fetchall()
+        for ex_id, pid, name in rows:
+            if pid in wanted:
+                names[pid].append((ex_id, name))
+        return names
+
+    def read_exercise(self, program_id: str, exercise_id: str) -> Tuple[str, int, int]:
+        # (name, rep_min, rep_max)
+        with self._lock:
+            row = self.conn.execute('SELECT name, rep_min, rep_max FROM exercises WHERE id = ? AND program_id = ?',
+                                    (exercise_id, program_id)).fetchone()
+        if row is None:
+            raise KeyError('Exercise not found')
+        return row
+
+    def read_sets(self, exercise_id: str, offset: int = 0, limit: Optional[int] = None,
+                  newest_first: bool = False) -> List[Set]:
+        # A range scan of sets_by_exercise: costs offset + limit rows.
+        order = 'DESC' if newest_first else 'ASC'
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT id, weight, reps, timestamp, session_id FROM sets WHERE exercise_id = ? '
+                f'ORDER BY seq {order} LIMIT ? OFFSET ?',
+                (exercise_id, -1 if limit is None else limit, offset)).fetchall()
+        return [Set(weight=w, reps=r, set_id=sid, timestamp=ts, session_id=session)
+                for sid, w, r, ts, session in rows]
+
+    def save(self, programs: List[Program]) -> None:
+        # Replaces the whole database, one program at a time, in a single
+        # transaction. Training persists through record() instead; this is
+        # what json_to_sqlite migrates with.
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM sets')
+            self.conn.execute('DELETE FROM exercises')
+            self.conn.execute('DELETE FROM programs')
+            for p in programs:
+                self.conn.execute('INSERT INTO programs (id, name) VALUES (?, ?)', (p.program_id, p.name))
+                for ex in p.snapshot_exercises():
+                    self.conn.execute(
+                        'INSERT INTO exercises (id, program_id, name, rep_min, rep_max) VALUES (?, ?, ?, ?, ?)',
+                        (ex.exercise_id, p.program_id, ex.name, ex.rep_min, ex.rep_max))
+                    self.conn.executemany(
+                        'INSERT INTO sets (id, exercise_id, weight, reps, timestamp, session_id) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        [(s.set_id, ex.exercise_id, s.weight, s.reps, s.timestamp, s.session_id)
+                         for s in ex.sets_view()])
+
+    def record(self, record: dict) -> None:
+        self.record_many([record])
+
+    def record_many(self, records: List[dict]) -> None:
+        with self._lock, self.conn:
+            for record in records:
+                self._write(record)
+
+    def _write(self, record: dict) -> None:
+        op = record['op']
+        execute = self.conn.execute
+        if op == 'create_program':
+            execute('INSERT OR IGNORE INTO programs (id, name) VALUES (?, ?)', (record['program_id'], record['name']))
+        elif op == 'clone_program':
+            program_id = record['program_id']
+            execute('INSERT OR IGNORE INTO programs (id, name) VALUES (?, ?)', (program_id, record['name']))
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO exercises (id, program_id, name, rep_min, rep_max) VALUES (?, ?, ?, ?, ?)',
+                [(clone_exercise_id(program_id, ex_id), program_id, name, rep_min, rep_max)
+                 for ex_id, name, rep_min, rep_max in execute(
+                     'SELECT id, name, rep_min, rep_max FROM exercises WHERE program_id = ? ORDER BY seq',
+                     (record['source_id'],)).fetchall()])
+        elif op == 'rename_program':
+            execute('UPDATE programs SET name = ? WHERE id = ?', (record['name'], record['program_id']))
+        elif op == 'delete_program':
+            execute('DELETE FROM sets WHERE exercise_id IN (SELECT id FROM exercises WHERE program_id = ?)',
+                    (record['program_id'],))
+            execute('DELETE FROM exercises WHERE program_id = ?', (record['program_id'],))
+            execute('DELETE FROM programs WHERE id = ?', (record['program_id'],))
+        elif op == 'add_exercise':
+            execute('INSERT OR IGNORE INTO exercises (id, program_id, name, rep_min, rep_max) VALUES (?, ?, ?, ?, ?)',
+                    (record['exercise_id'], record['program_id'], record['name'], record['rep_min'], record['rep_max']))
+        elif op == 'rename_exercise':
+            execute('UPDATE exercises SET name = ? WHERE id = ?', (record['name'], record['exercise_id']))
+        elif op == 'set_exercise_rep_range':
+            execute('UPDATE exercises SET rep_min = ?, rep_max = ? WHERE id = ?',
+                    (record['rep_min'], record['rep_max'], record['exercise_id']))
+        elif op == 'remove_exercise':
+            execute('DELETE FROM sets WHERE exercise_id = ?', (record['exercise_id'],))
+            execute('DELETE FROM exercises WHERE id = ?', (record['exercise_id'],))
+        elif op == 'add_set':
+            execute('INSERT OR IGNORE INTO sets (id, exercise_id, weight, reps, timestamp, session_id) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (record['set_id'], record['exercise_id'], record['weight'], record['reps'],
+                     record.get('timestamp'), record.get('session_id')))
+        elif op == 'edit_set':
+            execute('UPDATE sets SET weight = ?, reps = ? WHERE id = ?',
+                    (record['weight'], record['reps'], record['set_id']))
+        elif op == 'remove_set':
+            execute('DELETE FROM sets WHERE id = ?', (record['set_id'],))
+        elif op == 'restore_program':
+            p = record['program']
+            if execute('SELECT 1 FROM programs WHERE id = ?', (p['id'],)).fetchone() is None:
+                later = self._cut('programs', 'id, name', None, None, record['after'])
+                execute('INSERT INTO programs (id, name) VALUES (?, ?)', (p['id'], p['name']))
+                self.conn.executemany('INSERT INTO programs (id, name) VALUES (?, ?)', later)
+                for ex in p['exercises']:
+                    self._insert_exercise(p['id'], ex)
+        elif op == 'restore_exercise':
+            ex = record['exercise']
+            if execute('SELECT 1 FROM exercises WHERE id = ?', (ex['id'],)).fetchone() is None:
+                later = self._cut('exercises', 'id, program_id, name, rep_min, rep_max', 'program_id',
+                                  record['program_id'], record['after'])
+                self._insert_exercise(record['program_id'], ex)
+                self.conn.executemany(
+                    'INSERT INTO exercises (id, program_id, name, rep_min, rep_max) VALUES (?, ?, ?, ?, ?)', later)
+        elif op == 'restore_set':
+            s = record['set']
+            if execute('SELECT 1 FROM sets WHERE id = ?', (s['id'],)).fetchone() is None:
+                later = self._cut('sets', 'id, exercise_id, weight, reps, timestamp, session_id', 'exercise_id',
+                                  record['exercise_id'], record['after'])
+                self.conn.executemany('INSERT INTO sets (id, exercise_id, weight, reps, timestamp, session_id) '
+                                      'VALUES (?, ?, ?, ?, ?, ?)',
+                                      [(s['id'], record['exercise_id'], s['weight'], s['reps'], s.get('timestamp'),
+                                        s.get('session_id'))] + later)
+        else:
+            raise ValueError(f"Unknown operation: {op}")
+
+    def _cut(self, table: str, columns: str, key: Optional[str], value, after: Optional[str]) -> List[tuple]:
+        # Order is seq order, so a row restored after the row with id after
+        # goes in once the rows behind that one are taken out; they are
+        # returned to be put back behind it. Costs the rows after it, which
+        # is none when undoing the latest removal.
+        where = f'WHERE {key} = ? AND' if key else 'WHERE'
+        args = (value,) if key else ()
+        seq = -1
+        if after is not None:
+            row = self.conn.execute(f'SELECT seq FROM {table} WHERE id = ?', (after,)).fetchone()
+            seq = row[0] if row is not None else -1
+        rows = self.conn.execute(f'SELECT {columns} FROM {table} {where} seq > ? ORDER BY seq',
+                                 args + (seq,)).fetchall()
+        if rows:
+            self.conn.execute(f'DELETE FROM {table} {where} seq > ?', args + (seq,))
+        return rows
+
+    def _insert_exercise(self, program_id: str, ex: dict) -> None:
+        self.conn.execute('INSERT INTO exercises (id, program_id, name, rep_min, rep_max) VALUES (?, ?, ?, ?, ?)',
+                          (ex['id'], program_id, ex['name'], ex['rep_min'], ex['rep_max']))
+        self.conn.executemany(
+            'INSERT INTO sets (id, exercise_id, weight, reps, timestamp, session_id) VALUES (?, ?, ?, ?, ?, ?)',
+            [(s['id'], ex['id'], s['weight'], s['reps'], s.get('timestamp'), s.get('session_id'))
+             for s in ex['sets']])
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+def _fold_name(name: str) -> str:
+    # Index key: case-insensitive, with runs of whitespace collapsed.
+    return ' '.join(name.casefold().split())
+
+def _trigrams(key: str) -> set:
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+class _NameIndex:
+    # Case-insensitive name -> {id: name}. The distinct keys are kept sorted
+    # for prefix search and split into trigrams for substring search, so both
+    # cost about the number of matches rather than the number of names.
+    def __init__(self):
+        self.ids: Dict[str, Dict[object, str]] = {}
+        # (group, id) idents, e.g. (program_id, exercise_id), by group.
+        self.groups: Dict[object, Dict[tuple, str]] = {}
+        self.keys: List[str] = []
+        self.grams: Dict[str, set] = {}
+        # While building, new keys are appended and sorted once at the end.
+        self.building = True
+
+    def add(self, name: str, ident) -> None:
+        key = _fold_name(name)
+        ids = self.ids.get(key)
+        if ids is None:
+            ids = self.ids[key] = {}
+            if self.building:
+                self.keys.append(key)
+            else:
+                self.keys.insert(bisect_left(self.keys, key), key)
+            for gram in _trigrams(key):
+                self.grams.setdefault(gram, set()).add(key)
+        ids[ident] = name
+        if isinstance(ident, tuple):
+            self.groups.setdefault(ident[0], {})[ident] = name
+
+    def remove(self, name: str, ident) -> None:
+        if isinstance(ident, tuple) and ident[0] in self.groups:
+            group = self.groups[ident[0]]
+            group.pop(ident, None)
+            if not group:
+                del self.groups[ident[0]]
+        key = _fold_name(name)
+        ids = self.ids.get(key)
+        if ids is None or ids.pop(ident, None) is None or ids:
+            return
+        del self.ids[key]
+        if self.building:
+            self.keys.remove(key)
+        else:
+            del self.keys[bisect_left(self.keys, key)]
+        for gram in _trigrams(key):
+            keys = self.grams[gram]
+            keys.discard(key)
+            if not keys:
+                del self.grams[gram]
+
+    def remove_group(self, group) -> None:
+        for ident, name in list(self.groups.get(group, {}).items()):
+            self.remove(name, ident)
+
+    def finish(self) -> None:
+        self.keys.sort()
+        self.building = False
+
+    def lookup(self, name: str) -> Dict[object, str]:
+        return self.ids.get(_fold_name(name), {})
+
+    def prefixed(self, query: str) -> Iterator[str]:
+        # Keys starting with the query, in order.
+        q = _fold_name(query)
+        keys = self.keys
+        i = bisect_left(keys, q)
+        while q and i < len(keys) and keys[i].startswith(q):
+            yield keys[i]
+            i += 1
+
+    def containing(self, query: str) -> Iterator[str]:
+        # Keys containing the query other than those starting with it.
+        # Needs at least one trigram; shorter queries only match prefixes.
+        q = _fold_name(query)
+        if len(q) < 3:
+            return
+        sets = sorted((self.grams.get(g, set()) for g in _trigrams(q)), key=len)
+        candidates = sets[0].intersection(*sets[1:])
+        yield from sorted(k for k in candidates if q in k and not k.startswith(q))
+
+class _Batch:
+    def __init__(self):
+        self.records: List[dict] = []
+        self.inverses: List[dict] = []
+        self.locks: list = []
+        # An undo or redo, which must not become an undo step itself.
+        self.replaying = False
+
+# Payloads of the restore_* records: live objects in memory, dicts on disk.
+_RESTORED = (('program', Program), ('exercise', Exercise), ('set', Set))
+
+def _journal_record(record: dict) -> dict:
+    for key, _ in _RESTORED:
+        value = record.get(key)
+        if value is not None and not isinstance(value, dict):
+            return dict(record, **{key: value.to_dict()})
+    return record
+
+def _restored_record(record: dict) -> dict:
+    for key, cls in _RESTORED:
+        value = record.get(key)
+        if isinstance(value, dict):
+            return dict(record, **{key: cls.from_dict(value)})
+    return record
+
 class Training:
-    def __init__(self, data_file: str = 'workout_data.json'):
-        self.programs: Dict[str, Program] = {}
+    _clock = count(1)
+
+    def __init__(self, data_file: str = 'workout_data.json', journal: bool = False, compact_every: int = 1000,
+                 backend: Optional[StorageBackend] = None, lazy: bool = False,
+                 max_loaded_programs: Optional[int] = None, autosave_delay: Optional[float] = None,
+                 autosave_every: Optional[int] = None, indent: Optional[int] = 2, background: bool = False,
+                 undo_limit: int = 0):
+        self.programs: _OrderedMap = _OrderedMap()
         self.data_file = data_file
+        if backend is None:
+            backend = JsonFileBackend(data_file, journal=journal, compact_every=compact_every, indent=indent)
+        self.backend = backend
+        self.lazy = lazy
+        self.max_loaded_programs = max_loaded_programs
+        # Materialized programs in least- to most-recently used order (lazy mode).
+        self._loaded: 'OrderedDict[str, None]' = OrderedDict()
+        # Guards the programs dict and the LRU; per-program state is guarded by
+        # Program.lock so unrelated programs can be mutated in parallel.
+        self._lock = threading.RLock()
+        self._compactor: Optional[threading.Thread] = None
+        # Full-snapshot saves are coalesced: a save covers every mutation that
+        # finished before it started, and concurrent callers wait on it.
+        self._save_cond = threading.Condition()
+        self._saving = False
+        self._dirty_gen = 0
+        self._saved_gen = 0
+        # Autosave debounce: outside a batch, records queue up in _pending until
+        # autosave_every of them accumulate or autosave_delay seconds pass.
+        self.autosave_delay = autosave_delay
+        self.autosave_every = autosave_every
+        self._pending: List[dict] = []
+        self._pending_lock = threading.Lock()
+        # Records handed to _defer that the backend does not have yet, counted
+        # until _persist returns (flush empties _pending before that).
+        # Eviction waits for it to reach 0.
+        self._in_flight = 0
+        self._flush_lock = threading.Lock()
+        self._autosave_timer: Optional[threading.Timer] = None
+        # Background writes: records queue up in _pending and a writer thread
+        # persists them, so mutations return before any disk I/O. flush() is
+        # the durability barrier. autosave_delay then sets how long the writer
+        # waits to coalesce, and autosave_every caps the queue (callers flush
+        # synchronously past it).
+        self.background = background
+        self._writer: Optional[threading.Thread] = None
+        self._writer_wake = threading.Event()
+        self._writer_stop = False
+        self._local = threading.local()
+        # Undo history, off when undo_limit is 0. A step is the inverse records
+        # of one commit or batch, so it holds only what changed (removed
+        # objects are kept by reference). Replaying a step undoes it and yields
+        # the step that redoes it. _history_pos counts the steps currently
+        # applied; snapshots name such positions. _history_lock is a leaf lock.
+        self.undo_limit = undo_limit
+        self._undo: deque = deque()
+        self._redo: List[List[dict]] = []
+        self._history_pos = 0
+        self._snapshots: Dict[str, int] = {}
+        self._history_lock = threading.Lock()
+        # Change stamps for render caches: None is the program list, a program
+        # id covers everything in that program, (program_id, exercise_id) one
+        # exercise. Stamps come from a counter shared by every instance, so they
+        # never repeat even when a store is closed and reopened.
+        self._versions: Dict[object, int] = {}
+        # Stamp taken on opening, the version of anything unchanged since (so
+        # a reopened store never matches caches of the previous instance),
+        # and the stamp of the latest change anywhere.
+        self._opened_version = self._data_version = next(self._clock)
+        # (program_id, exercise_id) -> (stamp, ExerciseSeries, summary)
+        self._analytics: Dict[Tuple[str, str], tuple] = {}
+        # program_id -> (session_id, timestamp) of its most recent timed set.
+        self._sessions: Dict[str, Tuple[Optional[str], float]] = {}
+        # Name indexes (program_id and (program_id, exercise_id) keyed), built
+        # on first use and kept current by _apply. _index_lock is taken last,
+        # after any program lock or self._lock.
+        self._program_index: Optional[_NameIndex] = None
+        self._exercise_index: Optional[_NameIndex] = None
+        self._index_lock = threading.Lock()
+        self._index_build_lock = threading.Lock()
         self._load_data()
 
+    def _snapshot(self) -> List[Program]:
+        with self._lock:
+            return list(self.programs.values())
+
     def _save_data(self):
-        data = [p.to_dict() for p in self.programs.values()]
+        with self._save_cond:
+            self._dirty_gen += 1
+            target = self._dirty_gen
+            while self._saving:
+                self._save_cond.wait()
+            if self._saved_gen >= target:
+                return
+            self._saving = True
+            gen = self._dirty_gen
         try:
-            with open(self.data_file, 'w') as f:
-                json.dump(data, f, indent=2)
-        except IOError as e:
-            print(f"Error saving data: {e}")
+            self.backend.save(self._snapshot())
+        finally:
+            with self._save_cond:
+                self._saving = False
+                self._saved_gen = max(self._saved_gen, gen)
+                self._save_cond.notify_all()
 
     def _load_data(self):
-        if not os.path.exists(self.data_file):
+        if self.lazy:
+            for program_id, name in self.backend.load_index():
+                self.programs[program_id] = Program(name=name, program_id=program_id, loader=self._load_exercises)
+        else:
+            for prog in self.backend.load():
+                self.programs[prog.program_id] = prog
+        # Clones stored by reference share their source's definitions again;
+        # a clone of a clone needs its source resolved first.
+        clones = dict(self.backend.clone_sources())
+
+        def share(program_id: str) -> None:
+            source_id = clones.pop(program_id)
+            if source_id in clones:
+                share(source_id)
+            source = self.programs.get(source_id)
+            definitions = ()
+            if source is not None:
+                # An unloaded source's definitions come from the backend's
+                # index when it has them, and are cached for the next clone.
+                if not (source.loaded or source.shared):
+                    stored = self.backend.source_definitions(source_id)
+                    if stored is not None:
+                        source.cache_definitions(stored)
+                definitions = source.definitions()
+            self.programs[program_id].share(source_id, definitions)
+
+        while clones:
+            share(next(iter(clones)))
+        for record in self.backend.replay():
+            try:
+                self._apply(record)
+            except (KeyError, ValueError):
+                pass
+        if self.backend.compact_due():
+            self.compact()
+
+    def _commit(self, record: dict) -> None:
+        batch = getattr(self._local, 'batch', None)
+        if record['op'] == 'create_program':
+            lock = self._lock
+        elif record['op'] == 'restore_program':
+            lock = record['program'].lock
+        else:
+            # A clone is made under its source's lock.
+            lock = self._get_program_obj(record.get('source_id', record['program_id'])).lock
+            if batch is not None:
+                # Programs touched by a batch stay locked until it ends.
+                lock.acquire()
+                batch.locks.append(lock)
+        with lock:
+            # _apply looks the program up again, so a concurrent delete wins cleanly.
+            inverse = self._apply(record, inverse=batch is not None or self.undo_limit > 0)
+            record = _journal_record(record)
+            if batch is not None:
+                batch.records.append(record)
+                batch.inverses.append(inverse)
+                return
+            if self._debounced:
+                self._defer([record])
+            elif self.backend.incremental:
+                self.backend.record(record)
+            if self.undo_limit:
+                self._remember([inverse])
+        self._after_write()
+
+    @property
+    def _debounced(self) -> bool:
+        return self.background or self.autosave_delay is not None or self.autosave_every is not None
+
+    def _after_write(self) -> None:
+        # Runs with no program locks held: full saves take every program's lock.
+        if self._debounced:
+            self._autosave_check()
+        elif not self.backend.incremental:
+            self._save_data()
+        elif self.backend.compact_due():
+            self._start_compaction()
+
+    def _persist(self, records: List[dict]) -> None:
+        if self.backend.incremental:
+            self.backend.record_many(records)
+            if self.backend.compact_due():
+                self._start_compaction()
+        else:
+            self._save_data()
+
+    def _defer(self, records: List[dict]) -> None:
+        with self._pending_lock:
+            self._pending.extend(records)
+            self._in_flight += len(records)
+            if self.background:
+                self._wake_writer()
+            elif self.autosave_delay is not None and self._autosave_timer is None:
+                self._autosave_timer = threading.Timer(self.autosave_delay, self.flush)
+                self._autosave_timer.daemon = True
+                self._autosave_timer.start()
+
+    def _wake_writer(self) -> None:
+        if self._writer_stop:
+            # Closed: anything queued now waits for an explicit flush().
+            return
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+        self._writer_wake.set()
+
+    def _write_loop(self) -> None:
+        while True:
+            self._writer_wake.wait()
+            if self.autosave_delay and not self._writer_stop:
+                time.sleep(self.autosave_delay)
+            # Cleared before draining, so records queued from here on wake
+            # the next round instead of being missed.
+            self._writer_wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error saving data: {e}")
+            if self._writer_stop:
+                return
+
+    def _autosave_check(self) -> None:
+        if self.autosave_every is not None and len(self._pending) >= self.autosave_every:
+            self.flush()
+
+    def flush(self) -> None:
+        # One flush at a time keeps records reaching the backend in commit order.
+        with self._flush_lock:
+            with self._pending_lock:
+                records, self._pending = self._pending, []
+                if self._autosave_timer is not None:
+                    self._autosave_timer.cancel()
+                    self._autosave_timer = None
+            if records:
+                self._persist(records)
+                with self._pending_lock:
+                    self._in_flight -= len(records)
+
+    @contextmanager
+    def batch(self):
+        # Defers persistence until the outermost batch exits and undoes its
+        # in-memory changes if it raises. Nested batches join the outer one.
+        if getattr(self._local, 'batch', None) is not None:
+            yield
             return
+        batch = _Batch()
+        self._local.batch = batch
         try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-                for p_data in data:
-                    prog = Program.from_dict(p_data)
-                    self.programs[prog.program_id] = prog
-        except (IOError, json.JSONDecodeError) as e:
-            print(f"Error loading data: {e}")
+            yield
+        except BaseException:
+            for inverse in reversed(batch.inverses):
+                self._apply(inverse)
+            raise
+        else:
+            if batch.records and self._debounced:
+                self._defer(batch.records)
+            elif batch.records and self.backend.incremental:
+                # Written before the locks are released to keep per-program order.
+                self.backend.record_many(batch.records)
+            if batch.inverses and self.undo_limit and not batch.replaying:
+                self._remember(batch.inverses)
+        finally:
+            self._local.batch = None
+            for lock in batch.locks:
+                lock.release()
+            if self.lazy:
+                self._evict()
+        if batch.records:
+            self._after_write()
+
+    def _remember(self, inverses: List[dict]) -> None:
+        # A new step: what could be redone (and snapshots there) is gone, and
+        # the oldest steps (and snapshots before them) fall off past the limit.
+        with self._history_lock:
+            self._undo.append(list(inverses))
+            self._redo.clear()
+            self._history_pos += 1
+            while len(self._undo) > self.undo_limit:
+                self._undo.popleft()
+            oldest = self._history_pos - len(self._undo)
+            self._snapshots = {name: pos for name, pos in self._snapshots.items()
+                               if oldest <= pos < self._history_pos}
+
+    def _replay(self, step: List[dict]) -> List[dict]:
+        with self.batch():
+            batch = self._local.batch
+            batch.replaying = True
+            for record in reversed(step):
+                self._commit(record)
+            return list(batch.inverses)
+
+    def _step(self, undo: bool) -> bool:
+        if getattr(self._local, 'batch', None) is not None:
+            raise RuntimeError("Cannot undo or redo inside a batch")
+        source, target = (self._undo, self._redo) if undo else (self._redo, self._undo)
+        with self._history_lock:
+            if not source:
+                return False
+            step = source.pop()
+        try:
+            opposite = self._replay(step)
+        except Exception:
+            # The batch rolled back, so the step still applies as it was.
+            with self._history_lock:
+                source.append(step)
+            raise
+        with self._history_lock:
+            target.append(opposite)
+            self._history_pos += -1 if undo else 1
+        return True
+
+    def undo(self) -> bool:
+        # Reverts the latest change (one call, or one whole batch). False when
+        # there is nothing to undo.
+        return self._step(True)
+
+    def redo(self) -> bool:
+        return self._step(False)
+
+    def history(self) -> dict:
+        with self._history_lock:
+            return {'undo': len(self._undo), 'redo': len(self._redo),
+                    'snapshots': sorted(self._snapshots, key=self._snapshots.get)}
+
+    def snapshot(self, name: str) -> None:
+        # Names the current point in the undo history; restore_snapshot(name)
+        # returns to it while it is still within undo_limit steps and not on a
+        # branch that a later change replaced.
+        if not self.undo_limit:
+            raise ValueError("Undo history is disabled.")
+        with self._history_lock:
+            self._snapshots[name] = self._history_pos
+
+    def restore_snapshot(self, name: str) -> None:
+        # Undoes or redoes the steps in between: the cost is the changes made
+        # since (or until) the snapshot, not the size of the store.
+        with self._history_lock:
+            if name not in self._snapshots:
+                raise KeyError('Snapshot not found')
+            target = self._snapshots[name]
+        while self._history_pos > target and self.undo():
+            pass
+        while self._history_pos < target and self.redo():
+            pass
+
+    def delete_snapshot(self, name: str) -> None:
+        with self._history_lock:
+            if self._snapshots.pop(name, None) is None:
+                raise KeyError('Snapshot not found')
+
+    def _start_compaction(self) -> None:
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self.compact, daemon=True)
+            self._compactor.start()
+
+    def compact(self) -> None:
+        self.backend.compact(self._snapshot)
+
+    def close(self) -> None:
+        with self._pending_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._writer_stop = True
+            self._writer_wake.set()
+            writer.join()
+        self.flush()
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        self.backend.close()
+
+    def _apply(self, record: dict, inverse: bool = False) -> Optional[dict]:
+        # Applies one mutation record. With inverse=True it also returns the
+        # record that undoes it; the restore_* ops only ever appear as inverses
+        # (journaled when undo or redo applies them).
+        op = record['op']
+        undo = None
+        if op.startswith('restore_'):
+            # From the journal, the payload is a dict.
+            record = _restored_record(record)
+        if op == 'create_program':
+            if record['program_id'] not in self.programs:
+                program = Program(name=record['name'], program_id=record['program_id'])
+                if self.lazy:
+                    # Starts loaded and empty, but can still be evicted and reloaded.
+                    program._loader = self._load_exercises
+                self.programs[program.program_id] = program
+                self._reindex(self._program_index, program.program_id, None, program.name)
+            undo = {'op': 'delete_program', 'program_id': record['program_id']}
+        elif op == 'clone_program':
+            if record['program_id'] not in self.programs:
+                source = self._get_program_obj(record['source_id'])
+                program = Program(name=record['name'], program_id=record['program_id'],
+                                  loader=self._load_exercises if self.lazy else None)
+                program.share(source.program_id, source.definitions())
+                with self._lock:
+                    self.programs[program.program_id] = program
+                self._reindex(self._program_index, program.program_id, None, program.name)
+                if self._exercise_index is not None:
+                    for exercise_id, name in program.exercise_names():
+                        self._reindex(self._exercise_index, (program.program_id, exercise_id), None, name)
+            undo = {'op': 'delete_program', 'program_id': record['program_id']}
+        elif op == 'rename_program':
+            program = self._get_program_obj(record['program_id'])
+            undo = {'op': 'rename_program', 'program_id': record['program_id'], 'name': program.name}
+            old_name, program.name = program.name, record['name']
+            self._reindex(self._program_index, program.program_id, old_name, program.name)
+        elif op == 'delete_program':
+            with self._lock:
+                if record['program_id'] not in self.programs:
+                    raise KeyError('Program not found')
+                if inverse:
+                    program = self.programs[record['program_id']]
+                    if self.lazy and not program.loaded and not program.shared:
+                        # The backend drops its copy; the restored program
+                        # must not need it.
+                        program.exercises
+                    undo = {'op': 'restore_program', 'program': program,
+                            'after': self.programs.before(record['program_id'])}
+                program = self.programs.pop(record['program_id'])
+                self._reindex(self._program_index, program.program_id, program.name, None)
+                if self._exercise_index is not None:
+                    with self._index_lock:
+                        self._exercise_index.remove_group(program.program_id)
+                self._loaded.pop(record['program_id'], None)
+                for key in [k for k in self._analytics if k[0] == record['program_id']]:
+                    del self._analytics[key]
+                self._sessions.pop(record['program_id'], None)
+        elif op == 'restore_program':
+            program = record['program']
+            with self._lock:
+                if program.program_id in self.programs:
+                    raise KeyError('Program already exists')
+                if self.lazy and program._loader is None:
+                    program._loader = self._load_exercises
+                self.programs.insert_after(record['after'], program.program_id, program)
+                self._reindex(self._program_index, program.program_id, None, program.name)
+            if self._exercise_index is not None:
+                for exercise_id, name in program.exercise_names():
+                    self._reindex(self._exercise_index, (program.program_id, exercise_id), None, name)
+            undo = {'op': 'delete_program', 'program_id': program.program_id}
+        elif op == 'add_exercise':
+            program = self._get_program_obj(record['program_id'])
+            if record['exercise_id'] not in program.exercises:
+                exercise = Exercise(record['name'], record['rep_min'], record['rep_max'], exercise_id=record['exercise_id'])
+                program.exercises[exercise.exercise_id] = exercise
+                self._reindex(self._exercise_index, (program.program_id, exercise.exercise_id), None, exercise.name)
+            undo = {'op': 'remove_exercise', 'program_id': record['program_id'], 'exercise_id': record['exercise_id']}
+        elif op == 'rename_exercise':
+            exercise = self._get_exercise_obj(record['program_id'], record['exercise_id'])
+            undo = dict(record, name=exercise.name)
+            old_name, exercise.name = exercise.name, record['name']
+            self._reindex(self._exercise_index, (record['program_id'], exercise.exercise_id), old_name, exercise.name)
+        elif op == 'set_exercise_rep_range':
+            exercise = self._get_exercise_obj(record['program_id'], record['exercise_id'])
+            undo = dict(record, rep_min=exercise.rep_min, rep_max=exercise.rep_max)
+            exercise.update_rep_range(record['rep_min'], record['rep_max'])
+        elif op == 'remove_exercise':
+            program = self._get_program_obj(record['program_id'])
+            if record['exercise_id'] not in program.exercises:
+                raise KeyError('Exercise not found')
+            if inverse:
+                undo = {'op': 'restore_exercise', 'program_id': record['program_id'],
+                        'exercise': program.exercises[record['exercise_id']],
+                        'after': program.exercises.before(record['exercise_id'])}
+            exercise = program.exercises.pop(record['exercise_id'])
+            self._reindex(self._exercise_index, (program.program_id, exercise.exercise_id), exercise.name, None)
+            self._analytics.pop((record['program_id'], record['exercise_id']), None)
+        elif op == 'restore_exercise':
+            program = self._get_program_obj(record['program_id'])
+            exercise = record['exercise']
+            if exercise.exercise_id in program.exercises:
+                raise KeyError('Exercise already exists')
+            program.insert_exercise(exercise, record['after'])
+            self._reindex(self._exercise_index, (program.program_id, exercise.exercise_id), None, exercise.name)
+            undo = {'op': 'remove_exercise', 'program_id': record['program_id'], 'exercise_id': exercise.exercise_id}
+        elif op == 'add_set':
+            exercise = self._get_exercise_obj(record['program_id'], record['exercise_id'])
+            if not exercise.has_set(record['set_id']):
+                exercise.add_set(record['weight'], record['reps'], set_id=record['set_id'],
+                                 timestamp=record.get('timestamp'), session_id=record.get('session_id'))
+            if record.get('timestamp') is not None:
+                self._note_session(record['program_id'], record.get('session_id'), record['timestamp'])
+            undo = {'op': 'remove_set', 'program_id': record['program_id'], 'exercise_id': record['exercise_id'],
+                    'set_id': record['set_id']}
+        elif op == 'edit_set':
+            exercise = self._get_exercise_obj(record['program_id'], record['exercise_id'])
+            if inverse:
+                old = exercise.get_set(record['set_id'])
+                undo = dict(record, weight=old.weight, reps=old.reps)
+            exercise.edit_set(record['set_id'], record['weight'], record['reps'])
+        elif op == 'remove_set':
+            exercise = self._get_exercise_obj(record['program_id'], record['exercise_id'])
+            if inverse:
+                undo = {'op': 'restore_set', 'program_id': record['program_id'], 'exercise_id': record['exercise_id'],
+                        'set': exercise.get_set(record['set_id']), 'after': exercise.set_before(record['set_id'])}
+            exercise.remove_set(record['set_id'])
+        elif op == 'restore_set':
+            exercise = self._get_exercise_obj(record['program_id'], record['exercise_id'])
+            if exercise.has_set(record['set'].set_id):
+                raise KeyError('Set already exists')
+            exercise.insert_set(record['set'], record['after'])
+            undo = {'op': 'remove_set', 'program_id': record['program_id'], 'exercise_id': record['exercise_id'],
+                    'set_id': record['set'].set_id}
+        else:
+            raise ValueError(f"Unknown operation: {op}")
+        if op in DEFINITION_OPS:
+            self.programs[record['program_id']].forget_definitions()
+        self._bump(record)
+        return undo
+
+    def _bump(self, record: dict) -> None:
+        stamp = self._data_version = next(self._clock)
+        program_id = record['program_id'] if 'program_id' in record else record['program'].program_id
+        self._versions[program_id] = stamp
+        if 'exercise_id' in record or 'exercise' in record:
+            exercise_id = record['exercise_id'] if 'exercise_id' in record else record['exercise'].exercise_id
+            self._versions[(program_id, exercise_id)] = stamp
+        else:
+            self._versions[None] = stamp
+
+    def _reindex(self, index: Optional[_NameIndex], ident, old_name: Optional[str], new_name: Optional[str]) -> None:
+        if index is None:
+            return
+        with self._index_lock:
+            if old_name is not None:
+                index.remove(old_name, ident)
+            if new_name is not None:
+                index.add(new_name, ident)
+
+    def _name_index(self, attr: str) -> _NameIndex:
+        # The index is published before it is filled, so mutations racing with
+        # the build update it too; add() and remove() are idempotent per id.
+        index = getattr(self, attr)
+        if index is not None and not index.building:
+            return index
+        with self._index_build_lock:
+            index = getattr(self, attr)
+            if index is not None and not index.building:
+                return index
+            index = _NameIndex()
+            with self._index_lock:
+                setattr(self, attr, index)
+            with self._lock:
+                program_ids = list(self.programs)
+                unloaded = [pid for pid, p in self.programs.items() if not p.loaded and not p.shared]
+            if attr == '_exercise_index' and unloaded:
+                # Names of unmaterialized programs come from the backend's
+                # metadata, valid for those unchanged since it was read.
+                read_at = self._data_version
+                stored = self.backend.exercise_names(unloaded)
+            else:
+                stored = {}
+            for program_id in program_ids:
+                if attr == '_program_index':
+                    with self._lock:
+                        program = self.programs.get(program_id)
+                        if program is not None:
+                            with self._index_lock:
+                                index.add(program.name, program_id)
+                    continue
+                program = self.programs.get(program_id)
+                if program is None:
+                    continue
+                with program.lock:
+                    exercises = stored.get(program_id)
+                    if exercises is None or program.loaded or self.version(program_id) > read_at:
+                        try:
+                            # Materializes a lazily loaded program the backend
+                            # could not name (clones use their source's
+                            # definitions instead).
+                            exercises = self._get_program_obj(program_id).exercise_names()
+                        except KeyError:
+                            continue
+                    with self._lock:
+                        if program_id not in self.programs:
+                            continue
+                    with self._index_lock:
+                        for exercise_id, name in exercises:
+                            index.add(name, (program_id, exercise_id))
+            with self._index_lock:
+                index.finish()
+            return index
+
+    def version(self, program_id: Optional[str] = None, exercise_id: Optional[str] = None) -> int:
+        if exercise_id is not None:
+            return self._versions.get((program_id, exercise_id), self._opened_version)
+        return self._versions.get(program_id, self._opened_version)
+
+    def data_version(self) -> int:
+        return self._data_version
+
+    def find_programs(self, name: str) -> list:
+        # Programs with this name, ignoring case and repeated spaces.
+        index = self._name_index('_program_index')
+        with self._index_lock:
+            return [{'id': pid, 'name': n} for pid, n in index.lookup(name).items()]
+
+    def find_exercises(self, name: str, program_id: Optional[str] = None) -> list:
+        # Every program (or only program_id) with an exercise of this name,
+        # ignoring case and repeated spaces.
+        index = self._name_index('_exercise_index')
+        with self._index_lock:
+            named = index.lookup(name)
+            if program_id is None:
+                matches = list(named.items())
+            else:
+                group = index.groups.get(program_id, {})
+                if len(named) < len(group):
+                    matches = [(ident, n) for ident, n in named.items() if ident[0] == program_id]
+                else:
+                    matches = [(ident, n) for ident, n in group.items() if ident in named]
+        return [m for m in (self._exercise_match(ident, n) for ident, n in matches) if m is not None]
+
+    def _exercise_match(self, ident: Tuple[str, str], name: str) -> Optional[dict]:
+        program = self.programs.get(ident[0])
+        if program is None:
+            return None
+        return {'program_id': ident[0], 'program_name': program.name, 'id': ident[1], 'name': name}
+
+    def search(self, query: str, limit: int = 20) -> list:
+        # Programs and exercises whose names start with query, then (for
+        # queries of 3+ characters) those containing it, case-insensitively;
+        # at most limit results, each tagged with its 'type'.
+        results = []
+        indexes = (('program', self._name_index('_program_index')),
+                   ('exercise', self._name_index('_exercise_index')))
+        for mode in ('prefixed', 'containing'):
+            for kind, index in indexes:
+                with self._index_lock:
+                    for key in getattr(index, mode)(query):
+                        for ident, name in index.ids[key].items():
+                            if len(results) >= limit:
+                                return results
+                            if kind == 'program':
+                                match = {'id': ident, 'name': name}
+                            else:
+                                match = self._exercise_match(ident, name)
+                            if match is not None:
+                                match['type'] = kind
+                                results.append(match)
+        return results
 
     def create_program(self, name: str) -> str:
-        program = Program(name=name)
-        self.programs[program.program_id] = program
-        self._save_data()
-        return program.program_id
+        program_id = str(uuid.uuid4())
+        self._commit({'op': 'create_program', 'program_id': program_id, 'name': name})
+        return program_id
+
+    def clone_program(self, program_id: str, name: Optional[str] = None) -> str:
+        # A new program with the same exercises (and no sets), sharing the
+        # source's exercise definitions until either side is used or changed:
+        # constant time however large the source, and stored by reference.
+        source = self._get_program_obj(program_id)
+        clone_id = str(uuid.uuid4())
+        self._commit({'op': 'clone_program', 'program_id': clone_id, 'source_id': program_id,
+                      'name': name if name else f"{source.name} (copy)"})
+        return clone_id
 
     def rename_program(self, program_id: str, new_name: str) -> None:
-        program = self._get_program_obj(program_id)
-        program.name = new_name
-        self._save_data()
+        self._commit({'op': 'rename_program', 'program_id': program_id, 'name': new_name})
 
     def delete_program(self, program_id: str) -> None:
-        if program_id in self.programs:
-            del self.programs[program_id]
-            self._save_data()
-        else:
-            raise KeyError('Program not found')
+        self._commit({'op': 'delete_program', 'program_id': program_id})
 
     def list_programs(self) -> list:
-        return [{'id': pid, 'name': p.name} for pid, p in self.programs.items()]
+        return [{'id': p.program_id, 'name': p.name} for p in self._snapshot()]
 
     def get_program(self, program_id: str) -> dict:
         return self._get_program_obj(program_id).to_dict()
 
+    def get_program_summary(self, program_id: str) -> dict:
+        return self._get_program_obj(program_id).summary()
+
     def add_exercise(self, program_id: str, exercise_name: str, rep_min: int, rep_max: int) -> str:
-        program = self._get_program_obj(program_id)
-        exercise = Exercise(exercise_name, rep_min, rep_max)
-        program.exercises[exercise.exercise_id] = exercise
-        self._save_data()
-        return exercise.exercise_id
+        exercise_id = str(uuid.uuid4())
+        self._commit({'op': 'add_exercise', 'program_id': program_id, 'exercise_id': exercise_id,
+                      'name': exercise_name, 'rep_min': rep_min, 'rep_max': rep_max})
+        return exercise_id
 
     def rename_exercise(self, program_id: str, exercise_id: str, new_name: str) -> None:
-        exercise = self._get_exercise_obj(program_id, exercise_id)
-        exercise.name = new_name
-        self._save_data()
+        self._commit({'op': 'rename_exercise', 'program_id': program_id, 'exercise_id': exercise_id, 'name': new_name})
 
     def set_exercise_rep_range(self, program_id: str, exercise_id: str, rep_min: int, rep_max: int) -> None:
-        exercise = self._get_exercise_obj(program_id, exercise_id)
-        exercise.update_rep_range(rep_min, rep_max)
-        self._save_data()
+        self._commit({'op': 'set_exercise_rep_range', 'program_id': program_id, 'exercise_id': exercise_id,
+                      'rep_min': rep_min, 'rep_max': rep_max})
 
     def remove_exercise(self, program_id: str, exercise_id: str) -> None:
-        program = self._get_program_obj(program_id)
-        if exercise_id in program.exercises:
-            del program.exercises[exercise_id]
-            self._save_data()
-        else:
-            raise KeyError('Exercise not found')
+        self._commit({'op': 'remove_exercise', 'program_id': program_id, 'exercise_id': exercise_id})
 
     def list_exercises(self, program_id: str) -> list:
         program = self._get_program_obj(program_id)
-        return [ex.to_dict() for ex in program.exercises.values()]
-
-    def add_set(self, program_id: str, exercise_id: str, weight: float, reps: int) -> str:
-        exercise = self._get_exercise_obj(program_id, exercise_id)
-        set_id = exercise.add_set(weight, reps)
-        if reps >= exercise.rep_max:
-            pass 
-        self._save_data()
+        with program.lock:
+            return [ex.to_dict() for ex in program.exercises.values()]
+
+    def list_exercise_summaries(self, program_id: str) -> list:
+        program = self._get_program_obj(program_id)
+        with program.lock:
+            return [ex.summary() for ex in program.exercises.values()]
+
+    def get_exercise(self, program_id: str, exercise_id: str) -> dict:
+        return self._get_exercise_obj(program_id, exercise_id).summary()
+
+    def add_set(self, program_id: str, exercise_id: str, weight: float, reps: int,
+                timestamp: Optional[float] = None, session_id: Optional[str] = None) -> str:
+        set_id = str(uuid.uuid4())
+        if timestamp is None:
+            timestamp = time.time()
+        if session_id is None:
+            session_id = self._session_for(program_id, timestamp)
+        self._commit({'op': 'add_set', 'program_id': program_id, 'exercise_id': exercise_id,
+                      'set_id': set_id, 'weight': weight, 'reps': reps,
+                      'timestamp': timestamp, 'session_id': session_id})
         return set_id
 
+    def add_sets(self, sets: Iterable[tuple], batch_size: int = 10_000) -> int:
+        # Bulk add_set for imports. sets yields (program_id, exercise_id, weight,
+        # reps, timestamp, session_id) tuples and is consumed batch_size at a
+        # time, each slice committed as one batch. A timestamp of None stays
+        # None (an untimed set); sessions are assigned as add_set does.
+        sets = iter(sets)
+        added = 0
+        while True:
+            count_before = added
+            with self.batch():
+                for program_id, exercise_id, weight, reps, timestamp, session_id in islice(sets, batch_size):
+                    if session_id is None and timestamp is not None:
+                        session_id = self._session_for(program_id, timestamp)
+                    self._commit({'op': 'add_set', 'program_id': program_id, 'exercise_id': exercise_id,
+                                  'set_id': str(uuid.uuid4()), 'weight': weight, 'reps': reps,
+                                  'timestamp': timestamp, 'session_id': session_id})
+                    added += 1
+            if added == count_before:
+                return added
+
+    def _session_for(self, program_id: str, timestamp: float) -> str:
+        # Join the session of the nearest timed set within SESSION_GAP on either
+        # side, so backfilled and out-of-order sets land in the right session.
+        # Past the program's latest set only that set can be nearest.
+        # Program locks are taken before self._lock, never while holding it.
+        with self._lock:
+            current = self._sessions.get(program_id)
+        if current is not None and timestamp >= current[1]:
+            if current[0] is not None and timestamp - current[1] <= SESSION_GAP:
+                return current[0]
+            return str(uuid.uuid4())
+        program = self._get_program_obj(program_id)
+        latest = nearest = None
+        with program.lock:
+            for ex in program.exercises.values():
+                for s in ex.timed_around(timestamp):
+                    if s is None or s.session_id is None:
+                        continue
+                    gap = abs(s.timestamp - timestamp)
+                    if gap <= SESSION_GAP and (nearest is None or gap < abs(nearest.timestamp - timestamp)):
+                        nearest = s
+                s = ex.last_timed_set()
+                if s is not None and (latest is None or s.timestamp > latest.timestamp):
+                    latest = s
+        if latest is not None:
+            self._note_session(program_id, latest.session_id, latest.timestamp)
+        return nearest.session_id if nearest is not None else str(uuid.uuid4())
+
+    def _note_session(self, program_id: str, session_id: Optional[str], timestamp: float) -> None:
+        with self._lock:
+            current = self._sessions.get(program_id)
+            if current is None or timestamp >= current[1]:
+                self._sessions[program_id] = (session_id, timestamp)
+
     def edit_set(self, program_id: str, exercise_id: str, set_id: str, weight: float, reps: int) -> None:
-        exercise = self._get_exercise_obj(program_id, exercise_id)
-        exercise.edit_set(set_id, weight, reps)
-        self._save_data()
+        self._commit({'op': 'edit_set', 'program_id': program_id, 'exercise_id': exercise_id,
+                      'set_id': set_id, 'weight': weight, 'reps': reps})
 
     def remove_set(self, program_id: str, exercise_id: str, set_id: str) -> None:
-        exercise = self._get_exercise_obj(program_id, exercise_id)
-        exercise.remove_set(set_id)
-        self._save_data()
+        self._commit({'op': 'remove_set', 'program_id': program_id, 'exercise_id': exercise_id, 'set_id': set_id})
 
-    def list_sets(self, program_id: str, exercise_id: str) -> list:
-        exercise = self._get_exercise_obj(program_id, exercise_id)
-        return exercise.list_sets()
+    def _stored(self, program: Program) -> bool:
+        # An unmaterialized program is all in the backend (_touch only evicts
+        # once no records are in flight), so a backend with indexed reads can
+        # serve its sets.
+        # Callers hold program.lock, which materializing takes too.
+        return self.backend.indexed_reads and not program.loaded and not program.shared
+
+    def list_sets(self, program_id: str, exercise_id: str, offset: int = 0, limit: Optional[int] = None) -> list:
+        program = self._get_program_obj(program_id)
+        with program.lock:
+            if self._stored(program):
+                self.backend.read_exercise(program_id, exercise_id)
+                return [s.to_dict() for s in self.backend.read_sets(exercise_id, offset, limit)]
+            return self._get_exercise_obj(program_id, exercise_id).list_sets(offset, limit)
+
+    def iter_sets(self, program_id: str, exercise_id: str, chunk_size: int = 1024) -> Iterator[dict]:
+        # Whole history oldest first, read in chunks under the program lock
+        # without copying it. Each chunk carries on from the same position, so
+        # changes made meanwhile may or may not be seen.
+        program = self._get_program_obj(program_id)
+        done = 0
+        while True:
+            with program.lock:
+                chunk = self._get_exercise_obj(program_id, exercise_id).list_sets(done, chunk_size)
+            if not chunk:
+                return
+            done += len(chunk)
+            yield from chunk
+
+    def get_last_sets(self, program_id: str, exercise_id: str, n: int, skip: int = 0) -> list:
+        program = self._get_program_obj(program_id)
+        with program.lock:
+            if self._stored(program):
+                self.backend.read_exercise(program_id, exercise_id)
+                return [s.to_dict() for s in reversed(self.backend.read_sets(exercise_id, skip, n, newest_first=True))]
+            return [s.to_dict() for s in self._get_exercise_obj(program_id, exercise_id).recent_sets(n, skip)]
+
+    def get_sets_between(self, program_id: str, exercise_id: str, start: float, end: float) -> list:
+        with self._get_program_obj(program_id).lock:
+            return [s.to_dict() for s in self._get_exercise_obj(program_id, exercise_id).sets_between(start, end)]
+
+    def get_last_session(self, program_id: str, exercise_id: str) -> list:
+        with self._get_program_obj(program_id).lock:
+            return [s.to_dict() for s in self._get_exercise_obj(program_id, exercise_id).last_session()]
+
+    def get_rollup(self, program_id: str, exercise_id: str, bucket: float,
+                   start: Optional[float] = None, end: Optional[float] = None) -> list:
+        with self._get_program_obj(program_id).lock:
+            return self._get_exercise_obj(program_id, exercise_id).rollup(bucket, start, end)
 
     def get_suggested_weight(self, program_id: str, exercise_id: str) -> float:
-        exercise = self._get_exercise_obj(program_id, exercise_id)
-        last_set = exercise.get_last_set()
+        program = self._get_program_obj(program_id)
+        with program.lock:
+            if self._stored(program):
+                _, _, rep_max = self.backend.read_exercise(program_id, exercise_id)
+                last_set = next(iter(self.backend.read_sets(exercise_id, 0, 1, newest_first=True)), None)
+            else:
+                exercise = self._get_exercise_obj(program_id, exercise_id)
+                rep_max, last_set = exercise.rep_max, exercise.get_last_set()
         if last_set is None:
             return 0.0
-        if last_set.reps >= exercise.rep_max:
+        if last_set.reps >= rep_max:
             return last_set.weight + 5.0
         else:
             return last_set.weight
 
+    def get_exercise_stats(self, program_id: str, exercise_id: str) -> dict:
+        program = self._get_program_obj(program_id)
+        with program.lock:
+            exercise = self._get_exercise_obj(program_id, exercise_id)
+            best = exercise.best_set()
+            last = exercise.get_last_set()
+            return {
+                'set_count': exercise.count_sets(),
+                'total_volume': exercise.total_volume,
+                'best_set': best.to_dict() if best is not None else None,
+                'last_set': last.to_dict() if last is not None else None,
+                'last_set_is_pr': last is not None and last is best,
+                'last_session': exercise.last_session_summary(),
+            }
+
+    def get_exercise_analytics(self, program_id: str, exercise_id: str, points: int = 100) -> dict:
+        # numpy is only needed once analytics are requested.
+        from analytics import ExerciseSeries
+        program = self._get_program_obj(program_id)
+        with program.lock:
+            exercise = self._get_exercise_obj(program_id, exercise_id)
+            key = (program_id, exercise_id)
+            stamp = (self.version(program_id, exercise_id), points)
+            cached = self._analytics.get(key)
+            if cached is not None and cached[0] == stamp:
+                return cached[2]
+            series = cached[1] if cached is not None else ExerciseSeries()
+            series.sync(exercise)
+            summary = series.summary(exercise.rep_min, exercise.rep_max, points)
+            self._analytics[key] = (stamp, series, summary)
+            return summary
+
+    def get_program_analytics(self, program_id: str, points: int = 100) -> dict:
+        exercises = {}
+        for e in self.list_exercise_summaries(program_id):
+            exercises[e['id']] = dict(self.get_exercise_analytics(program_id, e['id'], points), name=e['name'])
+        return {
+            'exercises': exercises,
+            'total_volume': sum(e['total_volume'] for e in exercises.values()),
+            'personal_record_count': sum(len(e['personal_records']) for e in exercises.values()),
+        }
+
     def _get_program_obj(self, program_id: str) -> Program:
-        if program_id not in self.programs:
+        program = self.programs.get(program_id)
+        if program is None:
             raise KeyError('Program not found')
-        return self.programs[program_id]
+        if self.lazy:
+            self._touch(program_id)
+        return program
+
+    def _load_exercises(self, program_id: str) -> Dict[str, Exercise]:
+        return self.backend.load_program(program_id).exercises
+
+    def _touch(self, program_id: str) -> None:
+        with self._lock:
+            self._loaded[program_id] = None
+            self._loaded.move_to_end(program_id)
+        # A batch holds its programs' locks and has not written its records
+        # yet, so this thread evicts once the batch ends instead.
+        if getattr(self._local, 'batch', None) is None:
+            self._evict()
+
+    def _evict(self) -> None:
+        victims = []
+        with self._lock:
+            # Records in flight may not be in the backend yet, so keep
+            # everything loaded until they are.
+            if self.max_loaded_programs is not None and not self._in_flight:
+                while len(self._loaded) > self.max_loaded_programs:
+                    victim_id, _ = self._loaded.popitem(last=False)
+                    if victim_id in self.programs:
+                        victims.append(self.programs[victim_id])
+        # Callers may already hold another program's lock, so never block on a
+        # victim's lock; a busy program simply stays loaded, first in line for
+        # next time. Commits count their records in flight before releasing
+        # the program lock, so the count is checked again once it is held.
+        kept = []
+        for victim in victims:
+            if not victim.lock.acquire(blocking=False):
+                kept.append(victim)
+                continue
+            try:
+                if self._in_flight:
+                    kept.append(victim)
+                elif victim.loaded:
+                    self.backend.release(victim)
+                    victim.unload()
+            finally:
+                victim.lock.release()
+        if kept:
+            with self._lock:
+                for victim in reversed(kept):
+                    if victim.program_id in self.programs and victim.program_id not in self._loaded:
+                        self._loaded[victim.program_id] = None
+                        self._loaded.move_to_end(victim.program_id, last=False)
 
     def _get_exercise_obj(self, program_id: str, exercise_id: str) -> Exercise:
         program = self._get_program_obj(program_id)
         if exercise_id not in program.exercises:
             raise KeyError('Exercise not found')
-        return program.exercises[exercise_id]
\ No newline at end of file
+        return program.exercises[exercise_id]
+
+class _Tenant:
+    def __init__(self, training: Training):
+        self.training = training
+        self.users = 0
+        self.last_used = time.monotonic()
+
+class TrainingPool:
+    # One Training store per user, each in its own file, with at most max_open
+    # of them loaded. Idle stores (no open session) are closed least recently
+    # used first, or once idle_timeout seconds pass without a session. The
+    # user None maps to default_file, the single-user store, opened with
+    # shared_kwargs over training_kwargs.
+    def __init__(self, data_dir: str = 'user_data', max_open: int = 32, idle_timeout: Optional[float] = None,
+                 default_file: str = 'workout_data.json', shared_kwargs: Optional[dict] = None, **training_kwargs):
+        self.data_dir = data_dir
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.default_file = default_file
+        self.shared_kwargs = shared_kwargs or {}
+        self.training_kwargs = training_kwargs
+        self._open: 'OrderedDict[Optional[str], _Tenant]' = OrderedDict()
+        # Users whose store is being opened or closed; others wait on the
+        # event rather than touching the same file concurrently.
+        self._opening: Dict[Optional[str], threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, user_id: Optional[str]) -> str:
+        if user_id is None:
+            return self.default_file
+        # Hashed so any user id is a safe file name.
+        digest = hashlib.sha256(user_id.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.data_dir, digest + '.json')
+
+    def _open_store(self, user_id: Optional[str]) -> Training:
+        path = self.path_for(user_id)
+        if user_id is None:
+            return Training(data_file=path, **dict(self.training_kwargs, **self.shared_kwargs))
+        os.makedirs(self.data_dir, exist_ok=True)
+        return Training(data_file=path, **self.training_kwargs)
+
+    def _acquire(self, user_id: Optional[str]) -> Training:
+        while True:
+            with self._lock:
+                tenant = self._open.get(user_id)
+                if tenant is not None:
+                    tenant.users += 1
+                    self._open.move_to_end(user_id)
+                    return tenant.training
+                opening = self._opening.get(user_id)
+                if opening is None:
+                    opening = self._opening[user_id] = threading.Event()
+                    break
+            opening.wait()
+        # Loading happens outside the pool lock so other users are not held up.
+        try:
+            training = self._open_store(user_id)
+        finally:
+            with self._lock:
+                del self._opening[user_id]
+            opening.set()
+        with self._lock:
+            tenant = self._open[user_id] = _Tenant(training)
+            tenant.users += 1
+        return training
+
+    def _release(self, user_id: Optional[str]) -> None:
+        with self._lock:
+            tenant = self._open[user_id]
+            tenant.users -= 1
+            tenant.last_used = time.monotonic()
+        self.evict()
+
+    @contextmanager
+    def session(self, user_id: Optional[str]):
+        # The store stays open at least until the session ends.
+        training = self._acquire(user_id)
+        try:
+            yield training
+        finally:
+            self._release(user_id)
+
+    def evict(self) -> None:
+        now = time.monotonic()
+        victims = []
+        with self._lock:
+            excess = len(self._open) - self.max_open
+            for user_id, tenant in list(self._open.items()):
+                if tenant.users:
+                    continue
+                if excess > 0 or (self.idle_timeout is not None and now - tenant.last_used > self.idle_timeout):
+                    del self._open[user_id]
+                    self._opening[user_id] = threading.Event()
+                    victims.append((user_id, tenant.training))
+                    excess -= 1
+        for user_id, training in victims:
+            try:
+                training.close()
+            finally:
+                with self._lock:
+                    self._opening.pop(user_id).set()
+
+    def open_count(self) -> int:
+        return len(self._open)
+
+    def close(self) -> None:
+        with self._lock:
+            tenants = list(self._open.values())
+            self._open.clear()
+        for tenant in tenants:
+            tenant.training.close()
+
+# Spans for the public API, persistence and the copies views are built from;
+# see instrumentation.py. They cost one check per call while switched off.
+instrument(Training, exclude=('batch', 'iter_sets'))
+instrument(Training, ('_save_data', '_persist'))
+_BACKEND_SPANS = ('load', 'load_index', 'load_program', 'replay', 'save', 'record', 'record_many', 'compact')
+for _backend in (JsonFileBackend, BinaryFileBackend, SqliteBackend):
+    instrument(_backend, [n for n in _BACKEND_SPANS if n in vars(_backend)])
+instrument(Program, ('to_dict', 'summary'))
+instrument(Exercise, ('to_dict', 'summary'))
+instrument(TrainingPool, ('_acquire', 'evict'))